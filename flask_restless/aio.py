@@ -0,0 +1,162 @@
+# aio.py - APIs backed by a SQLAlchemy AsyncSession
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Provides :class:`AsyncAPIManager`, which creates APIs whose views are
+coroutine functions using a SQLAlchemy
+:class:`~sqlalchemy.ext.asyncio.AsyncSession`.
+
+The views, the search and the serialization are shared with
+:class:`~flask_restless.APIManager`. Each request runs them with
+:meth:`AsyncSession.run_sync() <sqlalchemy.ext.asyncio.AsyncSession.run_sync>`,
+so every statement they execute is awaited on the asyncio driver of the
+engine. Flask runs each view in an event loop of its own on the thread of
+the worker, which is blocked until the view returns, so this does not let a
+worker serve requests concurrently.
+
+"""
+from functools import wraps
+from weakref import WeakSet
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import async_scoped_session
+from sqlalchemy.orm import Session
+
+from .manager import APIManager
+from .manager import IllegalArgumentError
+
+
+def sync_session_target(session):
+    """Returns the object on which to listen for the events of the
+    synchronous sessions behind `session`, an
+    :class:`~sqlalchemy.ext.asyncio.AsyncSession` or
+    :class:`~sqlalchemy.ext.asyncio.async_scoped_session`, or ``None`` if
+    there is none.
+
+    The synchronous sessions of a registry are instances of the
+    ``sync_session_class`` given to its factory. If that is the plain
+    :class:`~sqlalchemy.orm.Session` class, listening on it would track
+    every session of the application, so ``None`` is returned and the
+    sessions must be tracked one by one.
+
+    """
+    if isinstance(session, AsyncSession):
+        return session.sync_session
+    sync_session_class = session.session_factory.kw.get('sync_session_class', Session)
+    return None if sync_session_class is Session else sync_session_class
+
+
+class SyncSessionProxy:
+    """Forwards attribute access to the synchronous
+    :class:`~sqlalchemy.orm.Session` of the current asynchronous session
+    of an :class:`AsyncAPIManager`.
+
+    The views of the manager hold an instance of this class in place of a
+    session. Its methods that execute statements may only be called
+    within :meth:`AsyncSession.run_sync()
+    <sqlalchemy.ext.asyncio.AsyncSession.run_sync>`.
+
+    """
+
+    def __init__(self, manager):
+        self._manager = manager
+
+    def __getattr__(self, name):
+        return getattr(self._manager.current_session().sync_session, name)
+
+
+class AsyncAPIManager(APIManager):
+    """An :class:`~flask_restless.APIManager` whose views are coroutine
+    functions using a SQLAlchemy
+    :class:`~sqlalchemy.ext.asyncio.AsyncSession`.
+
+    `session` is either an :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    or, so that concurrent requests use separate sessions, an
+    :class:`~sqlalchemy.ext.asyncio.async_scoped_session` scoped to the
+    current task. The scoped session is removed at the end of each
+    request.
+
+    The other arguments are as described in
+    :class:`~flask_restless.APIManager`. Models whose ``query`` attribute
+    is a synchronous query, as with Flask-SQLAlchemy, are not supported.
+
+    The export endpoint (see :ref:`export`) is not supported, since its
+    response is streamed after the view returns, and neither are export
+    jobs (see :ref:`exportjobs`) and snapshots (see :ref:`snapshots`),
+    which are rendered outside of the event loop.
+
+    Flask requires the ``async`` extra (``pip install flask[async]``) in
+    order to call the views. It runs each of them in a new event loop
+    that blocks the thread of the worker, so a worker still serves one
+    request at a time. For more information, see :ref:`async`.
+
+    """
+
+    def __init__(self, app=None, session=None, cache=None, fragment_cache=None, **kw):
+        if session is None:
+            raise ValueError('`session` can not be empty')
+        if kw.get('query_executor') is not None:
+            raise ValueError('`query_executor` can not be used with an asynchronous session')
+        if kw.get('snapshot_store') is not None:
+            raise ValueError('`snapshot_store` can not be used with an asynchronous session')
+
+        #: The asynchronous session given to the constructor.
+        self.async_session = session
+
+        super().__init__(app, session=SyncSessionProxy(self), **kw)
+
+        # The caches listen for the events of the synchronous sessions,
+        # which the proxy given to the superclass cannot provide.
+        self.cache = cache
+        self.fragment_cache = fragment_cache
+        self._trackers = [tracker for tracker in (cache, fragment_cache) if tracker is not None]
+        target = sync_session_target(session)
+        if target is not None:
+            for tracker in self._trackers:
+                tracker.track(target)
+        #: The synchronous sessions tracked one by one, if the factory of
+        #: the scoped session has no session class of its own.
+        self._tracked = WeakSet() if target is None and self._trackers else None
+
+    def create_api_blueprint(self, name, model, *args, allow_export=False, allow_export_jobs=False, **kw):
+        """Creates an API as described in
+        :meth:`~flask_restless.APIManager.create_api_blueprint`, except
+        that `allow_export` and `allow_export_jobs` must be ``False``.
+
+        """
+        if allow_export:
+            raise IllegalArgumentError('`allow_export` can not be used with an asynchronous session')
+        if allow_export_jobs:
+            raise IllegalArgumentError('`allow_export_jobs` can not be used with an asynchronous session')
+        return super().create_api_blueprint(name, model, *args, **kw)
+
+    def current_session(self):
+        """Returns the :class:`~sqlalchemy.ext.asyncio.AsyncSession` for the
+        current task.
+
+        """
+        if isinstance(self.async_session, async_scoped_session):
+            return self.async_session()
+        return self.async_session
+
+    def wrap_view(self, view_func):
+        """Returns a coroutine function that calls `view_func` with the
+        synchronous session of the current asynchronous session.
+
+        """
+        @wraps(view_func)
+        async def async_view(*args, **kw):
+            session = self.current_session()
+            if self._tracked is not None and session.sync_session not in self._tracked:
+                self._tracked.add(session.sync_session)
+                for tracker in self._trackers:
+                    tracker.track(session.sync_session)
+            try:
+                return await session.run_sync(lambda sync_session: view_func(*args, **kw))
+            finally:
+                if isinstance(self.async_session, async_scoped_session):
+                    await self.async_session.remove()
+        return async_view
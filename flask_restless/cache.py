@@ -0,0 +1,1092 @@
+# cache.py - server-side cache of responses to GET requests
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Server-side caches for responses to :http:method:`get` requests.
+
+A :class:`ResponseCache` stores the rendered bytes of whole responses and
+a :class:`FragmentCache` stores the JSON encoding of individual resource
+objects, both in a :class:`CacheBackend`. Each entry records a
+*generation token* for each table whose contents determine it. Whenever a
+session tracked by the cache commits changes to a table, the token of
+that table is replaced by a new random one, so every entry that depends
+on the table stops matching and is recomputed on the next request.
+
+"""
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+from typing import Optional
+
+from flask import current_app
+from flask import has_app_context
+from flask import json
+from sqlalchemy import event
+from sqlalchemy.inspection import inspect as sqlalchemy_inspect
+from sqlalchemy.orm.base import MANYTOONE
+
+from .helpers import get_related_model
+
+try:
+    import fcntl
+except ImportError:
+    # The memory-mapped backend is only available on POSIX systems.
+    fcntl = None  # type: ignore
+
+#: The number of seconds a request may take to recompute a stale entry
+#: before another request is allowed to try.
+REVALIDATE_TIMEOUT = 30
+
+#: The format of the strings that stand for pre-encoded JSON values in the
+#: output of :func:`dumps_document`, before they are replaced.
+PLACEHOLDER = '__restless_fragment_{0}_{1}__'
+
+#: A response read from the cache.
+CachedResponse = namedtuple('CachedResponse', ['status', 'headers', 'body'])
+
+
+class CacheBackend:
+    """Base class for the storage used by the caches in this module.
+
+    Keys are strings and values are :class:`bytes`. If `ttl` is not
+    ``None``, it is the number of seconds after which a value expires.
+    Backends may evict values at any time, for example to bound their
+    memory usage.
+
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value stored under `key`, or ``None`` if there is
+        no such value.
+
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        """Stores `value` under `key`, replacing any existing value."""
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """Stores `value` under `key` unless a value is already stored
+        there, and returns ``True`` if and only if `value` was stored.
+
+        This must be atomic: if several callers add the same key at the
+        same time, only one of them succeeds.
+
+        """
+        raise NotImplementedError
+
+    def get_many(self, keys) -> list:
+        """Returns a list of the values stored under each of `keys`, with
+        ``None`` for the keys that have no value.
+
+        """
+        return [self.get(key) for key in keys]
+
+    def delete(self, key: str):
+        """Removes the value stored under `key`, if any."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes all values."""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Stores values in a dictionary private to the current process.
+
+    `max_bytes` is the total size of the keys and values the backend may
+    hold; when it is exceeded, the least recently used values are evicted.
+
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        #: The total size of the keys and values currently stored.
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _remove(self, key):
+        value, expires = self._entries.pop(key)
+        self.size -= len(key) + len(value)
+
+    def _store(self, key, value, ttl, now):
+        if key in self._entries:
+            self._remove(key)
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, None if ttl is None else now + ttl)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def get(self, key):
+        with self._lock:
+            return self._lookup(key, time.time())
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl, time.time())
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            now = time.time()
+            if self._lookup(key, now) is not None:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class MmapBackend(CacheBackend):
+    """Stores values in a memory-mapped file shared by all the processes on
+    a host that use the same `path`, such as the worker processes of a
+    WSGI server.
+
+    The file holds a hash table of keys and, for each size class in
+    `slot_sizes`, an equal share of `max_bytes` split into fixed-size
+    slots. A value is stored in a slot of the smallest class that fits its
+    key and value; larger values are not stored. When a class is full, a
+    slot is reclaimed with the CLOCK algorithm, which evicts a value that
+    has not been read since the clock hand last passed it.
+
+    Each operation holds an exclusive :func:`fcntl.flock` lock on the file
+    (and a lock shared by the threads of the process), so this backend is
+    only available on POSIX systems. The file is created, or reused if it
+    already exists with the same layout, when the backend is created; it
+    is reopened after a :func:`os.fork` so that the parent and the child
+    processes do not share the lock.
+
+    """
+
+    MAGIC = b'RSTLMMAP'
+    VERSION = 1
+    #: Magic, version, size of the hash table and number of size classes.
+    HEADER = struct.Struct('<8sIII')
+    #: Size and number of slots, position of the clock hand and number of
+    #: slots in use.
+    CLASS = struct.Struct('<IIII')
+    #: Hash of the key, size class plus one (zero for an empty entry) and
+    #: slot.
+    ENTRY = struct.Struct('<QII')
+    #: Hash of the key (zero for an empty slot), expiry time (zero if the
+    #: value does not expire), length of the key, length of the value and
+    #: reference bit.
+    SLOT = struct.Struct('<QdIIB3x')
+    #: The size of the region reserved for the header.
+    HEADER_SIZE = 4096
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024,
+                 slot_sizes=(1024, 16 * 1024, 256 * 1024, 4 * 1024 * 1024)):
+        if fcntl is None:
+            raise RuntimeError('MmapBackend requires the fcntl module')
+        self.path = path
+        self.slot_sizes = sorted(slot_sizes)
+        share = max_bytes // len(self.slot_sizes)
+        self.num_slots = [max(1, share // size) for size in self.slot_sizes]
+        # The hash table is kept at most half full, so that lookups are
+        # short and an empty entry always exists.
+        self.table_size = 1 << (2 * sum(self.num_slots) - 1).bit_length()
+        self._mask = self.table_size - 1
+        self._table_offset = self.HEADER_SIZE
+        offset = self._table_offset + self.table_size * self.ENTRY.size
+        self._class_offsets = []
+        for size, number in zip(self.slot_sizes, self.num_slots):
+            self._class_offsets.append(offset)
+            offset += size * number
+        self.file_size = offset
+        self._lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, self.HEADER.size, 0)
+            if len(header) < self.HEADER.size or header[:len(self.MAGIC)] != self.MAGIC:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.file_size)
+                self._mmap = mmap.mmap(self._fd, self.file_size)
+                self._write_header()
+            else:
+                if os.fstat(self._fd).st_size != self.file_size:
+                    raise ValueError(f'{self.path} is a cache file with a different layout')
+                self._mmap = mmap.mmap(self._fd, self.file_size)
+                if self._mmap[:self.HEADER_SIZE] != self._header_bytes(keep_state=True):
+                    raise ValueError(f'{self.path} is a cache file with a different layout')
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _header_bytes(self, keep_state=False):
+        header = bytearray(self.HEADER_SIZE)
+        self.HEADER.pack_into(header, 0, self.MAGIC, self.VERSION, self.table_size, len(self.slot_sizes))
+        for index, (size, number) in enumerate(zip(self.slot_sizes, self.num_slots)):
+            hand, used = self._class_state(index) if keep_state else (0, 0)
+            self.CLASS.pack_into(header, self.HEADER.size + index * self.CLASS.size, size, number, hand, used)
+        return bytes(header)
+
+    def _write_header(self):
+        self._mmap[:self.HEADER_SIZE] = self._header_bytes()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # A lock taken with flock belongs to the open file
+                # description, which a forked process shares with its parent.
+                self._mmap.close()
+                os.close(self._fd)
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: bytes) -> int:
+        # Zero marks empty entries and slots.
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+    def _class_state(self, index):
+        """Returns the position of the clock hand and the number of slots
+        in use of the size class at `index`.
+
+        """
+        offset = self.HEADER.size + index * self.CLASS.size
+        return self.CLASS.unpack_from(self._mmap, offset)[2:]
+
+    def _set_class_state(self, index, hand, used):
+        offset = self.HEADER.size + index * self.CLASS.size
+        self.CLASS.pack_into(self._mmap, offset, self.slot_sizes[index], self.num_slots[index], hand, used)
+
+    def _entry(self, position):
+        return self.ENTRY.unpack_from(self._mmap, self._table_offset + position * self.ENTRY.size)
+
+    def _set_entry(self, position, key_hash, size_class, slot):
+        self.ENTRY.pack_into(self._mmap, self._table_offset + position * self.ENTRY.size, key_hash, size_class, slot)
+
+    def _slot_offset(self, size_class, slot):
+        return self._class_offsets[size_class - 1] + slot * self.slot_sizes[size_class - 1]
+
+    def _find(self, key):
+        """Returns the position in the hash table, the size class plus one
+        and the slot of `key`, or ``None`` if it is not stored.
+
+        """
+        key_hash = self._hash(key)
+        position = key_hash & self._mask
+        while True:
+            entry_hash, size_class, slot = self._entry(position)
+            if entry_hash == 0:
+                return None
+            if entry_hash == key_hash:
+                offset = self._slot_offset(size_class, slot)
+                slot_hash, expires, key_length, value_length, referenced = self.SLOT.unpack_from(self._mmap, offset)
+                start = offset + self.SLOT.size
+                if slot_hash == key_hash and self._mmap[start:start + key_length] == key:
+                    return position, size_class, slot
+            position = (position + 1) & self._mask
+
+    def _remove_entry(self, position):
+        """Removes the entry at `position` from the hash table, shifting
+        back the entries after it so that no lookup stops early.
+
+        """
+        while True:
+            self._set_entry(position, 0, 0, 0)
+            following = position
+            while True:
+                following = (following + 1) & self._mask
+                entry = self._entry(following)
+                if entry[0] == 0:
+                    return
+                home = entry[0] & self._mask
+                # The entry may move back unless its home lies cyclically
+                # in (position, following].
+                if position <= following:
+                    stays = position < home <= following
+                else:
+                    stays = position < home or home <= following
+                if not stays:
+                    break
+            self._set_entry(position, *entry)
+            position = following
+
+    def _remove(self, position, size_class, slot):
+        self.SLOT.pack_into(self._mmap, self._slot_offset(size_class, slot), 0, 0, 0, 0, 0)
+        self._remove_entry(position)
+        hand, used = self._class_state(size_class - 1)
+        self._set_class_state(size_class - 1, hand, used - 1)
+
+    def _evict(self, size_class, slot):
+        """Removes the value stored in the given slot, if any."""
+        offset = self._slot_offset(size_class, slot)
+        slot_hash = self.SLOT.unpack_from(self._mmap, offset)[0]
+        if slot_hash == 0:
+            return
+        position = slot_hash & self._mask
+        while True:
+            entry = self._entry(position)
+            if entry[0] == 0:
+                return
+            if entry[1:] == (size_class, slot):
+                self._remove(position, size_class, slot)
+                return
+            position = (position + 1) & self._mask
+
+    def _allocate(self, size_class, now):
+        """Returns a free slot of the given size class, evicting a value
+        with the CLOCK algorithm if needed.
+
+        """
+        index = size_class - 1
+        number = self.num_slots[index]
+        hand, used = self._class_state(index)
+        # Free slots are only taken while some remain; otherwise the clock
+        # hand clears the reference bits it passes and stops at the first
+        # value that was not read since the last revolution.
+        evict = used >= number
+        for _ in range(2 * number + 1):
+            slot = hand
+            hand = (hand + 1) % number
+            offset = self._slot_offset(size_class, slot)
+            slot_hash, expires, key_length, value_length, referenced = self.SLOT.unpack_from(self._mmap, offset)
+            if slot_hash == 0 or (expires and expires <= now):
+                break
+            if evict:
+                if not referenced:
+                    break
+                self.SLOT.pack_into(self._mmap, offset, slot_hash, expires, key_length, value_length, 0)
+        self._evict(size_class, slot)
+        used = self._class_state(index)[1]
+        self._set_class_state(index, hand, used + 1)
+        return slot
+
+    def _lookup(self, key, now):
+        found = self._find(key)
+        if found is None:
+            return None
+        position, size_class, slot = found
+        offset = self._slot_offset(size_class, slot)
+        slot_hash, expires, key_length, value_length, referenced = self.SLOT.unpack_from(self._mmap, offset)
+        if expires and expires <= now:
+            self._remove(position, size_class, slot)
+            return None
+        if not referenced:
+            self.SLOT.pack_into(self._mmap, offset, slot_hash, expires, key_length, value_length, 1)
+        start = offset + self.SLOT.size + key_length
+        return self._mmap[start:start + value_length]
+
+    def _store(self, key, value, ttl, now):
+        found = self._find(key)
+        if found is not None:
+            self._remove(*found)
+        size = self.SLOT.size + len(key) + len(value)
+        size_class = next((index + 1 for index, slot_size in enumerate(self.slot_sizes) if size <= slot_size), None)
+        if size_class is None:
+            return
+        slot = self._allocate(size_class, now)
+        key_hash = self._hash(key)
+        offset = self._slot_offset(size_class, slot)
+        expires = 0 if ttl is None else now + ttl
+        self.SLOT.pack_into(self._mmap, offset, key_hash, expires, len(key), len(value), 0)
+        start = offset + self.SLOT.size
+        self._mmap[start:start + len(key)] = key
+        self._mmap[start + len(key):start + len(key) + len(value)] = value
+        position = key_hash & self._mask
+        while self._entry(position)[0] != 0:
+            position = (position + 1) & self._mask
+        self._set_entry(position, key_hash, size_class, slot)
+
+    def get(self, key):
+        with self._locked():
+            return self._lookup(key.encode(), time.time())
+
+    def get_many(self, keys):
+        with self._locked():
+            now = time.time()
+            return [self._lookup(key.encode(), now) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._locked():
+            self._store(key.encode(), value, ttl, time.time())
+
+    def add(self, key, value, ttl=None):
+        with self._locked():
+            now = time.time()
+            key = key.encode()
+            if self._lookup(key, now) is not None:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def delete(self, key):
+        with self._locked():
+            found = self._find(key.encode())
+            if found is not None:
+                self._remove(*found)
+
+    def clear(self):
+        with self._locked():
+            self._write_header()
+            self._mmap[self._table_offset:self._class_offsets[0]] = bytes(self._class_offsets[0] - self._table_offset)
+            for size_class, number in enumerate(self.num_slots, start=1):
+                for slot in range(number):
+                    self.SLOT.pack_into(self._mmap, self._slot_offset(size_class, slot), 0, 0, 0, 0, 0)
+
+    def close(self):
+        """Unmaps and closes the file."""
+        with self._lock:
+            self._mmap.close()
+            os.close(self._fd)
+
+
+def encode_entry(meta: dict, body: bytes) -> bytes:
+    """Returns the bytes that store the JSON-serializable dictionary
+    `meta` and the bytes `body`.
+
+    """
+    return json.dumps(meta).encode() + b'\n' + body
+
+
+def decode_entry(value: bytes):
+    """Returns the pair of dictionary and bytes stored by
+    :func:`encode_entry`.
+
+    """
+    header, body = value.split(b'\n', 1)
+    return json.loads(header), body
+
+
+def mapper_tables(mapper):
+    """Returns the names of the tables to which `mapper` writes."""
+    return {table.name for table in mapper.tables}
+
+
+@lru_cache(maxsize=None)
+def linkage_tables(model) -> frozenset:
+    """Returns the names of the tables that store the linkage of the
+    relationships of `model`, that is, the tables of the related models
+    and the association tables of many-to-many relationships.
+
+    """
+    tables = set()
+    for prop in sqlalchemy_inspect(model).relationships:
+        tables.update(mapper_tables(prop.mapper))
+        if prop.secondary is not None and hasattr(prop.secondary, 'name'):
+            tables.add(prop.secondary.name)
+    return frozenset(tables)
+
+
+@lru_cache(maxsize=None)
+def to_many_linkage_tables(model, names=None) -> frozenset:
+    """Returns the names of the tables that store the linkage of the
+    to-many relationships of `model`, which, unlike the foreign keys of
+    many-to-one relationships, is not stored in the rows of `model`.
+
+    If `names` is a set of relationship names, only these relationships
+    are considered.
+
+    """
+    tables = set()
+    for prop in sqlalchemy_inspect(model).relationships:
+        if prop.direction == MANYTOONE or (names is not None and prop.key not in names):
+            continue
+        tables.update(mapper_tables(prop.mapper))
+        if prop.secondary is not None and hasattr(prop.secondary, 'name'):
+            tables.add(prop.secondary.name)
+    return frozenset(tables)
+
+
+@lru_cache(maxsize=None)
+def model_dependencies(model) -> frozenset:
+    """Returns the names of the tables whose contents determine a resource
+    of `model`, that is, the tables of its own model and the tables that
+    store the linkage of its relationships, as returned by
+    :func:`linkage_tables`.
+
+    """
+    return frozenset(mapper_tables(sqlalchemy_inspect(model)) | linkage_tables(model))
+
+
+def dependencies(model, include=frozenset()) -> frozenset:
+    """Returns the names of the tables whose contents determine a document
+    for `model` that includes the related resources on the paths given in
+    `include`.
+
+    The document depends on the tables returned by
+    :func:`model_dependencies` for `model` and for the model of each
+    included resource. Only those are cached, since `include` comes from
+    the client and may name relationships that do not exist.
+
+    """
+    tables = set(model_dependencies(model))
+    for path in include:
+        related = model
+        for name in path.split('.'):
+            related = get_related_model(related, name)
+            if related is None:
+                break
+            tables.update(model_dependencies(related))
+    return frozenset(tables)
+
+
+class TrackedCache:
+    """Base class for caches whose entries depend on the contents of
+    database tables.
+
+    Each entry records a generation token for each table on which it
+    depends, as returned by :meth:`tokens`. The token of a table is
+    replaced by :meth:`invalidate` whenever a session tracked with
+    :meth:`track` commits changes to the table, so that the entries that
+    depend on it stop matching.
+
+    `backend` is the :class:`CacheBackend` that stores the entries. If
+    not specified, a :class:`MemoryBackend` is used. Since each process
+    then has its own cache and only sees the writes made in that process,
+    deployments with several worker processes should use a backend shared
+    by all of them.
+
+    `ttl` is the number of seconds for which an entry is valid; it bounds
+    the age of entries that depend on changes made other than through a
+    tracked session.
+
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, ttl: Optional[float] = 60,
+                 key_prefix: str = 'restless:'):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        # The key in `Session.info` of the set of tables written in the
+        # current transaction of the session.
+        self._pending_key = ('flask_restless.cache', id(self))
+
+    def track(self, session):
+        """Invalidates the entries that depend on the tables written by
+        `session`, a :class:`~sqlalchemy.orm.Session`,
+        :class:`~sqlalchemy.orm.scoped_session` or
+        :class:`~sqlalchemy.orm.sessionmaker`, when it commits.
+
+        Both the flushes of the unit of work and ``INSERT``, ``UPDATE``
+        and ``DELETE`` statements executed with the session are tracked.
+
+        """
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'do_orm_execute', self._do_orm_execute)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def _pending(self, session):
+        return session.info.setdefault(self._pending_key, set())
+
+    def _after_flush(self, session, flush_context):
+        pending = self._pending(session)
+        for instance in chain(session.new, session.dirty, session.deleted):
+            state = sqlalchemy_inspect(instance)
+            pending.update(mapper_tables(state.mapper))
+            # Changes to many-to-many relationships are written to the
+            # association table.
+            for prop in state.mapper.relationships:
+                if prop.secondary is not None and hasattr(prop.secondary, 'name') \
+                        and state.attrs[prop.key].history.has_changes():
+                    pending.add(prop.secondary.name)
+
+    def _do_orm_execute(self, orm_execute_state):
+        if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        pending = self._pending(orm_execute_state.session)
+        if orm_execute_state.bind_mapper is not None:
+            pending.update(mapper_tables(orm_execute_state.bind_mapper))
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            pending.add(table.name)
+
+    def _after_commit(self, session):
+        # Releasing a savepoint does not make its changes visible to
+        # other transactions.
+        if session.in_nested_transaction():
+            return
+        pending = session.info.pop(self._pending_key, None)
+        if pending:
+            self.invalidate(pending)
+
+    def _after_rollback(self, session):
+        # The changes of a rolled back savepoint are conservatively kept,
+        # since the tables may also have been written outside of it.
+        if not session.in_nested_transaction():
+            session.info.pop(self._pending_key, None)
+
+    def _generation_key(self, table):
+        return f'{self.key_prefix}generation:{table}'
+
+    def invalidate(self, tables):
+        """Invalidates all entries that depend on any of the tables whose
+        names are given in `tables`.
+
+        """
+        for table in tables:
+            self.backend.set(self._generation_key(table), uuid.uuid4().hex.encode())
+
+    def tokens(self, tables) -> list:
+        """Returns the current generation tokens of the tables whose names
+        are given in `tables`, in order of table name.
+
+        """
+        tokens = []
+        for table in sorted(tables):
+            key = self._generation_key(table)
+            token = self.backend.get(key)
+            if token is None:
+                # A missing token, never set or evicted, must not match any
+                # existing entry, so it is replaced by a new one.
+                token = uuid.uuid4().hex.encode()
+                if not self.backend.add(key, token):
+                    token = self.backend.get(key) or token
+            tokens.append(token.decode())
+        return tokens
+
+
+class ResponseCache(TrackedCache):
+    """Stores rendered responses to :http:method:`get` requests.
+
+    `backend` and `ttl` are as described in :class:`TrackedCache`. For
+    `stale_ttl` seconds after an entry expires, it is still served to all
+    requests except one, which recomputes it.
+
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, ttl: float = 60, stale_ttl: float = 0,
+                 key_prefix: str = 'restless:'):
+        super().__init__(backend, ttl, key_prefix)
+        self.stale_ttl = stale_ttl
+
+    def get(self, key: str, tables):
+        """Returns a pair whose first element is the
+        :class:`CachedResponse` stored under `key`, or ``None`` if there is
+        no valid entry, and whose second element is the list of generation
+        tokens to pass to :meth:`set` when storing a new entry.
+
+        `tables` are the names of the tables on which the response
+        depends, as returned by :func:`dependencies`.
+
+        """
+        tokens = self.tokens(tables)
+        value = self.backend.get(self.key_prefix + key)
+        if value is None:
+            return None, tokens
+        meta, body = decode_entry(value)
+        if meta['tokens'] != tokens:
+            return None, tokens
+        # Only one request recomputes an expired entry; the others are
+        # served the stale entry in the meantime.
+        if meta['fresh'] <= time.time() and self.backend.add(f'{self.key_prefix}revalidate:{key}', b'', REVALIDATE_TIMEOUT):
+            return None, tokens
+        return CachedResponse(meta['status'], meta['headers'], body), tokens
+
+    def set(self, key: str, tokens, status: int, headers: dict, body: bytes):
+        """Stores the response with the given `status`, `headers` and
+        `body` under `key`.
+
+        `tokens` is the list of generation tokens returned by :meth:`get`
+        before the response was computed, so that the entry is invalid if
+        the tables changed in the meantime.
+
+        """
+        meta = {'fresh': time.time() + self.ttl, 'tokens': tokens, 'status': status, 'headers': headers}
+        value = encode_entry(meta, body)
+        self.backend.set(self.key_prefix + key, value, self.ttl + self.stale_ttl)
+        self.backend.delete(f'{self.key_prefix}revalidate:{key}')
+
+
+class RawJSON:
+    """A JSON value that has already been encoded as the string `text`.
+
+    Such values are spliced into the output of :func:`dumps_document`
+    unchanged.
+
+    """
+
+    __slots__ = ('text', )
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def dumps_document(document) -> str:
+    """Encodes `document` as JSON with :func:`flask.json.dumps`, splicing
+    in the text of any :class:`RawJSON` values it contains.
+
+    """
+    fragments: list = []
+    nonce = uuid.uuid4().hex
+    provider_default = getattr(current_app.json, 'default', None) if has_app_context() else None
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            fragments.append(value.text)
+            return PLACEHOLDER.format(nonce, len(fragments) - 1)
+        if provider_default is None:
+            raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+        return provider_default(value)
+
+    text = json.dumps(document, default=default)
+    if not fragments:
+        return text
+    pattern = '"{}"'.format(PLACEHOLDER.format(nonce, r'(\d+)'))
+    return re.sub(pattern, lambda match: fragments[int(match.group(1))], text)
+
+
+class FragmentCache(TrackedCache):
+    """Stores the JSON encoding of individual resource objects, so that
+    the resources that appear in many responses, for example in their
+    ``included`` sections, are only serialized once.
+
+    Only instances of models with a version, that is, with a
+    ``version_id_col``, a ``version_column`` given to
+    :meth:`~flask_restless.APIManager.create_api` or an ``updated_at``
+    column, are cached. An entry is keyed by the type, ID, sparse
+    fieldset and version of the resource, along with the generation tokens
+    of the tables of its model and of the tables that store the linkage of
+    its relationships (see :func:`model_dependencies`), so that writes that do
+    not change the version, such as bulk updates, still invalidate it.
+
+    `backend` and `ttl` are as described in :class:`TrackedCache`.
+
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, ttl: Optional[float] = 300,
+                 key_prefix: str = 'restless:'):
+        super().__init__(backend, ttl, key_prefix)
+
+    def model_tokens(self, model) -> list:
+        """Returns the generation tokens of the tables of `model` and of
+        the tables that store the linkage of its relationships.
+
+        """
+        return self.tokens(model_dependencies(model))
+
+    def key(self, tokens, *parts) -> str:
+        """Returns the key of the fragment for a resource identified by
+        `parts`, which must include its version.
+
+        `tokens` are the generation tokens of its model, as returned by
+        :meth:`model_tokens`.
+
+        """
+        canonical = json.dumps([parts, tokens], default=str)
+        return f'{self.key_prefix}fragment:{hashlib.sha1(canonical.encode()).hexdigest()}'
+
+    def get_many(self, keys) -> list:
+        """Returns a list containing the :class:`RawJSON` fragment stored
+        under each of `keys`, or ``None`` for those that are not cached.
+
+        """
+        return [None if value is None else RawJSON(value.decode()) for value in self.backend.get_many(keys)]
+
+    def set(self, key: str, text: str):
+        """Stores the JSON-encoded resource object `text` under `key`."""
+        self.backend.set(key, text.encode(), self.ttl)
+
+
+class PartitionCache:
+    """Stores the boundaries of the partitions of collections requested
+    with the ``page[partition]`` query parameter.
+
+    Unlike the entries of a :class:`TrackedCache`, boundaries are not
+    invalidated by writes: any list of boundaries splits a collection into
+    disjoint partitions that together cover it, so writes only make the
+    partitions less even. Instead, the boundaries computed first are kept
+    for `ttl` seconds, so that all the requests of a parallel fetch see
+    the same partitions. For this to hold across worker processes,
+    `backend` must be shared by all of them; if not specified, a
+    :class:`MemoryBackend` is used.
+
+    """
+
+    def __init__(self, backend: Optional[CacheBackend] = None, ttl: float = 3600,
+                 key_prefix: str = 'restless:'):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def key(self, *parts) -> str:
+        """Returns the key of the boundaries of the partitions identified by
+        `parts`, such as the collection, the filters and the number of
+        partitions.
+
+        """
+        canonical = json.dumps(parts, sort_keys=True, default=str)
+        return f'{self.key_prefix}partitions:{hashlib.sha1(canonical.encode()).hexdigest()}'
+
+    def get(self, key: str) -> Optional[list]:
+        """Returns the list of boundaries stored under `key`, or ``None``."""
+        value = self.backend.get(key)
+        return None if value is None else json.loads(value)
+
+    def add(self, key: str, boundaries: list) -> list:
+        """Stores `boundaries` under `key` unless another process or thread
+        stored boundaries first, and returns the stored boundaries.
+
+        """
+        if self.backend.add(key, json.dumps(boundaries).encode(), self.ttl):
+            return boundaries
+        stored = self.get(key)
+        return boundaries if stored is None else stored
+
+
+class Flight:
+    """A computation of the response to a request that concurrent
+    identical requests may share, as returned by :meth:`SingleFlight.begin`.
+
+    If :attr:`leader` is ``True``, this request computes the response and
+    must call :meth:`finish` when done, whether or not it succeeded.
+    Otherwise, it waits for the leader with :meth:`wait`.
+
+    """
+
+    def __init__(self, group, key, call, leader):
+        self.group = group
+        self.key = key
+        self.leader = leader
+        self._call = call
+        # The file descriptor of the lock file held by this request, if any.
+        self._lock_fd = None
+
+    def wait(self) -> Optional[CachedResponse]:
+        """Returns the response computed by another request, or ``None``
+        if this request must compute it itself because the other request
+        failed, did not finish before the timeout or does not exist.
+
+        """
+        if not self.leader:
+            if self._call.event.wait(self.group.timeout):
+                return self._call.result
+            return None
+        if self.group.lock_dir is None:
+            return None
+        # The leader within this process coordinates with the other
+        # processes through the lock file.
+        started = time.time()
+        fd = self.group._acquire(self.key, started + self.group.timeout)
+        if fd is None:
+            return None
+        result = self.group._read_result(self.key, started)
+        if result is None:
+            # No other process computed the response in the meantime, so
+            # this request does, while holding the lock.
+            self._lock_fd = fd
+            return None
+        self.group._release(self.key, fd)
+        self.finish(result, publish=False)
+        return result
+
+    def finish(self, result: Optional[CachedResponse], publish: bool = True):
+        """Shares `result`, the response computed by the leader, or
+        ``None`` if it failed, with the waiting requests.
+
+        If `publish` is ``True`` and the group has a lock directory, the
+        response is also shared with the other processes.
+
+        """
+        if not self.leader:
+            return
+        self.leader = False
+        if self._lock_fd is not None:
+            try:
+                if publish and result is not None:
+                    self.group._write_result(self.key, result)
+            finally:
+                self.group._release(self.key, self._lock_fd)
+                self._lock_fd = None
+        self._call.result = result
+        with self.group._lock:
+            if self.group._calls.get(self.key) is self._call:
+                del self.group._calls[self.key]
+        self._call.event.set()
+
+
+class _Call:
+    """The state of a computation shared by the threads of a process."""
+
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests, so that the response is
+    computed once and shared by all of them.
+
+    Requests wait for at most `timeout` seconds for another request
+    computing the same response, after which they compute it themselves.
+
+    Requests are coalesced among the threads of a process. If `lock_dir`
+    is the path of a directory, they are also coalesced among the
+    processes that use it, through a lock file and a file holding the
+    response for each request key; this requires the :mod:`fcntl` module.
+
+    `poll_interval` is the number of seconds between attempts to take the
+    lock of another process.
+
+    The lock file is removed by the request holding the lock before it
+    releases it. A response file is only read by the requests that waited
+    for it, for at most `timeout` seconds, so the response files older than
+    `timeout` are removed whenever a response is written, at most once per
+    `timeout` seconds in each process.
+
+    """
+
+    def __init__(self, timeout: float = 10, lock_dir: Optional[str] = None, poll_interval: float = 0.01):
+        if lock_dir is not None and fcntl is None:
+            raise RuntimeError('`lock_dir` requires the fcntl module')
+        self.timeout = timeout
+        self.lock_dir = lock_dir
+        self.poll_interval = poll_interval
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+        # The time of the last removal of old response files.
+        self._swept = 0.0
+
+    def begin(self, key: str) -> Flight:
+        """Joins the computation of the response identified by `key`,
+        starting it if no other thread of this process is computing it.
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return Flight(self, key, call, leader=False)
+            call = self._calls[key] = _Call()
+        return Flight(self, key, call, leader=True)
+
+    def _lock_path(self, key):
+        return os.path.join(self.lock_dir, f'{key}.lock')
+
+    def _result_path(self, key):
+        return os.path.join(self.lock_dir, f'{key}.response')
+
+    def _acquire(self, key, deadline):
+        """Returns the descriptor of the lock file of `key`, with the lock
+        held, or ``None`` if the lock was not free before the time
+        `deadline`.
+
+        """
+        path = self._lock_path(key)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() >= deadline:
+                        os.close(fd)
+                        return None
+                    time.sleep(self.poll_interval)
+            # The previous holder may have removed the file after this
+            # request opened it, in which case the lock is taken again on
+            # the file now at `path`.
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(fd)
+            if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                return fd
+            os.close(fd)
+
+    def _release(self, key, fd):
+        """Removes the lock file of `key` and releases the lock held through
+        the descriptor `fd`.
+
+        """
+        try:
+            os.remove(self._lock_path(key))
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _write_result(self, key, result):
+        path = self._result_path(key)
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        meta = {'time': time.time(), 'status': result.status, 'headers': result.headers}
+        with open(temporary, 'wb') as f:
+            f.write(encode_entry(meta, result.body))
+        os.replace(temporary, path)
+        self._sweep()
+
+    def _sweep(self):
+        """Removes the response files, including the temporary files of
+        interrupted writes, that are older than the timeout.
+
+        """
+        now = time.time()
+        with self._lock:
+            if self._swept + self.timeout > now:
+                return
+            self._swept = now
+        for name in os.listdir(self.lock_dir):
+            if not (name.endswith('.response') or '.response.' in name):
+                continue
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.stat(path).st_mtime < now - self.timeout:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _read_result(self, key, since):
+        """Returns the response written by another process after the time
+        `since`, or ``None`` if there is none.
+
+        """
+        try:
+            with open(self._result_path(key), 'rb') as f:
+                meta, body = decode_entry(f.read())
+        except (OSError, ValueError):
+            return None
+        if meta['time'] < since:
+            return None
+        return CachedResponse(meta['status'], meta['headers'], body)
@@ -12,6 +12,8 @@
 """Helper functions for Flask-Restless."""
 import datetime
 import inspect
+import re
+from collections import namedtuple
 from functools import lru_cache
 from itertools import chain
 from typing import Any
@@ -21,18 +23,23 @@ from typing import Iterable
 from typing import List
 from typing import Set
 
-from dateutil.parser import parse as parse_datetime
+from flask import g
+from flask import has_request_context
+from flask import request
 from sqlalchemy import Date
 from sqlalchemy import DateTime
 from sqlalchemy import Interval
 from sqlalchemy import Time
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy.exc import NoInspectionAvailable
+from sqlalchemy.ext.associationproxy import AssociationProxy
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.inspection import inspect as sqlalchemy_inspect
 from sqlalchemy.orm import ColumnProperty
 from sqlalchemy.orm import Query
 from sqlalchemy.orm import RelationshipProperty as RelProperty
 from sqlalchemy.orm.attributes import InstrumentedAttribute
-from sqlalchemy.orm.attributes import QueryableAttribute
 from sqlalchemy.sql import func
 
 try:
@@ -54,6 +61,9 @@ COLUMN_TYPES = (InstrumentedAttribute, hybrid_property)
 #: value of the field.
 CURRENT_TIME_MARKERS = ('CURRENT_TIMESTAMP', 'CURRENT_DATE', 'LOCALTIMESTAMP')
 
+#: Matches the strings that :func:`coerce_primary_key` converts to integers.
+INTEGER_RE = re.compile(r'[+-]?[0-9]+')
+
 
 def session_query(session, model):
     """Returns a SQLAlchemy query object for the specified `model`.
@@ -78,15 +88,13 @@ def session_query(session, model):
     return session.query(model)
 
 
-@lru_cache()
+@lru_cache(maxsize=None)
 def get_relations(model):
     """Returns a list of relation names of `model` (as a list of strings)."""
-    return [k for k in dir(model)
-            if not (k.startswith('_') or k in RELATION_EXCLUDE_LIST)
-            and get_related_model(model, k)]
+    return [k for k in sorted(model_info(model).relations)
+            if not (k.startswith('_') or k in RELATION_EXCLUDE_LIST)]
 
 
-@lru_cache()
 def get_related_model(model, relationname):
     """Gets the class of the model to which `model` is related by the attribute
     whose name is `relationname`.
@@ -112,18 +120,11 @@ def get_related_model(model, relationname):
         <class 'Person'>
 
     """
-    if hasattr(model, relationname):
-        # inspector = sqlalchemy_inspect(model)
-        # attributes = inspector.attrs
-        # if relationname in attributes:
-        #     state = attributes[relationname]
-        attr = getattr(model, relationname)
-        if hasattr(attr, 'property') \
-                and isinstance(attr.property, RelProperty):
-            return attr.property.mapper.class_
-        if isinstance(attr, AssociationProxyType):
-            return get_related_association_proxy_model(attr)
-    return None
+    if not isinstance(model, type):
+        # An aliased class has the relationships of the class it aliases.
+        model = sqlalchemy_inspect(model).mapper.class_
+    relation = model_info(model).relations.get(relationname)
+    return relation.target if relation is not None else None
 
 
 def get_related_association_proxy_model(attr):
@@ -162,14 +163,19 @@ def has_field(model, fieldname):
     settable hybrid property for this field name.
 
     """
-    descriptors = sqlalchemy_inspect(model).all_orm_descriptors._data
-    if fieldname in descriptors and hasattr(descriptors[fieldname], 'fset'):
-        return descriptors[fieldname].fset is not None
-    return hasattr(model, fieldname)
+    return model_info(model).has_field(fieldname)
 
 
 def get_field_type(model, field_name: str):
     """Helper which returns the SQLAlchemy type of the field."""
+    column_type = model_info(model).column_types.get(field_name)
+    if column_type is not None:
+        return column_type
+    return _field_type(model, field_name)
+
+
+def _field_type(model, field_name: str):
+    """Returns the SQLAlchemy type of the field by inspecting the model."""
     field = getattr(model, field_name)
     if isinstance(field, AssociationProxyType):
         field = field.remote_attr
@@ -191,14 +197,11 @@ def attribute_columns(model) -> List[str]:
     return column_attrs + hybrid_columns
 
 
-@lru_cache()
+@lru_cache(maxsize=None)
 def primary_key_names(model):
-    """Returns all the primary keys for a model."""
-    return [key for key, field in inspect.getmembers(model)
-            if isinstance(field, QueryableAttribute)
-            and hasattr(field, 'property')
-            and isinstance(field.property, ColumnProperty)
-            and field.property.columns[0].primary_key]
+    """Returns all the primary keys for a model, sorted by name."""
+    return sorted(key for key, prop in sqlalchemy_inspect(model).column_attrs.items()
+                  if prop.columns[0].primary_key)
 
 
 def is_proxy(value: Any) -> bool:
@@ -213,18 +216,7 @@ def is_like_list(instance, relation):
     relation, or it is a dynamically loaded one-to-many.
 
     """
-    if relation in instance._sa_class_manager:
-        return instance._sa_class_manager[relation].property.uselist
-    if hasattr(instance, relation):
-        attr = getattr(instance._sa_instance_state.class_, relation)
-        if hasattr(attr, 'property'):
-            return attr.property.uselist
-    related_value = getattr(type(instance), relation, None)
-    if is_proxy(related_value):
-        local_prop = related_value.local_attr.prop
-        if isinstance(local_prop, RelProperty):
-            return local_prop.uselist
-    return False
+    return model_info(type(instance)).is_like_list(relation)
 
 
 def query_by_primary_key(session, model, pk_value, primary_key=None):
@@ -263,7 +255,7 @@ def get_inclusions(inclusion_tree: Dict[str, dict], instances: Iterable) -> Gene
                 included_instance = getattr(instance, key)
                 if not included_instance:
                     continue
-                if is_like_list(instance, key):
+                if model_info(type(instance)).is_like_list(key):
                     new_instances.update(set(included_instance))
                 else:
                     new_instances.add(included_instance)
@@ -275,6 +267,65 @@ def get_inclusions(inclusion_tree: Dict[str, dict], instances: Iterable) -> Gene
         inclusion_tree, instances = stack.pop()
 
 
+@lru_cache(maxsize=None)
+def has_custom_query(model) -> bool:
+    """Returns ``True`` if `model` has a ``query`` attribute that may
+    restrict the instances visible through the API.
+
+    The query property installed by Flask-SQLAlchemy on every model does
+    not count, unless the model sets a custom ``query_class``.
+
+    """
+    attribute = inspect.getattr_static(model, 'query', None)
+    if attribute is None:
+        return False
+    if type(attribute).__module__.startswith('flask_sqlalchemy'):
+        query_class = getattr(model, 'query_class', Query)
+        return not (query_class is Query or query_class.__module__.startswith('flask_sqlalchemy'))
+    return True
+
+
+@lru_cache(maxsize=None)
+def primary_key_column(model, primary_key):
+    """Returns the :class:`~sqlalchemy.Column` for the `primary_key` of
+    `model` if it is the one and only column of the mapped primary key,
+    or ``None`` otherwise.
+
+    """
+    mapper = sqlalchemy_inspect(model)
+    prop = mapper.attrs.get(primary_key)
+    if len(mapper.primary_key) != 1 or not isinstance(prop, ColumnProperty):
+        return None
+    column = prop.columns[0]
+    return column if column is mapper.primary_key[0] else None
+
+
+@lru_cache(maxsize=None)
+def primary_key_statement(model, primary_key):
+    """Returns a ``SELECT`` statement for the instance of `model` whose
+    `primary_key` equals the ``pk_value`` bound parameter.
+
+    The statement is built once per model, so SQLAlchemy finds its
+    compiled form in the statement cache on every call.
+
+    """
+    return select(model).where(getattr(model, primary_key) == bindparam('pk_value')).limit(1)
+
+
+def request_memo() -> Dict:
+    """Returns a dictionary that lives as long as the current request, or
+    an empty dictionary if there is no request.
+
+    """
+    if not has_request_context():
+        return {}
+    current = request._get_current_object()  # type: ignore
+    memo = g.get('_restless_memo')
+    if memo is None or memo[0] is not current:
+        memo = g._restless_memo = (current, {})
+    return memo[1]
+
+
 def get_by(session, model, pk_value, primary_key):
     """Returns the first instance of `model` whose primary key has the value
     `pk_value`, or ``None`` if no such instance exists.
@@ -282,9 +333,263 @@ def get_by(session, model, pk_value, primary_key):
     If `primary_key` is specified, the column specified by that string is used
     as the primary key column. Otherwise, the column named ``id`` is used.
 
+    If `primary_key` is the mapped primary key of `model`, the instance is
+    looked up with :meth:`Session.get`, which avoids a query when the
+    instance is already in the identity map. Instances found while handling
+    a request are remembered, for each session, until the end of that
+    request.
+
+    """
+    memo = request_memo()
+    key = (session, model, primary_key, str(pk_value))
+    instance = memo.get(key)
+    if instance is not None and sqlalchemy_inspect(instance).persistent:
+        return instance
+    if has_custom_query(model):
+        instance = query_by_primary_key(session, model, pk_value, primary_key).first()
+    else:
+        column = primary_key_column(model, primary_key)
+        if column is not None:
+            instance = session.get(model, coerce_primary_key(column, pk_value))
+        else:
+            statement = primary_key_statement(model, primary_key)
+            instance = session.execute(statement, {'pk_value': pk_value}).scalars().first()
+    if instance is not None:
+        memo[key] = instance
+    return instance
+
+
+def coerce_primary_key(column, pk_value):
+    """Converts a string `pk_value`, as found in a URL or a JSON API
+    document, to an integer if `column` holds integers.
+
+    Lookups in the identity map compare the Python values, so ``'1'`` would
+    not find the instance whose primary key is ``1``. Only strings of
+    decimal digits, with an optional sign, are converted, since :func:`int`
+    also accepts strings such as ``'1_0'``, which the database does not
+    consider equal to a number. Other values are returned unchanged.
+
+    """
+    if isinstance(pk_value, str) and INTEGER_RE.fullmatch(pk_value):
+        try:
+            if column.type.python_type is int:
+                return int(pk_value)
+        except NotImplementedError:
+            pass
+    return pk_value
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+    """Parses a string into a :class:`datetime.datetime` object.
+
+    ISO 8601 strings are parsed with :meth:`datetime.datetime.fromisoformat`;
+    anything else is handed to the much slower, general purpose parser
+    from :mod:`dateutil`.
+
+    """
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil.parser import parse
+        return parse(value)
+
+
+def parse_date(value: str) -> datetime.date:
+    """Parses a string into a :class:`datetime.date` object.
+
+    The string may also represent a datetime, in which case only the date
+    component is kept.
+
+    """
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        return parse_datetime(value).date()
+
+
+def parse_time(value: str) -> datetime.time:
+    """Parses a string into a :class:`datetime.time` object.
+
+    The string may also represent a datetime, in which case only the time
+    component (including the time zone) is kept.
+
+    """
+    try:
+        return datetime.time.fromisoformat(value)
+    except ValueError:
+        return parse_datetime(value).timetz()
+
+
+def seconds_to_timedelta(value):
+    """Converts an integer number of seconds to a
+    :class:`datetime.timedelta` object; any other value is returned
+    unchanged.
+
+    """
+    if isinstance(value, int):
+        return datetime.timedelta(seconds=value)
+    return value
+
+
+def datetime_converter(parse):
+    """Returns a function that converts a string to a date-like object
+    using `parse`, honoring empty strings and :data:`CURRENT_TIME_MARKERS`.
+
     """
-    result = query_by_primary_key(session, model, pk_value, primary_key)
-    return result.first()
+
+    def convert(value):
+        # If the string is empty, no datetime can be inferred from it.
+        if value.strip() == '':
+            return None
+        # If the string is a string indicating that the value of should be the
+        # current datetime on the server, get the current datetime that way.
+        if value in CURRENT_TIME_MARKERS:
+            return getattr(func, value.lower())()
+        return parse(value)
+
+    return convert
+
+
+def converter_for_type(field_type):
+    """Returns the function that converts values received from the client
+    for a field of the given SQLAlchemy type, or ``None`` if the values
+    should be used unchanged.
+
+    """
+    if isinstance(field_type, Date):
+        return datetime_converter(parse_date)
+    if isinstance(field_type, Time):
+        return datetime_converter(parse_time)
+    if isinstance(field_type, DateTime):
+        return datetime_converter(parse_datetime)
+    if isinstance(field_type, Interval):
+        return seconds_to_timedelta
+    return None
+
+
+#: Describes a relationship of a model: whether it is list-like, its
+#: direction (for example, :data:`~sqlalchemy.orm.MANYTOONE`) and the class
+#: of the related model.
+RelationInfo = namedtuple('RelationInfo', ['uselist', 'direction', 'target'])
+
+
+class ModelInfo:
+    """Describes the fields and relationships of a model, computed once
+    so that the request-time helpers in this module are dictionary
+    lookups instead of calls into the SQLAlchemy inspection API.
+
+    This also describes how to validate and convert the fields that a
+    client provides in a request. Use :func:`model_info` to get the
+    (shared) instance for a model; the manager builds it when the API for
+    the model is created. Instances are not modified after they are
+    built.
+
+    """
+
+    __slots__ = ('model', 'fields', 'setters', 'column_types', 'converters', 'relations',
+                 'foreign_keys', 'primary_keys')
+
+    def __init__(self, model):
+        self.model = model
+        mapper = sqlalchemy_inspect(model)
+        descriptors = mapper.all_orm_descriptors
+
+        #: Maps the names of descriptors that may have a setter, such as
+        #: hybrid properties, to whether they actually have one.
+        self.setters = {name: descriptor.fset is not None
+                        for name, descriptor in descriptors.items()
+                        if hasattr(descriptor, 'fset')}
+
+        #: Maps the names of column attributes to their SQLAlchemy type.
+        self.column_types = {name: prop.columns[0].type for name, prop in mapper.column_attrs.items()}
+
+        #: Maps relationship names, including association proxies to
+        #: relationships, to their :class:`RelationInfo`.
+        self.relations = {}
+        for name, prop in mapper.relationships.items():
+            self.relations[name] = RelationInfo(prop.uselist, prop.direction, prop.mapper.class_)
+        for name, descriptor in descriptors.items():
+            if not isinstance(descriptor, AssociationProxy):
+                continue
+            proxy = getattr(model, name)
+            if isinstance(proxy, AssociationProxyType):
+                local_prop = proxy.local_attr.prop
+                self.relations[name] = RelationInfo(local_prop.uselist, local_prop.direction,
+                                                    get_related_association_proxy_model(proxy))
+
+        #: The names of the fields of the model that do not have a setter
+        #: that refuses assignment.
+        self.fields = frozenset(name for name in chain(descriptors.keys(), self.relations)
+                                if self.setters.get(name, True))
+
+        #: Maps field names to the function that converts values for that
+        #: field, or ``None`` if values need no conversion.
+        self.converters = {}
+        for name in descriptors.keys():
+            try:
+                self.converters[name] = converter_for_type(_field_type(model, name))
+            except (AttributeError, NoInspectionAvailable):
+                # A hybrid property whose expression cannot be evaluated on
+                # the class is left out; :meth:`converter` raises the same
+                # error when a value is given for it.
+                continue
+
+        self.foreign_keys = tuple(foreign_keys(model))
+        self.primary_keys = tuple(primary_key_names(model))
+
+    def has_field(self, fieldname) -> bool:
+        """Returns ``True`` if the model has the specified field or if it
+        has a settable hybrid property for this field name.
+
+        """
+        if fieldname in self.fields:
+            return True
+        settable = self.setters.get(fieldname)
+        if settable is not None:
+            return settable
+        return hasattr(self.model, fieldname)
+
+    def is_like_list(self, relation) -> bool:
+        """Returns ``True`` if the specified relationship is list-like."""
+        info = self.relations.get(relation)
+        return info is not None and info.uselist
+
+    def converter(self, fieldname):
+        """Returns the function that converts values for the specified
+        field, as described in :func:`converter_for_type`.
+
+        Raises :exc:`AttributeError` if the model has no such field.
+
+        """
+        try:
+            return self.converters[fieldname]
+        except KeyError:
+            return converter_for_type(get_field_type(self.model, fieldname))
+
+    def convert(self, fieldname, value):
+        """Converts a value for the specified field as described in
+        :func:`string_to_datetime`.
+
+        """
+        if value is None:
+            return value
+        converter = self.converter(fieldname)
+        if converter is None:
+            return value
+        return converter(value)
+
+    def convert_all(self, dictionary):
+        """Returns a new dictionary with the values of `dictionary`
+        converted as described in :func:`strings_to_datetimes`.
+
+        """
+        return {k: self.convert(k, v) for k, v in dictionary.items()}
+
+
+@lru_cache(maxsize=None)
+def model_info(model) -> ModelInfo:
+    """Returns the :class:`ModelInfo` for the specified model."""
+    return ModelInfo(model)
 
 
 def string_to_datetime(model, fieldname, value):
@@ -300,33 +605,7 @@ def string_to_datetime(model, fieldname, value):
     unchanged.
 
     """
-    if value is None:
-        return value
-    # If this is a date, time or datetime field, parse it and convert it to
-    # the appropriate type.
-    field_type = get_field_type(model, fieldname)
-    if isinstance(field_type, (Date, Time, DateTime)):
-        # If the string is empty, no datetime can be inferred from it.
-        if value.strip() == '':
-            return None
-        # If the string is a string indicating that the value of should be the
-        # current datetime on the server, get the current datetime that way.
-        if value in CURRENT_TIME_MARKERS:
-            return getattr(func, value.lower())()
-        value_as_datetime = parse_datetime(value)
-        # If the attribute on the model needs to be a Date or Time object as
-        # opposed to a DateTime object, just get the date component of the
-        # datetime.
-        if isinstance(field_type, Date):
-            return value_as_datetime.date()
-        if isinstance(field_type, Time):
-            return value_as_datetime.timetz()
-        return value_as_datetime
-    # If this is an Interval field, convert the integer value to a timedelta.
-    if isinstance(field_type, Interval) and isinstance(value, int):
-        return datetime.timedelta(seconds=value)
-    # In any other case, simply copy the value unchanged.
-    return value
+    return model_info(model).convert(fieldname, value)
 
 
 def strings_to_datetimes(model, dictionary):
@@ -345,7 +624,7 @@ def strings_to_datetimes(model, dictionary):
     This function outputs a new dictionary; it does not modify the argument.
 
     """
-    return {k: string_to_datetime(model, k, v) for k, v in dictionary.items()}
+    return model_info(model).convert_all(dictionary)
 
 
 def get_model(instance) -> type:
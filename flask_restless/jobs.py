@@ -0,0 +1,333 @@
+# jobs.py - background jobs that export collections to files
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Background jobs that export collections to gzipped newline-delimited
+JSON files.
+
+An :class:`ExportJobs` object runs the jobs in a bounded pool of threads,
+writes the files to a local directory and records the state of each job,
+including its progress, in a :class:`JobStore`. By default the states are
+stored in a SQLite database in the same directory, so that any process of
+the application can report on any job. Finished jobs and their files are
+deleted after a retention period, and unfinished jobs whose process stopped
+recording a heartbeat are marked as failed.
+
+"""
+import gzip
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as wait_for
+from contextlib import closing
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+#: The states of a job, in the order in which it goes through them; a job
+#: that fails ends in the ``'failed'`` state instead of ``'done'``.
+JOB_STATUSES = ('pending', 'running', 'done', 'failed')
+
+#: The fields of the dictionaries that represent the state of a job.
+#: ``heartbeat`` is the last time at which the process running the job
+#: recorded that it is still alive.
+JOB_FIELDS = ('id', 'collection', 'status', 'rows', 'error', 'created', 'finished', 'heartbeat')
+
+#: The error recorded for a job that raised an exception; the exception
+#: itself is logged, since its message may reveal details of the database.
+JOB_ERROR = 'The export failed'
+
+#: The error recorded for a job whose process stopped recording heartbeats.
+STALE_JOB_ERROR = 'The export was interrupted'
+
+
+def utcnow(offset: float = 0) -> str:
+    """Returns the current time plus `offset` seconds as an ISO 8601
+    string in UTC.
+
+    These strings sort in chronological order.
+
+    """
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset)).isoformat()
+
+
+class JobStore:
+    """Base class for the storage of the states of export jobs.
+
+    Each state is a dictionary with the keys in :data:`JOB_FIELDS`.
+    Stores must be safe to use from several threads at once.
+
+    """
+
+    def create(self, job: dict):
+        """Stores the state of a new job."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, **values):
+        """Replaces the given fields of the state of the job `job_id`."""
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns the state of the job `job_id`, or ``None`` if there is
+        no such job.
+
+        """
+        raise NotImplementedError
+
+    def delete(self, job_id: str):
+        """Removes the state of the job `job_id`, if any."""
+        raise NotImplementedError
+
+    def expired(self, finished_before: str) -> list:
+        """Returns the IDs of the jobs that finished before the time
+        `finished_before`.
+
+        """
+        raise NotImplementedError
+
+    def stale(self, heartbeat_before: str) -> list:
+        """Returns the IDs of the ``pending`` and ``running`` jobs whose
+        last heartbeat was recorded before the time `heartbeat_before`.
+
+        """
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """Stores the states of jobs in a table of the SQLite database at
+    `path`, which the processes of a host may share.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        columns = ', '.join(f'{name} TEXT' for name in JOB_FIELDS if name not in ('id', 'rows'))
+        self._execute(f'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, rows INTEGER, {columns})')
+
+    def _execute(self, statement, parameters=()) -> list:
+        """Executes `statement` in autocommit mode and returns the rows of
+        the result.
+
+        """
+        # Each call uses a connection of its own, so that the store can be
+        # used from any thread.
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as connection:
+            return connection.execute(statement, parameters).fetchall()
+
+    def create(self, job):
+        placeholders = ', '.join('?' for name in JOB_FIELDS)
+        self._execute(f'INSERT INTO jobs ({", ".join(JOB_FIELDS)}) VALUES ({placeholders})',
+                      [job.get(name) for name in JOB_FIELDS])
+
+    def update(self, job_id, **values):
+        unknown = set(values) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown job fields: {", ".join(sorted(unknown))}')
+        assignments = ', '.join(f'{name} = ?' for name in values)
+        self._execute(f'UPDATE jobs SET {assignments} WHERE id = ?', [*values.values(), job_id])
+
+    def get(self, job_id):
+        rows = self._execute(f'SELECT {", ".join(JOB_FIELDS)} FROM jobs WHERE id = ?', [job_id])
+        return dict(zip(JOB_FIELDS, rows[0])) if rows else None
+
+    def delete(self, job_id):
+        self._execute('DELETE FROM jobs WHERE id = ?', [job_id])
+
+    def expired(self, finished_before):
+        rows = self._execute('SELECT id FROM jobs WHERE finished < ?', [finished_before])
+        return [row[0] for row in rows]
+
+    def stale(self, heartbeat_before):
+        rows = self._execute("SELECT id FROM jobs WHERE status IN ('pending', 'running') AND heartbeat < ?",
+                             [heartbeat_before])
+        return [row[0] for row in rows]
+
+
+class ExportJobs:
+    """Runs jobs that export collections to gzipped newline-delimited JSON
+    files in the directory `directory`.
+
+    At most `max_workers` jobs run at once; the others wait in the order
+    in which they were submitted. `store` is the :class:`JobStore` of the
+    states of the jobs; by default, it is a :class:`SQLiteJobStore` with
+    the database ``jobs.sqlite`` in `directory`. The number of rows
+    written by a running job is recorded every `progress_interval` rows.
+
+    Every `heartbeat_interval` seconds, a thread records a heartbeat for
+    the unfinished jobs submitted by this process. A ``pending`` or
+    ``running`` job without a heartbeat for `stale_after` seconds, because
+    its process stopped, is marked as failed. The states and the files of
+    the jobs that finished more than `retention` seconds ago are deleted
+    by :meth:`cleanup`, which runs whenever a job is submitted; if
+    `retention` is ``None``, they are kept.
+
+    For more information, see :ref:`exportjobs`.
+
+    """
+
+    def __init__(self, directory: str, max_workers: int = 2, store: Optional[JobStore] = None,
+                 progress_interval: int = 1000, retention: Optional[float] = 7 * 24 * 3600,
+                 heartbeat_interval: float = 30, stale_after: float = 300):
+        if stale_after <= heartbeat_interval:
+            raise ValueError('`stale_after` must be greater than `heartbeat_interval`')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.store = store if store is not None else SQLiteJobStore(os.path.join(directory, 'jobs.sqlite'))
+        self.progress_interval = progress_interval
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flask-restless-export')
+        #: The futures of the jobs submitted by this process, by job ID.
+        self.futures: dict = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def path(self, job_id: str) -> str:
+        """Returns the path of the file written by the job `job_id`."""
+        return os.path.join(self.directory, f'{job_id}.ndjson.gz')
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns the state of the job `job_id`, or ``None`` if there is
+        no such job.
+
+        """
+        job = self.store.get(job_id)
+        with self._lock:
+            own = job_id in self.futures
+        if (job is not None and not own and job['status'] in ('pending', 'running')
+                and (job['heartbeat'] or '') < utcnow(-self.stale_after)):
+            self._fail_stale(job_id)
+            job = self.store.get(job_id)
+        return job
+
+    def submit(self, collection: str, lines) -> dict:
+        """Starts a job that exports the collection named `collection` and
+        returns the state of the new job.
+
+        `lines` is a function, called in a thread of the pool, that returns
+        an iterable of the lines of the export, each ending with a newline.
+
+        """
+        self.cleanup()
+        now = utcnow()
+        job = {'id': uuid.uuid4().hex, 'collection': collection, 'status': 'pending', 'rows': 0,
+               'error': None, 'created': now, 'finished': None, 'heartbeat': now}
+        self.store.create(job)
+        future = self.executor.submit(self._run, job['id'], lines)
+        with self._lock:
+            self.futures[job['id']] = future
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name='flask-restless-export-heartbeat',
+                                                   daemon=True)
+                self._heartbeat.start()
+        future.add_done_callback(lambda future: self._forget(job['id']))
+        return job
+
+    def _forget(self, job_id):
+        with self._lock:
+            self.futures.pop(job_id, None)
+
+    def _beat(self):
+        """Records a heartbeat for the unfinished jobs of this process every
+        ``heartbeat_interval`` seconds, until :meth:`shutdown`.
+
+        """
+        while not self._stopped.wait(self.heartbeat_interval):
+            with self._lock:
+                job_ids = list(self.futures)
+            for job_id in job_ids:
+                try:
+                    self.store.update(job_id, heartbeat=utcnow())
+                except Exception:
+                    logger.exception('Could not record the heartbeat of export job %s', job_id)
+
+    def _remove_files(self, job_id):
+        """Removes the file of the job `job_id` and its partial file, if
+        they exist.
+
+        """
+        path = self.path(job_id)
+        for name in (path, f'{path}.part'):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _fail_stale(self, job_id):
+        """Marks the stale job `job_id` as failed and removes its partial
+        file.
+
+        """
+        self._remove_files(job_id)
+        self.store.update(job_id, status='failed', error=STALE_JOB_ERROR, finished=utcnow())
+
+    def cleanup(self):
+        """Marks the stale jobs as failed, and deletes the states and the
+        files of the jobs that finished more than ``retention`` seconds
+        ago.
+
+        """
+        with self._lock:
+            own = set(self.futures)
+        for job_id in self.store.stale(utcnow(-self.stale_after)):
+            if job_id not in own:
+                self._fail_stale(job_id)
+        if self.retention is None:
+            return
+        for job_id in self.store.expired(utcnow(-self.retention)):
+            self._remove_files(job_id)
+            self.store.delete(job_id)
+
+    def _run(self, job_id, lines):
+        """Writes the lines returned by `lines()` to the file of the job
+        `job_id`, recording its progress.
+
+        """
+        self.store.update(job_id, status='running', heartbeat=utcnow())
+        path = self.path(job_id)
+        # The file is only given its final name once it is complete.
+        partial_path = f'{path}.part'
+        rows = 0
+        try:
+            with gzip.open(partial_path, 'wt', encoding='utf-8') as file:
+                for line in lines():
+                    file.write(line)
+                    rows += 1
+                    if rows % self.progress_interval == 0:
+                        self.store.update(job_id, rows=rows)
+            os.replace(partial_path, path)
+        except Exception:
+            # The message of the exception may reveal details of the
+            # database to the clients, so it is only logged.
+            logger.exception('Export job %s failed', job_id)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            self.store.update(job_id, status='failed', rows=rows, error=JOB_ERROR, finished=utcnow())
+            return
+        self.store.update(job_id, status='done', rows=rows, finished=utcnow())
+
+    def wait(self, timeout: Optional[float] = None):
+        """Waits for at most `timeout` seconds for the jobs submitted by
+        this process to finish.
+
+        """
+        with self._lock:
+            futures = list(self.futures.values())
+        wait_for(futures, timeout)
+
+    def shutdown(self, wait: bool = True):
+        """Stops the pool of threads, waiting for the running jobs to finish
+        if `wait` is ``True``, and stops recording heartbeats.
+
+        """
+        self.executor.shutdown(wait=wait)
+        self._stopped.set()
@@ -15,24 +15,55 @@ The :class:`APIManager` class allow users to create ReSTful APIs for
 their SQLAlchemy models.
 
 """
+import gc
+import threading
 from collections import defaultdict
+from concurrent.futures import Executor
+from functools import lru_cache
+from functools import partial
 from typing import Dict
 from typing import Optional
 from uuid import uuid1
 
 from flask import Blueprint
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.inspection import inspect as sqlalchemy_inspect
 
 from . import registry
+from .cache import FragmentCache
+from .cache import PartitionCache
+from .cache import ResponseCache
+from .cache import SingleFlight
+from .cache import model_dependencies
+from .helpers import get_column_name
 from .helpers import get_model
-from .helpers import primary_key_names
+from .helpers import get_relations
+from .helpers import has_custom_query
+from .helpers import model_info
+from .helpers import primary_key_column
+from .helpers import primary_key_statement
+from .jobs import ExportJobs
+from .routing import Dispatcher
+from .search import search
 from .serialization import DefaultDeserializer
 from .serialization import DefaultSerializer
 from .serialization import Deserializer
 from .serialization import Serializer
+from .snapshots import SnapshotStore
 from .views import API
 from .views import RelationshipAPI
 from .views.base import FetchCollection
 from .views.base import FetchResource
+from .views.base import cached_loader_options
+from .views.base import loader_options
+from .views.export import ExportJobView
+from .views.export import ExportResultView
+from .views.export import ExportView
+from .views.export import RateLimiter
+from .views.helpers import is_private_database
+from .views.helpers import partition_column
+from .views.ingest import IngestView
+from .views.ingest import ingest_columns
 
 #: The names of HTTP methods that allow fetching information.
 READONLY_METHODS = frozenset(('GET', ))
@@ -40,8 +71,12 @@ READONLY_METHODS = frozenset(('GET', ))
 #: The names of HTTP methods that allow creating, updating, or deleting information.
 WRITEONLY_METHODS = frozenset(('PATCH', 'POST', 'DELETE'))
 
+#: The names of HTTP methods that create or replace a resource in a single
+#: "upsert" statement.
+UPSERT_METHODS = frozenset(('PUT', ))
+
 #: The set of all recognized HTTP methods.
-ALL_METHODS = READONLY_METHODS | WRITEONLY_METHODS
+ALL_METHODS = READONLY_METHODS | WRITEONLY_METHODS | UPSERT_METHODS
 
 
 class IllegalArgumentError(Exception):
@@ -52,6 +87,89 @@ class IllegalArgumentError(Exception):
     pass
 
 
+class LazyAPI:
+    """Builds the views of an API the first time they are needed.
+
+    `build` is a function that takes no arguments and returns a pair whose
+    elements are a dictionary mapping keys to view functions and the
+    :class:`~flask_restless.registry.APIInfo` for the API.
+
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.lock = threading.Lock()
+        self.built = None
+
+    def get(self):
+        """Returns the pair returned by the build function, calling it if
+        this has not been done yet.
+
+        """
+        if self.built is None:
+            with self.lock:
+                if self.built is None:
+                    self.built = self.build()
+        return self.built
+
+    def view(self, key, name):
+        """Returns a view function named `name` that builds the API, if
+        necessary, and calls its view function for `key`.
+
+        """
+
+        def view_func(**kw):
+            return self.get()[0][key](**kw)
+
+        view_func.__name__ = name
+        return view_func
+
+
+class CreatedAPIs(dict):
+    """A dictionary mapping models to the
+    :class:`~flask_restless.registry.APIInfo` for their API.
+
+    The API for a model may be deferred with :meth:`defer`, in which case
+    it is built when the model is first looked up.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        #: Maps models to the :class:`LazyAPI` of their deferred API.
+        self.pending: Dict[type, LazyAPI] = {}
+        self.lock = threading.Lock()
+
+    def add(self, model, api_info):
+        """Records the API for `model`."""
+        self[model] = api_info
+        registry.add(model, api_info)
+
+    def defer(self, model, lazy_api):
+        """Records the API for `model`, which will be built by `lazy_api`."""
+        with self.lock:
+            self.pop(model, None)
+            self.pending[model] = lazy_api
+
+    def build_pending(self):
+        """Builds and records all deferred APIs."""
+        for model in list(self.pending):
+            self[model]
+
+    def __missing__(self, model):
+        lazy_api = self.pending.get(model)
+        if lazy_api is None:
+            raise KeyError(model)
+        # Building an API may look up other models, so the lock is not held
+        # while building.
+        views, api_info = lazy_api.get()
+        with self.lock:
+            if self.pending.get(model) is lazy_api:
+                self.add(model, api_info)
+                del self.pending[model]
+        return self[model]
+
+
 class APIManager:
     """Provides a method for creating a public ReSTful JSON API with respect
     to a given :class:`~flask.Flask` application object.
@@ -101,9 +219,73 @@ class APIManager:
     `include_links` controls whether to include link objects in resource objects
     https://jsonapi.org/format/#document-links
 
+    `cache` is a :class:`~flask_restless.cache.ResponseCache` in which APIs
+    created with ``cache_responses=True`` store their responses to
+    :http:method:`get` requests. The cache tracks the writes made with
+    `session` in order to invalidate the responses that depend on them.
+    For more information, see :ref:`caching`.
+
+    `fragment_cache` is a :class:`~flask_restless.cache.FragmentCache` in
+    which the serialized resource objects returned by :http:method:`get`
+    requests are stored. For more information, see :ref:`fragments`.
+
+    `single_flight` is a :class:`~flask_restless.cache.SingleFlight` that
+    coalesces concurrent identical :http:method:`get` requests for
+    resources and collections, so that the response is computed once. For
+    more information, see :ref:`singleflight`.
+
+    If `single_dispatcher` is ``True``, the APIs created with the same URL
+    prefix share a single blueprint with a fixed set of URL rules, and
+    each request is dispatched to the views of the requested model by
+    collection name. This keeps the URL map of the application small when
+    there are hundreds of models. For more information, see
+    :ref:`dispatcher`.
+
+    If `lazy` is ``True``, :meth:`create_api` only registers the URL rules
+    of each API. The serializer, deserializer and views of the API are
+    built on the first request for the API (or the first time another API
+    needs them), or by :meth:`warmup`. This shortens the startup of
+    applications with many models. For more information, see
+    :ref:`lazy`.
+
+    `query_executor` is a :class:`~concurrent.futures.Executor`, such as a
+    :class:`~concurrent.futures.ThreadPoolExecutor`, in which requests for
+    a collection count the resources on a separate connection while the
+    page of resources is loaded. The count runs in a transaction of its
+    own, so it does not see the uncommitted changes of `session`, and the
+    ``total`` of a response may not match its page if the collection
+    changes between the two queries. :meth:`create_api` raises
+    :exc:`IllegalArgumentError` if the model is bound to an in-memory
+    SQLite database, which other connections can not see. For more
+    information, see :ref:`concurrentcount`.
+
+    `export_jobs` is a :class:`~flask_restless.jobs.ExportJobs` that runs
+    the background export jobs of the APIs created with
+    ``allow_export_jobs=True``. For more information, see
+    :ref:`exportjobs`.
+
+    `snapshot_store` is a :class:`~flask_restless.snapshots.SnapshotStore`
+    in which APIs created with the `snapshots` argument store the
+    snapshots of their collections. Like `cache`, it tracks the writes
+    made with `session`. For more information, see :ref:`snapshots`.
+
+    `partition_cache` is a :class:`~flask_restless.cache.PartitionCache`
+    in which APIs created with ``allow_partitions=True`` store the
+    boundaries of the partitions of their collections. If not specified,
+    each process keeps its own boundaries in memory, so applications with
+    several worker processes must give it a backend shared by all of them,
+    or else the partitions requested from different processes may overlap
+    or miss resources after writes. For more information, see
+    :ref:`partitions`.
+
     """
 
-    def __init__(self, app=None, session=None, preprocessors=None, postprocessors=None, url_prefix='/api', include_links: bool = False):
+    def __init__(self, app=None, session=None, preprocessors=None, postprocessors=None, url_prefix='/api', include_links: bool = False,
+                 cache: Optional[ResponseCache] = None, fragment_cache: Optional[FragmentCache] = None,
+                 single_flight: Optional[SingleFlight] = None, single_dispatcher: bool = False,
+                 lazy: bool = False, query_executor: Optional[Executor] = None,
+                 export_jobs: Optional[ExportJobs] = None, snapshot_store: Optional[SnapshotStore] = None,
+                 partition_cache: Optional[PartitionCache] = None):
         if session is None:
             raise ValueError('`session` can not be empty')
 
@@ -113,7 +295,7 @@ class APIManager:
         #: created an API via the :meth:`create_api_blueprint` method
         #: and whose values are the corresponding collection names for
         #: those models.
-        self.created_apis_for: dict = {}
+        self.created_apis_for: CreatedAPIs = CreatedAPIs()
 
         #: List of blueprints created by :meth:`create_api` to be registered
         #: to the app when calling :meth:`init_app`.
@@ -131,6 +313,53 @@ class APIManager:
 
         self.include_links = include_links
 
+        #: The cache of responses to :http:method:`get` requests, if any.
+        self.cache = cache
+        if cache is not None:
+            cache.track(session)
+
+        #: The cache of serialized resource objects, if any.
+        self.fragment_cache = fragment_cache
+        if fragment_cache is not None:
+            fragment_cache.track(session)
+
+        #: The coalescing of concurrent identical requests, if any.
+        self.single_flight = single_flight
+
+        #: Whether APIs share the URL rules of a :class:`Dispatcher`.
+        self.single_dispatcher = single_dispatcher
+
+        #: Maps URL prefixes to the :class:`Dispatcher` for the APIs created
+        #: with that prefix, if `single_dispatcher` is ``True``.
+        self.dispatchers: Dict[str, Dispatcher] = {}
+
+        #: Whether APIs are built on first use instead of when created.
+        self.lazy = lazy
+
+        #: The :class:`LazyAPI` objects of the APIs created by this manager,
+        #: if `lazy` is ``True``.
+        self.lazy_apis: list = []
+
+        #: The executor in which collection requests count the resources
+        #: while loading the page, if any.
+        self.query_executor = query_executor
+
+        #: The runner of background export jobs, if any.
+        self.export_jobs = export_jobs
+
+        #: The store of the snapshots of collections, if any.
+        self.snapshot_store = snapshot_store
+        if snapshot_store is not None:
+            snapshot_store.track(session)
+
+        #: The cache of the boundaries of the partitions of collections.
+        self.partition_cache = partition_cache if partition_cache is not None else PartitionCache()
+
+        #: Returns the :func:`~flask_restless.views.base.loader_options` of
+        #: the views of this manager, computed once for each combination of
+        #: arguments.
+        self.loader_options = lru_cache(maxsize=1024)(partial(loader_options, self))
+
     def url_for(self, model, **kw) -> str:
         """Returns the URL for the specified model, similar to
         :func:`flask.url_for`.
@@ -224,6 +453,18 @@ class APIManager:
         :meth:`create_api_blueprint`."""
         return self.created_apis_for[model].url_prefix
 
+    def version_column_for(self, model) -> Optional[str]:
+        """Returns the name of the column of the specified model whose value
+        changes whenever an instance changes, as specified by the
+        `version_column` keyword argument to :meth:`create_api_blueprint`,
+        or else the ``updated_at`` column of the model, if any.
+
+        """
+        version_column = self.created_apis_for[model].version_column
+        if version_column is None and 'updated_at' in model_info(model).column_types:
+            version_column = 'updated_at'
+        return version_column
+
     def init_app(self, app):
 
         """Registers any created APIs on the given Flask application.
@@ -310,6 +551,22 @@ class APIManager:
             allow_delete_from_to_many_relationships: bool = False,
             allow_client_generated_ids: bool = False,
             allow_non_primary_key_id: bool = False,
+            upsert_columns=None,
+            use_returning: bool = False,
+            allow_ingest: bool = False,
+            ingest_chunk_size: int = 1000,
+            ingest_commit_per_chunk: bool = True,
+            allow_export: bool = False,
+            export_max_rows: Optional[int] = None,
+            export_rate_limit: Optional[int] = None,
+            allow_export_jobs: bool = False,
+            snapshots: Optional[Dict[str, list]] = None,
+            version_column=None,
+            cache_responses: bool = False,
+            deferred_join: bool = False,
+            render_in_database: bool = False,
+            allow_partitions: bool = False,
+            allow_aggregation: bool = False,
     ):
         """Creates and returns a ReSTful API interface as a blueprint, but does
         not register it on any :class:`flask.Flask` application.
@@ -378,6 +635,12 @@ class APIManager:
           :http:method:`patch` method (if ``allow_to_many_replacement``
           is set to ``True``). For more information, see :ref:`updating`
           and :ref:`updatingrelationships`.
+        * If ``'PUT'`` is in the list, :http:method:`put` requests will
+          be allowed at endpoints for individual resources. Such a
+          request creates the resource or, if it already exists, updates
+          its attributes in a single ``INSERT ... ON CONFLICT DO UPDATE``
+          statement. This requires ``allow_client_generated_ids`` to be
+          ``True``. For more information, see :ref:`upserting`.
 
         The default set of methods provides a read-only interface (that is,
         only :http:method:`get` requests are allowed).
@@ -491,6 +754,107 @@ class APIManager:
         this be a UUID. This is ``False`` by default. For more information, see
         :ref:`creating`.
 
+        `upsert_columns` is a list of columns of `model`, given either as
+        strings or as the attributes themselves, that identify the existing
+        row to update on a :http:method:`put` request. These columns must be
+        covered by a primary key or a unique constraint. If not specified,
+        the primary key of the API is used.
+
+        If `use_returning` is ``True``, the server will create, update and
+        delete resources with a single ``INSERT ... RETURNING``, ``UPDATE
+        ... RETURNING`` or ``DELETE`` statement instead of loading the
+        instance and flushing the session, whenever the request and the
+        database allow it. This bypasses the unit of work of the session,
+        so mapper events such as ``before_insert`` are not triggered and
+        the custom ``query`` attribute of the model, if any, is not used
+        to look up the resource. Models with ORM validators, inheritance or
+        a version counter always use the session. This is ``False`` by
+        default. For more information, see :ref:`returning`.
+
+        If `allow_ingest` is ``True``, the server will accept
+        :http:method:`post` requests to ``<url_prefix>/<collection_name>/ingest``
+        whose body is newline-delimited JSON or CSV, inserting one resource
+        per row. `ingest_chunk_size` is the number of rows inserted with a
+        single statement, and `ingest_commit_per_chunk` determines whether
+        the session is committed after each chunk or once per request. This
+        is ``False`` by default. For more information, see :ref:`ingest`.
+
+        If `allow_export` is ``True``, the server will respond to
+        :http:method:`get` requests to ``<url_prefix>/<collection_name>/export``
+        with the whole collection as newline-delimited JSON or CSV, one
+        resource per line, fetched from a server-side cursor. The export is
+        not paginated, so `max_page_size` does not apply; instead, at most
+        `export_max_rows` resources are exported, if specified, and each
+        client may make at most `export_rate_limit` export requests per
+        minute, if specified. This is ``False`` by default. For more
+        information, see :ref:`export`.
+
+        If `allow_export_jobs` is ``True``, :http:method:`post` requests to
+        ``<url_prefix>/<collection_name>/exports`` start a background job
+        that exports the collection to a gzipped newline-delimited JSON
+        file, run by the `export_jobs` of this manager. `export_max_rows`
+        and `export_rate_limit` apply to these jobs too, and the
+        ``GET_EXPORT_JOB`` preprocessors apply to the requests for the
+        state and the file of a job. This is ``False`` by default. For more
+        information, see :ref:`exportjobs`.
+
+        `snapshots` is a dictionary mapping names to lists of filter
+        objects. A :http:method:`get` request for the collection with the
+        query parameter ``snapshot=<name>`` is answered with a document of
+        all the resources that match the filters of the snapshot, rendered
+        in advance and stored in the `snapshot_store` of this manager. For
+        more information, see :ref:`snapshots`.
+
+        `version_column` is a column of `model`, given either as a string or
+        as the attribute itself, whose value changes whenever a resource
+        changes, such as an ``updated_at`` timestamp. If specified, or if
+        `model` has a ``version_id_col``, :http:method:`get` responses
+        include :http:header:`ETag` (and, for timestamps,
+        :http:header:`Last-Modified`) headers and the server responds with
+        :http:statuscode:`304` to conditional requests for unchanged
+        resources and collections. For more information, see
+        :ref:`conditional`.
+
+        If `cache_responses` is ``True``, responses to :http:method:`get`
+        requests for resources and collections are stored in the cache given
+        in the constructor of this class. Preprocessors are still applied to
+        each request, but the postprocessors are only applied when a
+        response is computed. This is ``False`` by default. For more
+        information, see :ref:`caching`.
+
+        If `deferred_join` is ``True``, pages of collections are selected by
+        first querying the primary keys of the page and then loading the
+        rows with those keys, which is faster for large page numbers. This
+        is ``False`` by default. For more information, see
+        :ref:`deferredjoin`.
+
+        If `render_in_database` is ``True``, the database builds the JSON
+        resource objects of pages of collections, if the serializer is the
+        default one, the resources have only integer, string and boolean
+        attributes and many-to-one relationships, and neither included
+        resources nor postprocessors are involved. This is ``False`` by
+        default. For more information, see :ref:`databaserendering`.
+
+        If `allow_partitions` is ``True``, clients may split the collection
+        into disjoint partitions by ranges of the primary key, with the
+        ``page[partition]=k/N`` query parameter, and page through each
+        partition in the order of the primary key. The model must have a
+        primary key consisting of a single integer or string column. This
+        is ``False`` by default. The boundaries of the partitions are kept
+        in the ``partition_cache`` of the manager, which must have a
+        backend shared by all the worker processes of the application if
+        there are several. For more information, see :ref:`partitions`.
+
+        If `allow_aggregation` is ``True``, :http:method:`get` requests for
+        the collection may ask for the count, sum, minimum or maximum of
+        the attributes of the resources that match the filters, possibly
+        grouped by other attributes, with the ``aggregate[<function>]`` and
+        ``group_by`` query parameters. The aggregates are computed by the
+        database and returned in the ``meta`` object of the response, which
+        has no ``data`` member; ``GET_COLLECTION`` postprocessors receive
+        this document too. This is ``False`` by default. For more
+        information, see :ref:`aggregation`.
+
         If `allow_functions` is ``True``, then :http:method:`get`
         requests to ``/api/eval/<collection_name>`` will return the
         result of evaluating SQL functions specified in the body of the
@@ -515,80 +879,268 @@ class APIManager:
             raise IllegalArgumentError(msg)
         if collection_name is None:
             collection_name = model.__table__.name
+        if ingest_chunk_size < 1:
+            msg = '`ingest_chunk_size` must be positive'
+            raise IllegalArgumentError(msg)
+        if export_max_rows is not None and export_max_rows < 1:
+            msg = '`export_max_rows` must be positive'
+            raise IllegalArgumentError(msg)
+        if export_rate_limit is not None and export_rate_limit < 1:
+            msg = '`export_rate_limit` must be positive'
+            raise IllegalArgumentError(msg)
+        if allow_export_jobs and self.export_jobs is None:
+            msg = '`allow_export_jobs` requires the `export_jobs` argument of the APIManager constructor'
+            raise IllegalArgumentError(msg)
+        if snapshots is not None and self.snapshot_store is None:
+            msg = '`snapshots` requires the `snapshot_store` argument of the APIManager constructor'
+            raise IllegalArgumentError(msg)
+        partition_column_ = None
+        if allow_partitions:
+            partition_column_ = partition_column(model)
+            if partition_column_ is None:
+                msg = '`allow_partitions` requires a primary key consisting of a single integer or string column'
+                raise IllegalArgumentError(msg)
+        if self.query_executor is not None and self.session is not None:
+            try:
+                bind = self.session.get_bind(mapper=sqlalchemy_inspect(model))
+            except (RuntimeError, SQLAlchemyError):
+                # The session is not bound yet, so the bind is checked by
+                # each count instead.
+                bind = None
+            if bind is not None and is_private_database(bind):
+                msg = ('`query_executor` requires a database that other connections can see, not an in-memory'
+                       ' SQLite database')
+                raise IllegalArgumentError(msg)
+        if cache_responses and self.cache is None:
+            msg = '`cache_responses` requires the `cache` argument of the APIManager constructor'
+            raise IllegalArgumentError(msg)
+        if upsert_columns is not None:
+            upsert_columns = [get_column_name(column) for column in upsert_columns]
+        if version_column is not None:
+            version_column = get_column_name(version_column)
+        if allow_ingest and serializer is not None and not hasattr(serializer, 'attributes_columns'):
+            msg = '`allow_ingest` requires a serializer with `attributes_columns` and `relationship_columns`'
+            raise IllegalArgumentError(msg)
+        if allow_aggregation and serializer is not None and not hasattr(serializer, 'attributes_columns'):
+            msg = '`allow_aggregation` requires a serializer with `attributes_columns`'
+            raise IllegalArgumentError(msg)
 
         # convert all method names to upper case
         methods = frozenset((m.upper() for m in methods))
         # the name of the API, for use in creating the view and the blueprint
         api_name = f'{collection_name}_api'
-        # Prepend the universal preprocessors and postprocessors specified in
-        # the constructor of this class.
-        preprocessors_: Dict[str, list] = defaultdict(list)
-        postprocessors_: Dict[str, list] = defaultdict(list)
-        preprocessors_.update(preprocessors or {})
-        postprocessors_.update(postprocessors or {})
-
-        for key, value in self.pre.items():
-            preprocessors_[key] = value + preprocessors_[key]
-
-        for key, value in self.post.items():
-            postprocessors_[key] = value + postprocessors_[key]
-
-        # Validate that all the additional attributes exist on the model.
-        if additional_attributes is not None:
-            for attr in additional_attributes:
-                if not hasattr(model, attr):
-                    raise AttributeError(f'no attribute "{attr}" on model {model}')
-
-        # find the primary_key of the model or try and use 'id'
-        if primary_key is None:
-            pk_names = primary_key_names(model)
-            primary_key = pk_names[0]
-
-        # Create a default serializer and deserializer if none have been
-        # provided.
-        if serializer is None:
-            serializer = DefaultSerializer(model, collection_name, self, primary_key=primary_key,
-                                           only=only, exclude=exclude, additional_attributes=additional_attributes,
-                                           allow_non_primary_key_id=allow_non_primary_key_id)
-
-        session = self.session
-        if deserializer is None:
-            deserializer = DefaultDeserializer(self.session, model, self, allow_client_generated_ids=allow_client_generated_ids)
-        # Create the view function for the API for this model.
-        api_view = API.as_view(api_name, session, model, self,
-                               # Keyword arguments for APIBase.__init__()
-                               preprocessors=preprocessors_,
-                               postprocessors=postprocessors_,
-                               primary_key=primary_key,
-                               validation_exceptions=validation_exceptions,
-                               allow_to_many_replacement=allow_to_many_replacement,
-                               # Keyword arguments for API.__init__()
-                               page_size=page_size,
-                               max_page_size=max_page_size,
-                               serializer=serializer,
-                               deserializer=deserializer,
-                               includes=includes)
-
-        # add the URL rules to the blueprint: the first is for methods on the
-        # collection only, the second is for methods which may or may not
-        # specify an instance, the third is for methods which must specify an
-        # instance
 
         if url_prefix is None:
             prefix = self.url_prefix
         else:
             prefix = url_prefix
 
-        blueprint = Blueprint(name, __name__, url_prefix=prefix)
-        add_rule = blueprint.add_url_rule
-
         # The URLs that will be routed below.
         collection_url = f'/{collection_name}'
         resource_url = f'{collection_url}/<resource_id>'
         related_resource_url = f'{resource_url}/<relation_name>'
         to_many_resource_url = f'{related_resource_url}/<related_resource_id>'
         relationship_url = f'{resource_url}/relationships/<relation_name>'
+        urls = {
+            'collection': collection_url,
+            'resource': resource_url,
+            'related': related_resource_url,
+            'to_many': to_many_resource_url,
+            'relationship': relationship_url,
+            'ingest': f'{collection_url}/ingest',
+            'export': f'{collection_url}/export',
+            'exports': f'{collection_url}/exports',
+            'export_job': f'{collection_url}/exports/<job_id>',
+            'export_result': f'{collection_url}/exports/<job_id>/result',
+        }
+
+        if self.single_dispatcher:
+            dispatcher = self.dispatchers.get(prefix)
+            if dispatcher is None:
+                dispatcher = self.dispatchers[prefix] = Dispatcher(name, prefix)
+            blueprint = dispatcher.blueprint
+
+            def add_rule(shape, view_func, methods, defaults=None):
+                dispatcher.add(collection_name, shape, view_func, methods, defaults)
+        else:
+            blueprint = Blueprint(name, __name__, url_prefix=prefix)
+
+            def add_rule(shape, view_func, methods, **options):
+                blueprint.add_url_rule(urls[shape], view_func=view_func, methods=methods, **options)
+
+        # The names of the view functions of the API.
+        view_names = {
+            'api': api_name,
+            'relationship': f'{api_name}_relationships',
+            'collection': f'{collection_name}_get_collection',
+            'resource': f'{collection_name}_get_resource',
+            'ingest': f'{api_name}_ingest',
+            'export': f'{api_name}_export',
+            'exports': f'{api_name}_exports',
+            'export_result': f'{api_name}_export_result',
+        }
 
+        # The export requests of each client are counted across requests.
+        rate_limiter = RateLimiter(export_rate_limit) if export_rate_limit is not None else None
+
+        def build():
+            """Inspects the model and creates the view functions of the API.
+
+            Returns a pair whose elements are a dictionary mapping the keys
+            of `view_names` to the view functions and the
+            :class:`~flask_restless.registry.APIInfo` for the API.
+
+            """
+            nonlocal version_column, primary_key, serializer, deserializer
+            if version_column is None:
+                mapper = sqlalchemy_inspect(model)
+                if mapper.version_id_col is not None:
+                    version_column = mapper.get_property_by_column(mapper.version_id_col).key
+
+            # Prepend the universal preprocessors and postprocessors specified in
+            # the constructor of this class.
+            preprocessors_: Dict[str, list] = defaultdict(list)
+            postprocessors_: Dict[str, list] = defaultdict(list)
+            preprocessors_.update(preprocessors or {})
+            postprocessors_.update(postprocessors or {})
+
+            for key, value in self.pre.items():
+                preprocessors_[key] = value + preprocessors_[key]
+
+            for key, value in self.post.items():
+                postprocessors_[key] = value + postprocessors_[key]
+
+            # Validate that all the additional attributes exist on the model.
+            if additional_attributes is not None:
+                for attr in additional_attributes:
+                    if not hasattr(model, attr):
+                        raise AttributeError(f'no attribute "{attr}" on model {model}')
+
+            # Inspect the model once, up front, so that requests only need to
+            # look up the result.
+            info = model_info(model)
+
+            # find the primary_key of the model or try and use 'id'
+            if primary_key is None:
+                primary_key = info.primary_keys[0]
+
+            # Create a default serializer and deserializer if none have been
+            # provided.
+            if serializer is None:
+                serializer = DefaultSerializer(model, collection_name, self, primary_key=primary_key,
+                                               only=only, exclude=exclude, additional_attributes=additional_attributes,
+                                               allow_non_primary_key_id=allow_non_primary_key_id)
+
+            session = self.session
+            if deserializer is None:
+                deserializer = DefaultDeserializer(self.session, model, self, allow_client_generated_ids=allow_client_generated_ids)
+            views = {}
+            # Create the view function for the API for this model.
+            views['api'] = API.as_view(view_names['api'], session, model, self,
+                                       # Keyword arguments for APIBase.__init__()
+                                       preprocessors=preprocessors_,
+                                       postprocessors=postprocessors_,
+                                       primary_key=primary_key,
+                                       validation_exceptions=validation_exceptions,
+                                       allow_to_many_replacement=allow_to_many_replacement,
+                                       # Keyword arguments for API.__init__()
+                                       page_size=page_size,
+                                       max_page_size=max_page_size,
+                                       serializer=serializer,
+                                       deserializer=deserializer,
+                                       includes=includes,
+                                       upsert_columns=upsert_columns,
+                                       use_returning=use_returning)
+
+            views['relationship'] = RelationshipAPI.as_view(
+                view_names['relationship'], session, model, self,
+                # Keyword arguments for APIBase.__init__()
+                preprocessors=preprocessors_,
+                postprocessors=postprocessors_,
+                primary_key=primary_key,
+                validation_exceptions=validation_exceptions,
+                allow_to_many_replacement=allow_to_many_replacement,
+                # Keyword arguments RelationshipAPI.__init__()
+                allow_delete_from_to_many_relationships=allow_delete_from_to_many_relationships
+            )
+
+            views['collection'] = FetchCollection.as_view(
+                name=view_names['collection'],
+                session=session,
+                model=model,
+                api_manager=self,
+                preprocessors=preprocessors_['GET_COLLECTION'],
+                postprocessors=postprocessors_['GET_COLLECTION'],
+                max_page_size=max_page_size,
+                page_size=page_size,
+                includes=includes,
+                version_column=version_column,
+                cache=self.cache if cache_responses else None,
+                deferred_join=deferred_join,
+                render_in_database=render_in_database,
+                snapshots=self.snapshot_store,
+                snapshot_views=snapshots,
+                partition_column=partition_column_,
+                allow_aggregation=allow_aggregation
+            )
+
+            views['resource'] = FetchResource.as_view(
+                name=view_names['resource'],
+                session=session,
+                model=model,
+                api_manager=self,
+                preprocessors=preprocessors_['GET_RESOURCE'],
+                postprocessors=postprocessors_['GET_RESOURCE'],
+                includes=includes,
+                version_column=version_column,
+                cache=self.cache if cache_responses else None
+            )
+
+            if allow_ingest:
+                views['ingest'] = IngestView.as_view(
+                    view_names['ingest'], session, model,
+                    ingest_columns(model, serializer, primary_key, allow_client_generated_ids),
+                    chunk_size=ingest_chunk_size,
+                    commit_per_chunk=ingest_commit_per_chunk,
+                    preprocessors=preprocessors_,
+                    postprocessors=postprocessors_
+                )
+
+            if allow_export:
+                views['export'] = ExportView.as_view(
+                    view_names['export'], session, model, self,
+                    max_rows=export_max_rows,
+                    rate_limiter=rate_limiter,
+                    preprocessors=preprocessors_
+                )
+
+            if allow_export_jobs:
+                for key, view_class in (('exports', ExportJobView), ('export_result', ExportResultView)):
+                    views[key] = view_class.as_view(
+                        view_names[key], session, model, self, self.export_jobs,
+                        max_rows=export_max_rows,
+                        rate_limiter=rate_limiter,
+                        preprocessors=preprocessors_
+                    )
+
+            api_info = registry.APIInfo(collection_name, blueprint.name, serializer, primary_key, prefix, version_column)
+            return views, api_info
+
+        # Unless the manager is lazy, build the API now; otherwise, the URL
+        # rules are routed to views that build it on the first request.
+        if self.lazy:
+            lazy_api = LazyAPI(build)
+            self.lazy_apis.append(lazy_api)
+            views = {key: lazy_api.view(key, view_name) for key, view_name in view_names.items()}
+        else:
+            views, api_info = build()
+        views = {key: self.wrap_view(view) for key, view in views.items()}
+
+        # add the URL rules to the blueprint: the first is for methods on the
+        # collection only, the second is for methods which may or may not
+        # specify an instance, the third is for methods which must specify an
+        # instance
+        #
         # Create relationship URL endpoints.
         #
         # Due to a limitation in Flask's routing (which is actually
@@ -597,68 +1149,36 @@ class APIManager:
         # :http:get:`/api/articles/1/relationships/author` interpret the
         # word `relationships` as the name of a relation of an article
         # object.
-        relationship_api_name = f'{api_name}_relationships'
-
-        relationship_api_view = RelationshipAPI.as_view(
-            relationship_api_name, session, model, self,
-            # Keyword arguments for APIBase.__init__()
-            preprocessors=preprocessors_,
-            postprocessors=postprocessors_,
-            primary_key=primary_key,
-            validation_exceptions=validation_exceptions,
-            allow_to_many_replacement=allow_to_many_replacement,
-            # Keyword arguments RelationshipAPI.__init__()
-            allow_delete_from_to_many_relationships=allow_delete_from_to_many_relationships
-        )
+        #
         # When PATCH is allowed, certain non-PATCH requests are allowed
         # on relationship URLs.
         relationship_methods = READONLY_METHODS & methods
         if 'PATCH' in methods:
             relationship_methods |= WRITEONLY_METHODS
-        add_rule(relationship_url, methods=relationship_methods,
-                 view_func=relationship_api_view)
-
-        get_collection_function = FetchCollection.as_view(
-            name=f'{collection_name}_get_collection',
-            session=session,
-            model=model,
-            api_manager=self,
-            preprocessors=preprocessors_['GET_COLLECTION'],
-            postprocessors=postprocessors_['GET_COLLECTION'],
-            max_page_size=max_page_size,
-            page_size=page_size,
-            includes=includes
-        )
+        add_rule('relationship', methods=relationship_methods,
+                 view_func=views['relationship'])
+
         if 'GET' in methods:
-            add_rule(collection_url, view_func=get_collection_function, methods=['GET'])
-
-        get_resource_function = FetchResource.as_view(
-            name=f'{collection_name}_get_resource',
-            session=session,
-            model=model,
-            api_manager=self,
-            preprocessors=preprocessors_['GET_RESOURCE'],
-            postprocessors=postprocessors_['GET_RESOURCE'],
-            includes=includes
-        )
+            add_rule('collection', view_func=views['collection'], methods=['GET'])
 
         # The URL for accessing the entire collection. (POST is special because
         # the :meth:`API.post` method doesn't have any arguments.)
         #
         # For example, /api/people.
         collection_methods = frozenset(('POST', )) & methods
-        add_rule(collection_url, view_func=api_view,
+        add_rule('collection', view_func=views['api'],
                  methods=collection_methods)
 
-        # The URL for accessing a single resource. (DELETE and PATCH are
-        # special because the :meth:`API.delete` and :meth:`API.patch` methods
-        # don't have the `relationname` and `relationinstid` arguments.)
+        # The URL for accessing a single resource. (DELETE, PATCH, and PUT are
+        # special because the :meth:`API.delete`, :meth:`API.patch`, and
+        # :meth:`API.put` methods don't have the `relationname` and
+        # `relationinstid` arguments.)
         #
         # For example, /api/people/1.
-        resource_methods = frozenset(('DELETE', 'PATCH')) & methods
-        add_rule(resource_url, view_func=api_view, methods=resource_methods)
+        resource_methods = (frozenset(('DELETE', 'PATCH')) | UPSERT_METHODS) & methods
+        add_rule('resource', view_func=views['api'], methods=resource_methods)
         resource_methods = READONLY_METHODS & methods
-        add_rule(resource_url, view_func=get_resource_function, methods=resource_methods)
+        add_rule('resource', view_func=views['resource'], methods=resource_methods)
 
         # The URL for accessing a related resource, which may be a to-many or a
         # to-one relationship.
@@ -666,7 +1186,7 @@ class APIManager:
         # For example, /api/people/1/articles.
         related_resource_methods = READONLY_METHODS & methods
         related_resource_defaults = dict(related_resource_id=None)
-        add_rule(related_resource_url, view_func=api_view,
+        add_rule('related', view_func=views['api'],
                  methods=related_resource_methods,
                  defaults=related_resource_defaults)
 
@@ -674,16 +1194,100 @@ class APIManager:
         #
         # For example, /api/people/1/articles/1.
         to_many_resource_methods = READONLY_METHODS & methods
-        add_rule(to_many_resource_url, view_func=api_view,
+        add_rule('to_many', view_func=views['api'],
                  methods=to_many_resource_methods)
 
+        # The URL for loading many resources at once.
+        #
+        # For example, /api/people/ingest.
+        if allow_ingest:
+            add_rule('ingest', view_func=views['ingest'], methods=['POST'])
+
+        # The URL for streaming the whole collection.
+        #
+        # For example, /api/people/export.
+        if allow_export:
+            add_rule('export', view_func=views['export'], methods=['GET'])
+
+        # The URLs for starting export jobs and following their progress.
+        #
+        # For example, /api/people/exports/1a2b/result.
+        if allow_export_jobs:
+            add_rule('exports', view_func=views['exports'], methods=['POST'])
+            add_rule('export_job', view_func=views['exports'], methods=['GET'])
+            add_rule('export_result', view_func=views['export_result'], methods=['GET'])
+
         # Finally, record that this APIManager instance has created an API for
         # the specified model.
-        api_info = registry.APIInfo(collection_name, blueprint.name, serializer, primary_key, prefix)
-        self.created_apis_for[model] = api_info
-        registry.add(model, api_info)
+        if self.lazy:
+            self.created_apis_for.defer(model, lazy_api)
+        else:
+            self.created_apis_for.add(model, api_info)
         return blueprint
 
+    def wrap_view(self, view_func):
+        """Returns the function routed to for the given view function of an
+        API created by this manager.
+
+        This implementation returns `view_func` itself; subclasses may
+        override it to adapt every view, as
+        :class:`~flask_restless.aio.AsyncAPIManager` does.
+
+        """
+        return view_func
+
+    def warmup(self, freeze=False):
+        """Builds the APIs created by this manager along with the state they
+        otherwise compute on their first requests.
+
+        For each API, this builds the serializer and views (if the `lazy`
+        argument of the constructor is ``True``), the model metadata, the
+        loader options for fetching resources without included resources,
+        the tables on which cached responses depend, and the statements
+        that look up a resource by its primary key and fetch the
+        collection. The statements are compiled for the database of the
+        session, if the session can tell what it is; with Flask-SQLAlchemy,
+        call this method within an application context.
+
+        Call this method once all APIs have been created in order to
+        detect configuration errors at startup and to avoid the latency of
+        the first requests. In a server that forks worker processes after
+        loading the application, such as Gunicorn with ``preload_app``,
+        the workers then start with everything built.
+
+        If `freeze` is ``True``, all objects tracked by the garbage
+        collector are then moved to a permanent generation with
+        :func:`gc.freeze`. Otherwise, the garbage collector of each worker
+        would eventually touch the memory pages holding these objects,
+        copying pages that the workers could have kept sharing with the
+        parent process.
+
+        """
+        for lazy_api in self.lazy_apis:
+            lazy_api.get()
+        self.created_apis_for.build_pending()
+        for model, api_info in list(self.created_apis_for.items()):
+            model_info(model)
+            get_relations(model)
+            has_custom_query(model)
+            primary_key_column(model, api_info.primary_key)
+            statements = [primary_key_statement(model, api_info.primary_key)]
+            cached_loader_options(self, model, (), api_info.serializer, False)
+            if self.cache is not None or self.fragment_cache is not None:
+                model_dependencies(model)
+            try:
+                dialect = self.session.get_bind(mapper=sqlalchemy_inspect(model)).dialect
+                statements.append(search(self.session, model, filters=[], sort=[]).statement)
+            except (RuntimeError, SQLAlchemyError):
+                # The session is not bound yet, or the query of the model
+                # needs an application context.
+                continue
+            for statement in statements:
+                statement.compile(dialect=dialect)
+        if freeze:
+            gc.collect()
+            gc.freeze()
+
     def serialize_relationship(self, instance):
         model = get_model(instance)
         return {
@@ -764,6 +1368,10 @@ class APIManager:
         """
         blueprint_name = str(uuid1())
         blueprint = self.create_api_blueprint(blueprint_name, *args, **kw)
+        # With a single dispatcher, APIs with the same URL prefix share a
+        # blueprint, which must be registered only once.
+        if blueprint in self.blueprints:
+            return
         # Store the created blueprint
         self.blueprints.append(blueprint)
         # If a Flask application was provided in the constructor of this
@@ -14,8 +14,11 @@ from .typehints import Model
 #:   model exposed by this API.
 #: - `primary_key`, the primary key used by the model
 #: - `url_prefix`, the url prefix to use for the collection
+#: - `version_column`, the name of the column whose value changes whenever
+#:   an instance of the model changes, if any
 #:
-APIInfo = namedtuple('APIInfo', ['collection_name', 'blueprint_name', 'serializer', 'primary_key', 'url_prefix'])
+APIInfo = namedtuple('APIInfo', ['collection_name', 'blueprint_name', 'serializer', 'primary_key', 'url_prefix', 'version_column'],
+                     defaults=[None])
 
 
 _registry: Dict[Model, APIInfo] = {}
@@ -0,0 +1,146 @@
+# routing.py - routing requests for many APIs through a few URL rules
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Routing of requests to the views of many APIs through a small, fixed
+set of URL rules.
+
+By default, each API created by :class:`~flask_restless.APIManager` is a
+blueprint with its own URL rules, so the number of rules in the URL map of
+the application grows with the number of models. A :class:`Dispatcher`
+instead registers one rule per URL shape (collection, resource, related
+resource and so on) and looks up the views of the model in a dictionary
+keyed by collection name.
+
+"""
+from typing import Dict
+from typing import Tuple
+
+from flask import Blueprint
+from flask import abort
+from flask import current_app
+from flask import request
+from werkzeug.exceptions import MethodNotAllowed
+
+#: The URL rules registered by a :class:`Dispatcher`, as pairs of URL rule
+#: and the name of the shape of the URLs it matches.
+#:
+#: Werkzeug prefers rules with more static parts, so the ``relationships``
+#: rule takes precedence over the rule for to-many related resources.
+RULES = (
+    ('/<collection_name>', 'collection'),
+    ('/<collection_name>/<resource_id>', 'resource'),
+    ('/<collection_name>/<resource_id>/<relation_name>', 'related'),
+    ('/<collection_name>/<resource_id>/<relation_name>/<related_resource_id>', 'to_many'),
+    ('/<collection_name>/<resource_id>/relationships/<relation_name>', 'relationship'),
+)
+
+#: The names of the actions on a collection whose URLs, such as
+#: ``/<collection_name>/ingest``, are routed to their own views.
+COLLECTION_ACTIONS = frozenset(('ingest', 'export', 'exports'))
+
+#: The methods accepted by the rules of a :class:`Dispatcher`; the methods
+#: allowed for each model are checked when the request is dispatched.
+DISPATCHED_METHODS = ('GET', 'HEAD', 'OPTIONS', 'POST', 'PATCH', 'PUT', 'DELETE')
+
+
+def action_route(shape, kw):
+    """Returns the pair of shape and keyword arguments of the view for the
+    action on a collection at a URL of the given `shape` with the keyword
+    arguments `kw`, or ``None`` if the URL is not that of an action.
+
+    """
+    action = kw.get('resource_id')
+    if action not in COLLECTION_ACTIONS:
+        return None
+    if shape == 'resource':
+        return action, {}
+    # For example, /<collection_name>/exports/<job_id>/result.
+    if action == 'exports' and shape == 'related':
+        return 'export_job', {'job_id': kw['relation_name']}
+    if action == 'exports' and shape == 'to_many' and kw['related_resource_id'] == 'result':
+        return 'export_result', {'job_id': kw['relation_name']}
+    return None
+
+
+class Dispatcher:
+    """Routes the requests for all APIs with the same URL prefix to the
+    views of the requested model.
+
+    `name` is the name of the blueprint, returned by :attr:`blueprint`,
+    which holds the URL rules. `url_prefix` is the URL prefix of the
+    blueprint.
+
+    """
+
+    def __init__(self, name, url_prefix):
+        self.url_prefix = url_prefix
+
+        #: Maps collection names to dictionaries that map the name of a
+        #: URL shape to a dictionary from HTTP method to pairs of view
+        #: function and keyword arguments for it.
+        self.routes: Dict[str, Dict[str, Dict[str, Tuple]]] = {}
+
+        self.blueprint = Blueprint(name, __name__, url_prefix=url_prefix)
+        for rule, shape in RULES:
+            self.blueprint.add_url_rule(rule, endpoint=shape, view_func=self.dispatch, methods=DISPATCHED_METHODS,
+                                        defaults={'shape': shape}, provide_automatic_options=False)
+
+    def add(self, collection_name, shape, view_func, methods, defaults=None):
+        """Routes requests with any of the given HTTP `methods` to URLs of
+        the given `shape` for `collection_name` to `view_func`.
+
+        `shape` is one of the names in :data:`RULES`, one of
+        :data:`COLLECTION_ACTIONS` for the URL of that action on the
+        collection, or ``'export_job'`` or ``'export_result'`` for the URLs
+        of an export job. `defaults` is a dictionary of additional keyword
+        arguments for the view function.
+
+        """
+        views = self.routes.setdefault(collection_name, {}).setdefault(shape, {})
+        for method in methods:
+            views[method] = (view_func, defaults or {})
+
+    def allowed_methods(self, views):
+        """Returns the set of HTTP methods allowed by the given dictionary
+        of views, including the methods that Flask adds automatically.
+
+        """
+        methods = set(views)
+        if 'GET' in methods:
+            methods.add('HEAD')
+        methods.add('OPTIONS')
+        return methods
+
+    def dispatch(self, shape, collection_name, **kw):
+        """Calls the view for the shape of the requested URL, the requested
+        collection and the method of the request.
+
+        Responds with :http:statuscode:`404` if there is no API for the
+        collection and :http:statuscode:`405` if the API does not allow
+        the method of the request at this URL.
+
+        """
+        routes = self.routes.get(collection_name)
+        if routes is None:
+            abort(404)
+        # The URLs of the actions have the shapes of other URLs, but take
+        # precedence over them, like static URL rules would.
+        action = action_route(shape, kw)
+        if action is not None and request.method in routes.get(action[0], ()):
+            shape, kw = action
+        views = routes.get(shape, {})
+        if request.method == 'OPTIONS':
+            response = current_app.response_class()
+            response.allow.update(self.allowed_methods(views))
+            return response
+        method = 'GET' if request.method == 'HEAD' else request.method
+        try:
+            view_func, defaults = views[method]
+        except KeyError:
+            raise MethodNotAllowed(valid_methods=sorted(self.allowed_methods(views)))
+        # The views of an asynchronous manager are coroutine functions.
+        return current_app.ensure_sync(view_func)(**defaults, **kw)
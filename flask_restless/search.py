@@ -28,9 +28,9 @@ from sqlalchemy.orm.attributes import InstrumentedAttribute
 from .exceptions import BadRequest
 from .helpers import get_related_association_proxy_model
 from .helpers import get_related_model
+from .helpers import model_info
 from .helpers import primary_key_names
 from .helpers import session_query
-from .helpers import string_to_datetime
 
 try:
     # SQLAlchemy 1.3+
@@ -231,7 +231,7 @@ class Filter(object):
             otherfield = dictionary.get('field')
             argument = dictionary.get('val')
             # Need to deal with the special case of converting dates.
-            argument = string_to_datetime(model, fieldname, argument)
+            argument = model_info(model).convert(fieldname, argument)
             return Filter(fieldname, operator, argument, otherfield)
         # For the sake of brevity, rename this method.
         from_dict = Filter.from_dictionary
@@ -39,15 +39,12 @@ from sqlalchemy import inspect
 from sqlalchemy.orm.base import MANYTOONE
 
 from .helpers import attribute_columns
-from .helpers import foreign_keys
 from .helpers import get_by
 from .helpers import get_column_name
 from .helpers import get_related_model
 from .helpers import get_relations
-from .helpers import has_field
 from .helpers import is_like_list
-from .helpers import primary_key_names
-from .helpers import strings_to_datetimes
+from .helpers import model_info
 
 #: Names of columns which should definitely not be considered user columns to
 #: be included in a dictionary representation of a model.
@@ -347,7 +344,8 @@ class DefaultSerializer(Serializer):
         self._api_manager = api_manager
         self._model = model
         self._type = type_name
-        pk_names = primary_key_names(model)
+        info = model_info(model)
+        pk_names = info.primary_keys
         if primary_key:
             if not allow_non_primary_key_id and primary_key not in pk_names:
                 raise ValueError(f'Column `{primary_key}` is not a primary key')
@@ -385,7 +383,7 @@ class DefaultSerializer(Serializer):
         # JSON API 1.0: Although has-one foreign keys (e.g. author_id) are often stored internally alongside other information to be represented in a resource
         # object, these keys SHOULD NOT appear as attributes
         # https://jsonapi.org/format/#document-resource-object-attributes
-        columns -= set(foreign_keys(model))
+        columns -= set(info.foreign_keys)
 
         # Exclude column names that are on the exclude list.
         columns = {column for column in columns if not column.startswith('__') and column not in COLUMN_EXCLUDE_LIST}
@@ -575,16 +573,17 @@ class DefaultDeserializer(Deserializer):
         expected_type = self.api_manager.collection_name(self.model)
         if type_ != expected_type:
             raise ConflictingType(expected_type, type_)
+        info = model_info(self.model)
         # Check for any request parameter naming a column which does not exist
         # on the current model.
         for field in data:
             if field == 'relationships':
                 for relation in data['relationships']:
-                    if not has_field(self.model, relation):
+                    if not info.has_field(relation):
                         raise UnknownRelationship(relation)
             elif field == 'attributes':
                 for attribute in data['attributes']:
-                    if not has_field(self.model, attribute):
+                    if not info.has_field(attribute):
                         raise UnknownAttribute(attribute)
         # Determine which related instances need to be added.
         links = {}
@@ -607,7 +606,7 @@ class DefaultDeserializer(Deserializer):
         attributes = data.pop('attributes', {})
         # Special case: if there are any dates, convert the string form of the
         # date into an instance of the Python ``datetime`` object.
-        attributes = strings_to_datetimes(self.model, attributes)
+        attributes = info.convert_all(attributes)
         data.update(attributes)
         # Create the new instance by keyword attributes.
         instance = self.model(**data)
@@ -0,0 +1,258 @@
+# snapshots.py - precomputed documents of whole collections
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Snapshots of whole collections, rendered to files and served from
+memory-mapped views of these files.
+
+A :class:`SnapshotStore` keeps one file per snapshot in a directory that
+the processes of a host may share. Like the other caches of
+:mod:`flask_restless.cache`, it records the generation token of each table
+on which a snapshot depends, so that a snapshot is rendered again as soon
+as a tracked session commits changes to one of its tables. Until then, and
+for snapshots older than the refresh interval, the previous snapshot is
+served while the new one is rendered in the background.
+
+"""
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .cache import CacheBackend
+from .cache import TrackedCache
+
+#: The number of bytes at the start of a snapshot file that hold its
+#: metadata, as JSON padded with spaces.
+HEADER_SIZE = 1024
+
+
+def file_identity(stat):
+    """Returns a value that changes when the file with the given
+    :func:`os.stat` result is replaced.
+
+    """
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class SnapshotReader(io.RawIOBase):
+    """A read-only, seekable file over the bytes of a
+    :class:`memoryview`.
+
+    Each request reads a snapshot through a reader of its own, so that
+    concurrent requests do not share a file position.
+
+    """
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class Snapshot:
+    """A rendered snapshot, memory-mapped from the file at `path`.
+
+    The file starts with a header of :data:`HEADER_SIZE` bytes holding
+    the metadata of the snapshot, followed by the body of the document.
+
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            #: The identity of the file, which changes when it is replaced.
+            self.identity = file_identity(os.fstat(file.fileno()))
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        meta = json.loads(self._mmap[:HEADER_SIZE])
+        #: The generation tokens of the tables at the time of rendering.
+        self.tokens = meta['tokens']
+        #: The time at which the snapshot was rendered, in seconds since
+        #: the epoch.
+        self.created = meta['created']
+        #: The hash of the body, for use as an entity tag.
+        self.etag = meta['etag']
+        #: The size of the body in bytes.
+        self.size = len(self._mmap) - HEADER_SIZE
+
+    def reader(self) -> SnapshotReader:
+        """Returns a new file-like object for reading the body."""
+        return SnapshotReader(memoryview(self._mmap)[HEADER_SIZE:])
+
+
+class SnapshotStore(TrackedCache):
+    """Stores snapshots of whole collections in files in the directory
+    `directory`.
+
+    A snapshot is rendered again when a session tracked with
+    :meth:`~flask_restless.cache.TrackedCache.track` commits changes to
+    one of the tables on which it depends, or when it is older than
+    `interval` seconds, since it may depend on changes made other than
+    through a tracked session. In both cases, the previous snapshot is
+    still served while the new one is rendered in the background, so
+    that requests never wait for a collection to be rendered, except for
+    the first one.
+
+    `backend` stores the generation tokens of the tables, as described
+    in :class:`~flask_restless.cache.TrackedCache`; it should be shared
+    by the processes that share `directory`.
+
+    For more information, see :ref:`snapshots`.
+
+    """
+
+    def __init__(self, directory: str, interval: float = 60, backend: Optional[CacheBackend] = None,
+                 key_prefix: str = 'restless:'):
+        super().__init__(backend, interval, key_prefix)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+        #: The snapshots mapped by this process, by key.
+        self._snapshots: dict = {}
+        #: The locks that let one thread at a time render each snapshot.
+        self._render_locks: dict = {}
+        #: The keys of the snapshots being rendered in the background.
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='flask-restless-snapshot')
+
+    def path(self, key: str) -> str:
+        """Returns the path of the file of the snapshot `key`."""
+        return os.path.join(self.directory, f'{hashlib.sha1(key.encode()).hexdigest()}.snapshot')
+
+    def _load(self, key):
+        """Returns the current snapshot `key`, or ``None`` if it has not
+        been rendered.
+
+        """
+        path = self.path(key)
+        try:
+            identity = file_identity(os.stat(path))
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot is not None and snapshot.identity == identity:
+            return snapshot
+        try:
+            snapshot = Snapshot(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._snapshots[key] = snapshot
+        return snapshot
+
+    def get(self, key: str, tables, render) -> Snapshot:
+        """Returns the snapshot `key`, which depends on the tables whose
+        names are given in `tables`.
+
+        If there is no snapshot, it is rendered by calling `render` with a
+        binary file to which it writes the body. If the snapshot is no
+        longer valid or is older than the refresh interval, it is returned
+        and rendered again in the background.
+
+        """
+        tokens = self.tokens(tables)
+        snapshot = self._load(key)
+        if snapshot is None:
+            with self._lock:
+                lock = self._render_locks.setdefault(key, threading.Lock())
+            with lock:
+                # Another thread may have rendered it in the meantime.
+                snapshot = self._load(key)
+                if snapshot is None:
+                    snapshot = self.refresh(key, tables, render)
+        elif snapshot.tokens != tokens or snapshot.created + self.interval <= time.time():
+            with self._lock:
+                start = key not in self._refreshing
+                self._refreshing.add(key)
+            if start:
+                self.executor.submit(self._refresh_in_background, key, tables, render)
+        return snapshot
+
+    def _refresh_in_background(self, key, tables, render):
+        try:
+            self.refresh(key, tables, render)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def refresh(self, key: str, tables, render) -> Snapshot:
+        """Renders the snapshot `key` with `render`, as described in
+        :meth:`get`, and returns it.
+
+        """
+        # The tokens are taken before rendering, so that the snapshot is
+        # invalid if the tables change in the meantime.
+        tokens = self.tokens(tables)
+        created = time.time()
+        fd, partial_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'w+b') as file:
+                file.write(b' ' * HEADER_SIZE)
+                body = HashingWriter(file)
+                render(body)
+                header = json.dumps({'tokens': tokens, 'created': created, 'etag': body.hexdigest()}).encode()
+                if len(header) >= HEADER_SIZE:
+                    raise ValueError('Snapshot depends on too many tables')
+                file.seek(0)
+                file.write(header.ljust(HEADER_SIZE - 1) + b'\n')
+            # Processes that mapped the previous file keep reading it.
+            os.replace(partial_path, self.path(key))
+        except BaseException:
+            os.remove(partial_path)
+            raise
+        return self._load(key)
+
+    def shutdown(self, wait: bool = True):
+        """Stops the background refresher, waiting for the snapshots being
+        rendered if `wait` is ``True``.
+
+        """
+        self.executor.shutdown(wait=wait)
+
+
+class HashingWriter:
+    """Writes bytes to `file` while computing their hash."""
+
+    def __init__(self, file):
+        self._file = file
+        self._hash = hashlib.sha1()
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
@@ -17,9 +17,15 @@ The main class in this module, :class:`APIBase`, is a
 for JSON API requests on a SQLAlchemy backend.
 
 """
+import hashlib
 import math
 import re
 from collections import defaultdict
+from copy import deepcopy
+from datetime import datetime
+from datetime import timezone
+from decimal import Decimal
+from functools import lru_cache
 from functools import partial
 from functools import wraps
 from http import HTTPStatus
@@ -27,6 +33,8 @@ from itertools import chain
 from typing import Optional
 from typing import Set
 from typing import Tuple
+from urllib.parse import parse_qsl
+from urllib.parse import quote
 from urllib.parse import urlparse
 from urllib.parse import urlunparse
 
@@ -36,26 +44,38 @@ from flask import json
 from flask import request
 from flask.views import MethodView
 from flask.views import View
+from sqlalchemy import DateTime
 from sqlalchemy import inspect
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import load_only
 from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.dynamic import DynamicAttributeImpl
 from sqlalchemy.orm.query import Query
 from sqlalchemy.sql import false as FALSE
+from sqlalchemy.sql import func
 from sqlalchemy.sql.elements import BinaryExpression
 from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date
 from werkzeug.http import parse_options_header
+from werkzeug.http import quote_etag
+from werkzeug.wsgi import wrap_file
 
+from ..cache import CachedResponse
+from ..cache import dependencies
+from ..cache import dumps_document
+from ..cache import to_many_linkage_tables
 from ..exceptions import BadRequest
 from ..exceptions import Error
 from ..exceptions import NotFound
+from ..helpers import coerce_primary_key
 from ..helpers import get_inclusions_for_instances
 from ..helpers import get_model
 from ..helpers import get_related_model
 from ..helpers import is_like_list
 from ..helpers import is_proxy
 from ..helpers import query_by_primary_key
+from ..helpers import request_memo
 from ..helpers import session_query
 from ..search import ComparisonToNull
 from ..search import search
@@ -64,8 +84,15 @@ from ..serialization import DeserializationException
 from ..serialization import SerializationException
 from ..serialization import Serializer
 from ..typehints import ResponseTuple
+from .helpers import aggregate
+from .helpers import aggregate_value
+from .helpers import collection_version
 from .helpers import count
+from .helpers import count_concurrently
+from .helpers import deferred_join_page
+from .helpers import partition_boundaries
 from .helpers import upper_keys as upper
+from .rendering import render_page
 
 #: The Content-Type we expect for most requests to APIs.
 #:
@@ -105,6 +132,34 @@ PAGE_NUMBER_PARAM = 'page[number]'
 #: :https:method:`get` request.
 PAGE_SIZE_PARAM = 'page[size]'
 
+#: The query parameter key that identifies the partition of a collection,
+#: given as ``k/N``, in a :https:method:`get` request.
+PAGE_PARTITION_PARAM = 'page[partition]'
+
+#: The query parameter key that identifies the primary key after which a
+#: page of a partition starts in a :https:method:`get` request.
+PAGE_AFTER_PARAM = 'page[after]'
+
+#: A regular expression for the query parameter keys that request
+#: aggregates of a collection, such as ``aggregate[sum]``.
+AGGREGATE_PARAM_RE = re.compile(r'^aggregate\[(\w+)\]$')
+
+#: The query parameter key that identifies the fields by which aggregates
+#: are grouped in a :https:method:`get` request.
+GROUP_BY_PARAM = 'group_by'
+
+#: The aggregate functions that may be requested for a collection.
+AGGREGATE_FUNCTIONS = {
+    'count': func.count,
+    'sum': func.sum,
+    'min': func.min,
+    'max': func.max,
+}
+
+#: The query parameter key that identifies the snapshot of a collection in a
+#: :https:method:`get` request.
+SNAPSHOT_PARAM = 'snapshot'
+
 #: A regular expression for Accept headers.
 #:
 #: For an explanation of "media-range", etc., see Sections 5.3.{1,2} of
@@ -126,6 +181,10 @@ ACCEPT_RE = re.compile(
         )?                      # accept params are optional
     ''', re.VERBOSE)
 
+#: The maximum number of distinct header values and query strings whose
+#: parsed form is cached; clients tend to reuse a small set of them.
+PARSE_CACHE_SIZE = 256
+
 #: Keys in a JSON API error object.
 ERROR_FIELDS = ('id_', 'links', 'status', 'code_', 'title', 'detail', 'source',
                 'meta')
@@ -142,24 +201,31 @@ def collection_parameters():
 
     """
     try:
-        # Determine filtering options.
+        # Determine filtering options. The filters are decoded for each
+        # request, since preprocessors may modify them in place.
         filters = json.loads(request.args.get(FILTER_PARAM, '[]'))
-
-        # Determine sorting options.
-        sort = request.args.get(SORT_PARAM)
-        if sort:
-            if sort == '0':
-                # '0' disables default sorting
-                sort = None
-            else:
-                sort = [('-', value[1:]) if value.startswith('-') else ('+', value)
-                        for value in sort.split(',')]
-        else:
-            sort = []
     except (TypeError, KeyError, ValueError) as e:
         raise BadRequest(cause=e, details='Unable to decode filter objects as JSON list') from e
 
-    return filters, sort
+    # Determine sorting options.
+    sort = parsed_request().sort
+    return filters, None if sort is None else list(sort)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_sort(value):
+    """Returns the tuple of ``(direction, field)`` pairs given by the
+    value of the ``sort`` query parameter.
+
+    Returns an empty tuple if `value` is empty or ``None``, and ``None``
+    if `value` is ``'0'``, which disables the default sorting.
+
+    """
+    if not value:
+        return ()
+    if value == '0':
+        return None
+    return tuple(('-', field[1:]) if field.startswith('-') else ('+', field) for field in value.split(','))
 
 
 class PaginationError(Exception):
@@ -325,42 +391,53 @@ def requires_json_api_accept(func):
         correct JSON API :https:header:`Accept` header.
 
         """
-        header = request.headers.get('Accept')
-        # If there is no Accept header, we don't need to do anything.
-        if header is None:
-            return func(*args, **kw)
-        header_pairs = list(parse_accept_header(header))
-        # If the Accept header is empty, then do nothing.
-        #
-        # An empty Accept header is technically allowed by RFC 2616,
-        # Section 14.1 (for more information, see
-        # https://stackoverflow.com/a/12131993/108197). Since an empty
-        # Accept header doesn't violate JSON APIs rule against having
-        # only JSON API mimetypes with media type parameters, we simply
-        # proceed as normal with the request.
-        if len(header_pairs) == 0:
-            return func(*args, **kw)
-        jsonapi_pairs = [(name, extra) for name, extra in header_pairs
-                         if name.startswith(CONTENT_TYPE)]
-        # If there are Accept headers but none of them specifies the
-        # JSON API media type, respond with `406 Not Acceptable`.
-        if len(jsonapi_pairs) == 0:
-            detail = ('Accept header, if specified, must be the JSON API media'
-                      ' type: application/vnd.api+json')
-            return error_response(406, detail=detail)
-        # If there are JSON API Accept headers, but they all have media
-        # type parameters, respond with `406 Not Acceptable`.
-        if all(extra is not None for name, extra in jsonapi_pairs):
-            detail = ('Accept header contained JSON API content type, but each'
-                      ' instance occurred with media type parameters; at least'
-                      ' one instance must appear without parameters (the part'
-                      ' after the semicolon)')
+        detail = accept_error(request.headers.get('Accept'))
+        if detail is not None:
             return error_response(406, detail=detail)
-        # At this point, everything is fine, so just execute the method as-is.
         return func(*args, **kw)
     return new_func
 
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def accept_error(header):
+    """Returns the detail of the :https:status:`406` error for the given
+    :https:header:`Accept` header, or ``None`` if the header is acceptable.
+
+    The result depends only on the value of the header, so it is cached.
+    For more information, see :func:`requires_json_api_accept`.
+
+    """
+    # If there is no Accept header, we don't need to do anything.
+    if header is None:
+        return None
+    header_pairs = list(parse_accept_header(header))
+    # If the Accept header is empty, then do nothing.
+    #
+    # An empty Accept header is technically allowed by RFC 2616,
+    # Section 14.1 (for more information, see
+    # https://stackoverflow.com/a/12131993/108197). Since an empty
+    # Accept header doesn't violate JSON APIs rule against having
+    # only JSON API mimetypes with media type parameters, we simply
+    # proceed as normal with the request.
+    if len(header_pairs) == 0:
+        return None
+    jsonapi_pairs = [(name, extra) for name, extra in header_pairs
+                     if name.startswith(CONTENT_TYPE)]
+    # If there are Accept headers but none of them specifies the
+    # JSON API media type, respond with `406 Not Acceptable`.
+    if len(jsonapi_pairs) == 0:
+        return ('Accept header, if specified, must be the JSON API media'
+                ' type: application/vnd.api+json')
+    # If there are JSON API Accept headers, but they all have media
+    # type parameters, respond with `406 Not Acceptable`.
+    if all(extra is not None for name, extra in jsonapi_pairs):
+        return ('Accept header contained JSON API content type, but each'
+                ' instance occurred with media type parameters; at least'
+                ' one instance must appear without parameters (the part'
+                ' after the semicolon)')
+    return None
+
+
 def requires_json_api_mimetype(func):
     """Decorator that requires requests *that include data* have the
     :https:header:`Content-Type` header required by the JSON API
@@ -383,36 +460,80 @@ def requires_json_api_mimetype(func):
 
         """
         # GET and DELETE requests don't have request data in JSON API,
-        # so we can ignore those and only continue if this is a PATCH or
-        # POST request.
+        # so we can ignore those and only continue if this is a PATCH,
+        # POST, or PUT request.
         #
         # Ideally we would be able to decorate each individual request
         # methods directly, but it is not possible with the current
         # design of Flask's method-based views.
-        if request.method not in ('PATCH', 'POST'):
+        if request.method not in ('PATCH', 'POST', 'PUT'):
             return func(*args, **kw)
-        header = request.headers.get('Content-Type')
-        content_type, extra = parse_options_header(header)
-        content_is_json = content_type.startswith(CONTENT_TYPE)
-        # Request must have the Content-Type: application/vnd.api+json header,
-        if not content_is_json:
-            detail = f'Request must have "Content-Type: {CONTENT_TYPE}" header'
-            return error_response(415, detail=detail)
-        # JSON API requires that the content type header does not have
-        # any media type parameters.
-        if extra:
-            detail = f'Content-Type header must not have any media type parameters but found {extra}'
+        detail = content_type_error(request.headers.get('Content-Type'))
+        if detail is not None:
             return error_response(415, detail=detail)
         return func(*args, **kw)
     return new_func
 
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def content_type_error(header):
+    """Returns the detail of the :https:status:`415` error for the given
+    :https:header:`Content-Type` header, or ``None`` if the header is the
+    JSON API media type.
+
+    The result depends only on the value of the header, so it is cached.
+
+    """
+    content_type, extra = parse_options_header(header)
+    # Request must have the Content-Type: application/vnd.api+json header,
+    if not content_type.startswith(CONTENT_TYPE):
+        return f'Request must have "Content-Type: {CONTENT_TYPE}" header'
+    # JSON API requires that the content type header does not have
+    # any media type parameters.
+    if extra:
+        return f'Content-Type header must not have any media type parameters but found {extra}'
+    return None
+
+
+def requires_json_api(func):
+    """Decorator that checks the :https:header:`Accept` and
+    :https:header:`Content-Type` headers of a request in a single step.
+
+    This is equivalent to decorating `func` with both
+    :func:`requires_json_api_accept` and :func:`requires_json_api_mimetype`,
+    with one function call per request instead of two.
+
+    """
+    @wraps(func)
+    def new_func(*args, **kw):
+        """Executes ``func(*args, **kw)`` only after checking for the
+        correct JSON API headers.
+
+        """
+        detail = accept_error(request.headers.get('Accept'))
+        if detail is not None:
+            return error_response(406, detail=detail)
+        if request.method in ('PATCH', 'POST', 'PUT'):
+            detail = content_type_error(request.headers.get('Content-Type'))
+            if detail is not None:
+                return error_response(415, detail=detail)
+        return func(*args, **kw)
+    return new_func
+
+
 def mime_renderer(func):
 
     @wraps(func)
     def new_func(*args, **kw):
-        data, status_code, headers = func(*args, **kw)
-        return Response(response=json.dumps(data), status=status_code, mimetype=CONTENT_TYPE, headers=headers)
+        result = func(*args, **kw)
+        # Responses read from the cache are already rendered.
+        if isinstance(result, Response):
+            return result
+        data, status_code, headers = result
+        # A 304 Not Modified response must not have a body.
+        if status_code == 304:
+            return Response(status=status_code, headers=headers)
+        return Response(response=dumps_document(data), status=status_code, mimetype=CONTENT_TYPE, headers=headers)
     return new_func
 
 
@@ -475,7 +596,8 @@ def parse_sparse_fields(type_=None):
     """Get the sparse fields as requested by the client.
 
     Returns a dictionary mapping resource type names to set of fields to
-    include for that resource.
+    include for that resource. The dictionary is shared by all requests
+    with the same query string, so it must not be modified.
 
     For example, if the client requests::
 
@@ -492,13 +614,73 @@ def parse_sparse_fields(type_=None):
         >>> parse_sparse_fields('articles')
         {'title', 'body'}
 
+    """
+    fields = parsed_request().sparse_fields
+    return fields.get(type_) if type_ is not None else fields
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def sparse_fields_from(query_string):
+    """Returns the dictionary mapping resource type names to the frozen set
+    of fields requested by the given raw query string of a request.
+
+    Since the result depends only on the query string, it is cached and
+    shared between requests, so it must not be modified.
+
     """
     # TODO use a regular expression to ensure field parameters are of the
     # correct format? (maybe ``fields\[[^\[\]\.]*\]``)
-    fields = {key[7:-1]: set(value.split(','))
-              for key, value in request.args.items()
-              if key.startswith('fields[') and key.endswith(']')}
-    return fields.get(type_) if type_ is not None else fields
+    fields = {}
+    # As with :attr:`flask.Request.args`, the first value of a repeated
+    # parameter wins.
+    for key, value in parse_qsl(query_string.decode('utf-8', 'replace'), keep_blank_values=True):
+        if key.startswith('fields[') and key.endswith(']'):
+            fields.setdefault(key[7:-1], frozenset(value.split(',')))
+    return fields
+
+
+class ParsedRequest:
+    """The query parameters of the current request that every view needs,
+    each parsed at most once per request.
+
+    Use :func:`parsed_request` to get the instance for the current
+    request. Parsing is delegated to functions cached on the raw query
+    string or parameter value.
+
+    """
+
+    __slots__ = ('request', '_sparse_fields', '_sort')
+
+    def __init__(self, request):
+        self.request = request
+        self._sparse_fields = None
+        self._sort = ()
+
+    @property
+    def sparse_fields(self):
+        """The read-only dictionary returned by :func:`parse_sparse_fields`."""
+        if self._sparse_fields is None:
+            self._sparse_fields = sparse_fields_from(self.request.query_string)
+        return self._sparse_fields
+
+    @property
+    def sort(self):
+        """The tuple returned by :func:`parse_sort` for the ``sort`` query
+        parameter.
+
+        """
+        if self._sort == ():
+            self._sort = parse_sort(self.request.args.get(SORT_PARAM))
+        return self._sort
+
+
+def parsed_request():
+    """Returns the :class:`ParsedRequest` for the current request."""
+    memo = request_memo()
+    parsed = memo.get(ParsedRequest)
+    if parsed is None:
+        parsed = memo[ParsedRequest] = ParsedRequest(request._get_current_object())
+    return parsed
 
 
 def resources_from_path(instance, path):
@@ -707,6 +889,89 @@ def errors_from_serialization_exceptions(exceptions, included=False):
     return errors_response(500, errors)
 
 
+def loader_options(api_manager, model, include: frozenset, serializer: Serializer, filters: bool) -> tuple:
+    """Returns the loader options that eagerly load the relationships of
+    `model` needed to serialize instances of `model` with `serializer` and
+    the related resources on the paths given in `include`.
+
+    Related resources that only appear as linkage only have their primary
+    key loaded, unless `filters` is ``True``, since filters may need the
+    other columns.
+
+    The options only depend on the arguments, so the views get them from
+    :func:`cached_loader_options`.
+
+    """
+    options = []
+
+    def is_safe_to_selectload(attribute):
+        # SQLAlchemy does not build correct `selectinload` queries for models that have special select join
+        try:
+            inspected_relationship = inspect(attribute)
+            if inspected_relationship.property.secondary:
+                return False
+            if not isinstance(inspected_relationship.property.primaryjoin, BinaryExpression):
+                return False
+        except Exception:
+            # we do not have enough information, assume it's not safe
+            return False
+
+        return True
+
+    join_paths = {path.split('.')[0] for path in include}
+
+    for path in join_paths:
+        attribute = getattr(model, path)
+        if not is_safe_to_selectload(attribute):
+            continue
+        if not is_proxy(attribute) and not isinstance(attribute.impl, DynamicAttributeImpl):
+            options.append(selectinload(attribute))
+
+    relationship_columns = serializer.relationship_columns
+
+    # `many_to_one_relationships` is not a part of the base Serializer class, so to keep backward compatibility
+    # check if we use DefaultSerializer
+    if isinstance(serializer, DefaultSerializer):
+        relationship_columns -= serializer.many_to_one_relationships
+
+    for path in relationship_columns:
+        attribute = getattr(model, path)
+        if not is_safe_to_selectload(attribute):
+            continue
+        if path not in join_paths and not is_proxy(attribute) and not isinstance(attribute.impl, DynamicAttributeImpl):
+            option = selectinload(attribute)
+
+            # if request contains filters we need to load all columns
+            if not filters:
+                try:
+                    related_model = get_related_model(model, path)
+                    pk = api_manager.primary_key_for(related_model)
+                    option = option.options(load_only(getattr(related_model, pk)))
+                except KeyError:
+                    # theoretically all models should be known to the API, and we should raise a Server Error if they are not,
+                    # but to keep backward compatibility we let it pass
+                    pass
+            options.append(option)
+
+    return tuple(options)
+
+
+def cached_loader_options(api_manager, model, include, serializer, filters) -> tuple:
+    """Returns the :func:`loader_options` for the given arguments, computed
+    once for each combination unless `serializer` is not hashable.
+
+    The options are cached by `api_manager`, so that they are freed along
+    with it. `include` is an iterable of paths of related resources.
+
+    """
+    arguments = (model, frozenset(include or ()), serializer, bool(filters))
+    try:
+        return api_manager.loader_options(*arguments)
+    except TypeError:
+        # Custom serializers are not necessarily hashable.
+        return loader_options(api_manager, *arguments)
+
+
 class Paginated:
     """Represents a paginated list of resources.
 
@@ -807,7 +1072,7 @@ class Paginated:
         query_params = request.args
         # Set the new query_parameters to be everything except the
         # pagination query parameters.
-        new_query = {k: v for k, v in query_params.items() if k not in (PAGE_NUMBER_PARAM, PAGE_SIZE_PARAM)}
+        new_query = {k: v for k, v in query_params.items() if k not in (PAGE_NUMBER_PARAM, PAGE_SIZE_PARAM, PAGE_AFTER_PARAM)}
         new_query_string = '&'.join(map('='.join, new_query.items()))
         # Join the base URL with the query parameter string.
         return f'{proto}://{host}{path}?{new_query_string}'
@@ -966,7 +1231,7 @@ class ModelView(MethodView):
     #:
     #: This way, the :data:`mimerender` function appears last. It must appear
     #: last so that it can render the returned dictionary.
-    decorators = [requires_json_api_accept, requires_json_api_mimetype, mime_renderer]
+    decorators = [requires_json_api, mime_renderer]
 
     def __init__(self, session, model, *args, **kw):
         super(ModelView, self).__init__(*args, **kw)
@@ -975,9 +1240,11 @@ class ModelView(MethodView):
 
 
 class FetchView(View):
-    decorators = [catch_processing_exceptions, requires_json_api_accept, requires_json_api_mimetype, mime_renderer]
+    decorators = [catch_processing_exceptions, requires_json_api, mime_renderer]
 
-    def __init__(self, session, model, api_manager, page_size=10, max_page_size=100, preprocessors=None, postprocessors=None, includes=None):
+    def __init__(self, session, model, api_manager, page_size=10, max_page_size=100, preprocessors=None, postprocessors=None, includes=None,
+                 version_column=None, cache=None, deferred_join=False, render_in_database=False, snapshots=None,
+                 snapshot_views=None, partition_column=None, allow_aggregation=False):
         self.session = session
         self.model = model
         self.api_manager = api_manager
@@ -985,14 +1252,166 @@ class FetchView(View):
         self.max_page_size = max_page_size
         self.preprocessors = preprocessors or []
         self.postprocessors = postprocessors or []
-        # TODO: parse request arguments here
-        self.sparse_fields = parse_sparse_fields()
+        self.sparse_fields = parsed_request().sparse_fields
         if includes:
             self.default_includes = frozenset(includes)
         else:
             self.default_includes = {}
+        #: The name of the column whose value changes whenever a resource
+        #: changes, used to answer conditional requests; see
+        #: :ref:`conditional`.
+        self.version_column = version_column
+        #: The :class:`~flask_restless.cache.ResponseCache` that stores the
+        #: responses of this view, if any; see :ref:`caching`.
+        self.cache = cache
+        #: Whether pages of collections are selected by primary key first;
+        #: see :ref:`deferredjoin`.
+        self.deferred_join = deferred_join
+        #: Whether the database renders the resource objects of pages of
+        #: collections when it can; see :ref:`databaserendering`.
+        self.render_in_database = render_in_database
+        #: The :class:`~flask_restless.snapshots.SnapshotStore` of the
+        #: snapshots of the collection and the dictionary mapping the name
+        #: of each snapshot to its filters, if any; see :ref:`snapshots`.
+        self.snapshots = snapshots
+        self.snapshot_views = snapshot_views
+        #: The primary key column by which the collection may be split into
+        #: partitions, if partitions are allowed; see :ref:`partitions`.
+        self.partition_column = partition_column
+        #: Whether clients may request aggregates of the collection; see
+        #: :ref:`aggregation`.
+        self.allow_aggregation = allow_aggregation
+        #: The :class:`~flask_restless.cache.FragmentCache` that stores the
+        #: serialized resource objects, if any.
+        self.fragment_cache = api_manager.fragment_cache
+        #: The :class:`~flask_restless.cache.SingleFlight` that coalesces
+        #: concurrent identical requests, if any; see :ref:`singleflight`.
+        self.single_flight = api_manager.single_flight
+        #: The key and generation tokens under which the response to the
+        #: current request will be cached or shared.
+        self.cache_key = None
+        self.cache_tokens = None
+        #: The :class:`~flask_restless.cache.Flight` of the current request
+        #: and the response it shares, if any.
+        self.flight = None
+        self.rendered = None
+
+    def _cache_key(self, **params):
+        """Returns the key under which the response to the current request
+        is cached.
+
+        The key is computed from the URL of the request, with the query
+        parameters in a canonical order, and from `params`, which must
+        include the values of any parameters changed by the preprocessors,
+        such as the filters. Filter objects are compared as JSON with sorted
+        keys, and the order of the names in the ``include`` and
+        ``fields[...]`` parameters does not matter.
+
+        """
+        args = []
+        for name in sorted(request.args):
+            if name in (FILTER_PARAM, SORT_PARAM):
+                continue
+            values = request.args.getlist(name)
+            if name == 'include' or name.startswith('fields['):
+                values = sorted(chain.from_iterable(value.split(',') for value in values))
+            args.append([name, values])
+        canonical = json.dumps([request.base_url, args, params], sort_keys=True, default=str)
+        return hashlib.sha1(canonical.encode()).hexdigest()
+
+    def _cached_response(self, include, **params) -> Optional[Response]:
+        """Returns the cached response to the current request, or the
+        response computed by a concurrent identical request, or ``None``
+        if there is neither, in which case the response computed by
+        :meth:`get_data` will be cached and shared.
+
+        `params` are as described in :meth:`_cache_key`.
+
+        """
+        if self.cache is None and self.single_flight is None:
+            return None
+        self.cache_key = self._cache_key(**params)
+        entry = None
+        if self.cache is not None:
+            tables = dependencies(self.model, frozenset(include))
+            entry, self.cache_tokens = self.cache.get(self.cache_key, tables)
+        if entry is None and self.single_flight is not None:
+            self.flight = self.single_flight.begin(self.cache_key)
+            entry = self.flight.wait()
+        if entry is None:
+            return None
+        response = Response(entry.body, status=entry.status, mimetype=CONTENT_TYPE, headers=entry.headers)
+        return response.make_conditional(request)
+
+    def _linkage_version(self) -> Optional[str]:
+        """Returns the part of the version of a resource of this API that
+        reflects the linkage of its to-many relationships, or ``None`` if
+        it can not be known.
+
+        This linkage is stored in other tables, so a change to it does not
+        change the version column of the resource. The returned string
+        holds the generation tokens of these tables, as recorded by a
+        cache of the manager that tracks the writes of its session, and is
+        empty if the serialized relationships are all many-to-one. Without
+        such a cache, resources with to-many relationships have no known
+        version.
+
+        """
+        serializer = self.api_manager.serializer_for(self.model)
+        names = getattr(serializer, 'relationship_columns', None)
+        tables = to_many_linkage_tables(self.model, None if names is None else frozenset(names))
+        if not tables:
+            return ''
+        manager = self.api_manager
+        tracker = next((cache for cache in (manager.cache, manager.fragment_cache, manager.snapshot_store)
+                        if cache is not None), None)
+        if tracker is None:
+            return None
+        return ':'.join(tracker.tokens(tables))
+
+    def _conditional(self, version, last_modified=None):
+        """Returns a pair whose first element is a dictionary containing
+        the :http:header:`ETag` and (if `last_modified` is a
+        :class:`~datetime.datetime`) :http:header:`Last-Modified` headers
+        for a representation whose version is given by the string
+        `version`, and whose second element is ``True`` if and only if the
+        conditional headers of the request match them, that is, if the
+        client already has this representation.
+
+        The query string is part of the entity tag, since it determines
+        the pagination, sparse fieldsets, etc. of the representation. As
+        required by :rfc:`7232`, :http:header:`If-Modified-Since` is
+        ignored if the request has an :http:header:`If-None-Match` header.
+
+        """
+        etag = hashlib.sha1(f'{version}:{request.full_path}'.encode()).hexdigest()
+        headers = {'ETag': quote_etag(etag, weak=True)}
+        if not isinstance(last_modified, datetime):
+            last_modified = None
+        else:
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            # HTTP dates have a resolution of one second.
+            last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+            headers['Last-Modified'] = http_date(last_modified)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        elif last_modified is not None and request.if_modified_since is not None:
+            not_modified = last_modified <= request.if_modified_since
+        else:
+            not_modified = False
+        return headers, not_modified
 
     def dispatch_request(self, *args, **kwargs):
+        try:
+            return self._dispatch(*args, **kwargs)
+        finally:
+            # Requests waiting for this one must be released even if it
+            # failed.
+            if self.flight is not None:
+                self.flight.finish(self.rendered)
+
+    def _dispatch(self, *args, **kwargs):
         include = request.args.get('include')
         if include is None:
             include = self.default_includes
@@ -1000,21 +1419,57 @@ class FetchView(View):
             include = set(include.split(','))
 
         try:
-            return self.get_data(*args, include=include, **kwargs)
+            result = self.get_data(*args, include=include, **kwargs)
         except BadRequest as e:
             return error_response(e.http_code, detail=e.details)
         except Error as e:
             return error_response(e.http_code, cause=e.cause, detail=e.details)
         except MultipleExceptions as e:
             return errors_from_serialization_exceptions(e.exceptions)
+        if self.cache_key is None or isinstance(result, Response):
+            return result
+        data, status, headers = result
+        if status != 200:
+            return result
+        body = dumps_document(data)
+        self.rendered = CachedResponse(status, headers, body.encode())
+        if self.cache is not None:
+            self.cache.set(self.cache_key, self.cache_tokens, status, headers, self.rendered.body)
+        return Response(response=body, status=status, mimetype=CONTENT_TYPE, headers=headers)
 
     def get_data(self, *args, include: Optional[Set[str]] = None, **kwargs) -> ResponseTuple:
         raise NotImplementedError
 
+    def _fragment_key(self, instance, model, type_, only, tokens):
+        """Returns the key of the cached fragment for the resource object
+        of `instance`, or ``None`` if `instance` has no version.
+
+        `tokens` is a dictionary of the generation tokens of each model,
+        filled as needed.
+
+        """
+        version_column = self.api_manager.version_column_for(model)
+        if version_column is None:
+            return None
+        version = getattr(instance, version_column)
+        if version is None:
+            return None
+        resource_id = getattr(instance, self.api_manager.primary_key_for(model))
+        fields = None if only is None else sorted(only)
+        if model not in tokens:
+            tokens[model] = self.fragment_cache.model_tokens(model)
+        return self.fragment_cache.key(tokens[model], request.host_url, self.api_manager.url_prefix_for(model),
+                                       self.api_manager.include_links, type_, resource_id, fields, version)
+
     def _serialize_instances(self, instances):
         # should live in API MANAGER?
-        serialized_instances = []
+        to_serialize = []
         failed = []
+        # Postprocessors may modify the resource objects, so they need the
+        # dictionaries instead of cached fragments.
+        use_fragments = self.fragment_cache is not None and not self.postprocessors
+        keys = []
+        tokens = {}
         for instance in instances:
             if instance is None:
                 continue
@@ -1026,11 +1481,25 @@ class FetchView(View):
             # serializing relationships, so we don't really need to
             # recompute this every time.
             only = self.sparse_fields.get(_type)
+            key = self._fragment_key(instance, model, _type, only, tokens) if use_fragments else None
+            keys.append(key)
+            to_serialize.append((instance, serializer, only))
+        cached_keys = [key for key in keys if key is not None]
+        fragments = dict(zip(cached_keys, self.fragment_cache.get_many(cached_keys))) if cached_keys else {}
+        serialized_instances = []
+        for (instance, serializer, only), key in zip(to_serialize, keys):
+            fragment = fragments.get(key)
+            if fragment is not None:
+                serialized_instances.append(fragment)
+                continue
             try:
                 serialized = serializer.serialize(instance, only=only)
-                serialized_instances.append(serialized)
             except SerializationException as exception:
                 failed.append(exception)
+                continue
+            if key is not None:
+                self.fragment_cache.set(key, json.dumps(serialized))
+            serialized_instances.append(serialized)
         if failed:
             raise MultipleExceptions(failed)
         return serialized_instances
@@ -1042,57 +1511,7 @@ class FetchView(View):
             serializer: Serializer,
             filters=None
     ) -> Query:
-
-        def is_safe_to_selectload(attribute):
-            # SQLAlchemy does not build correct `selectinload` queries for models that have special select join
-            try:
-                inspected_relationship = inspect(attribute)
-                if inspected_relationship.property.secondary:
-                    return False
-                if not isinstance(inspected_relationship.property.primaryjoin, BinaryExpression):
-                    return False
-            except Exception:
-                # we do not have enough information, assume it's not safe
-                return False
-
-            return True
-
-        join_paths = {path.split('.')[0] for path in include}
-
-        for path in join_paths:
-            attribute = getattr(self.model, path)
-            if not is_safe_to_selectload(attribute):
-                continue
-            if not is_proxy(attribute) and not isinstance(attribute.impl, DynamicAttributeImpl):
-                query = query.options(selectinload(attribute))
-
-        relationship_columns = serializer.relationship_columns
-
-        # `many_to_one_relationships` is not a part of the base Serializer class, so to keep backward compatibility
-        # check if we use DefaultSerializer
-        if isinstance(serializer, DefaultSerializer):
-            relationship_columns -= serializer.many_to_one_relationships
-
-        for path in relationship_columns:
-            attribute = getattr(self.model, path)
-            if not is_safe_to_selectload(attribute):
-                continue
-            if path not in join_paths and not is_proxy(attribute) and not isinstance(attribute.impl, DynamicAttributeImpl):
-                options = selectinload(attribute)
-
-                # if request contains filters we need to load all columns
-                if not filters:
-                    try:
-                        related_model = get_related_model(self.model, path)
-                        pk = self.api_manager.primary_key_for(related_model)
-                        options = options.options(load_only(getattr(related_model, pk)))
-                    except KeyError:
-                        # theoretically all models should be known to the API, and we should raise a Server Error if they are not,
-                        # but to keep backward compatibility we let it pass
-                        pass
-                query = query.options(options)
-
-        return query
+        return query.options(*cached_loader_options(self.api_manager, self.model, include, serializer, filters))
 
 
 class FetchCollection(FetchView):
@@ -1102,6 +1521,11 @@ class FetchCollection(FetchView):
         filters, sort = collection_parameters()
         for preprocessor in self.preprocessors:
             preprocessor(filters=filters, sort=sort)
+        snapshot_name = request.args.get(SNAPSHOT_PARAM)
+        if snapshot_name is not None and self.snapshot_views is not None:
+            response = self._snapshot_response(snapshot_name, filters, sort, include)
+            if response is not None:
+                return response
         page_size = int(request.args.get(PAGE_SIZE_PARAM, self.page_size))
         if page_size > self.max_page_size:
             raise BadRequest(details=f"Page size must not exceed the server's maximum: {self.max_page_size}")
@@ -1112,11 +1536,46 @@ class FetchCollection(FetchView):
             raise BadRequest(details='Page number can not be negative')
         if page_size == 0 and page_number > 1:
             raise BadRequest(details='Page number can not be used with with page size 0')
+        aggregates = self._parse_aggregates()
+        partition = request.args.get(PAGE_PARTITION_PARAM)
+        if aggregates is not None:
+            # Aggregates are not paginated.
+            partition = None
+        elif partition is not None:
+            partition = self._parse_partition(partition, sort)
+        elif PAGE_AFTER_PARAM in request.args:
+            raise BadRequest(details=f'{PAGE_AFTER_PARAM} can only be used with {PAGE_PARTITION_PARAM}')
+        cached = self._cached_response(include, filters=filters, sort=sort)
+        if cached is not None:
+            return cached
 
         serializer = self.api_manager.serializer_for(self.model)
+        if aggregates is not None:
+            return self._aggregates(aggregates, filters, serializer)
         query = search(self.session, self.model, filters=filters, sort=sort)
+        if partition is not None:
+            return self._partition_page(query, partition, page_size, filters, include, serializer)
+
+        # The version of the collection is only known if the document
+        # does not depend on any other resources.
+        validators = {}
+        num_total = None
+        linkage = self._linkage_version() if self.version_column is not None and not include else None
+        if linkage is not None:
+            column = getattr(self.model, self.version_column)
+            counter = not isinstance(column.type, DateTime)
+            num_total, maximum, total = collection_version(self.session, query, column, counter=counter)
+            # The linkage may change without changing the greatest time.
+            last_modified = None if linkage else maximum
+            validators, not_modified = self._conditional(f'{num_total}:{maximum}:{total}:{linkage}', last_modified)
+            if not_modified:
+                return {}, 304, validators
+
+        searched = query
         query = self._selectinload_included_relationships(query, include, serializer, filters=filters)
 
+        # The resource objects of the page, if the database renders them.
+        data = None
         if page_size == 0:
             instances = query.all()
             num_results = len(instances)
@@ -1125,7 +1584,28 @@ class FetchCollection(FetchView):
             first = None
             last = None
         else:
-            num_results = count(self.session, query)
+            pending_count = None
+            executor = self.api_manager.query_executor
+            if num_total is not None:
+                num_results = num_total
+            elif executor is not None:
+                # The count does not depend on the page, so it runs on a
+                # connection of its own while the page is loaded.
+                pending_count = count_concurrently(executor, self.session, query, self.model)
+            else:
+                num_results = count(self.session, query)
+            offset = (page_number - 1) * page_size
+            instances = None
+            if self.render_in_database and not include and not self.postprocessors:
+                only = self.sparse_fields.get(self.api_manager.collection_name(self.model))
+                data = render_page(self.session, searched, self.model, self.api_manager, only, page_size, offset)
+            if data is None and self.deferred_join:
+                instances = deferred_join_page(searched, query, self.model, page_size, offset)
+            if data is None and instances is None:
+                # TODO Use Query.slice() instead, since it's easier to use.
+                instances = query.limit(page_size).offset(offset).all()
+            if pending_count is not None:
+                num_results = pending_count.result()
             first = 1
             if num_results == 0:
                 last = 1
@@ -1133,15 +1613,13 @@ class FetchCollection(FetchView):
                 last = int(math.ceil(num_results / page_size))
             prev = page_number - 1 if page_number > 1 else None
             next_ = page_number + 1 if page_number < last else None
-            offset = (page_number - 1) * page_size
-            # TODO Use Query.slice() instead, since it's easier to use.
-            instances = query.limit(page_size).offset(offset).all()
-        data = self._serialize_instances(instances)
+        if data is None:
+            data = self._serialize_instances(instances)
         paginated_data = Paginated(data, page_size=page_size, num_results=num_results, next_=next_, prev=prev, first=first, last=last)
         links = {'self': self.api_manager.url_for(self.model)}
         links.update(paginated_data.pagination_links)
         link_header = ','.join(paginated_data.header_links)
-        headers = dict(Link=link_header)
+        headers = dict(Link=link_header, **validators)
         result = {
             'jsonapi': {'version': JSONAPI_VERSION},
             'data': paginated_data.items,
@@ -1158,6 +1636,233 @@ class FetchCollection(FetchView):
             postprocessor(result=result, filters=filters, sort=sort)
         return result, 200, headers
 
+    def _parse_aggregates(self):
+        """Returns a list of the pairs ``(function, field)`` requested with
+        the ``aggregate[<function>]`` query parameters, in order, or
+        ``None`` if there are none.
+
+        The value of each parameter is a comma-separated list of fields;
+        ``*`` stands for all rows, and is only allowed for ``count``.
+
+        """
+        requested = []
+        for name, value in request.args.items(multi=True):
+            match = AGGREGATE_PARAM_RE.match(name)
+            if match is None:
+                continue
+            function = match.group(1)
+            if function not in AGGREGATE_FUNCTIONS:
+                raise BadRequest(details=f'Aggregate function must be one of the following: {", ".join(AGGREGATE_FUNCTIONS)}')
+            for field in value.split(','):
+                if field == '*' and function != 'count':
+                    raise BadRequest(details=f'Aggregate function {function} requires a field')
+                requested.append((function, field))
+        if not requested:
+            if GROUP_BY_PARAM in request.args:
+                raise BadRequest(details=f'{GROUP_BY_PARAM} requires at least one aggregate')
+            return None
+        if not self.allow_aggregation:
+            raise BadRequest(details='This collection does not support aggregates')
+        return requested
+
+    def _aggregates(self, requested, filters, serializer) -> ResponseTuple:
+        """Returns the response with the aggregates `requested`, as
+        returned by :meth:`_parse_aggregates`, of the resources that match
+        `filters`, grouped by the fields given in the ``group_by`` query
+        parameter.
+
+        Only the attributes of `serializer` that are columns of the model
+        may be aggregated or grouped by. The aggregates are computed by a
+        single ``GROUP BY`` query and returned in the ``meta`` object of a
+        document without primary data; the ``GET_COLLECTION``
+        postprocessors receive this document, which has no ``data`` member.
+
+        """
+        mapper = inspect(self.model)
+        allowed = serializer.attributes_columns
+
+        def column(field):
+            prop = mapper.column_attrs.get(field) if field in allowed else None
+            if prop is None:
+                raise BadRequest(details=f'Unknown field "{field}"')
+            return prop.columns[0]
+
+        expressions = []
+        for function, field in requested:
+            if field == '*':
+                expressions.append(func.count())
+                continue
+            expression = column(field)
+            if function == 'sum':
+                try:
+                    numeric = expression.type.python_type in (int, float, Decimal)
+                except NotImplementedError:
+                    numeric = False
+                if not numeric:
+                    raise BadRequest(details=f'Field "{field}" is not numeric')
+            expressions.append(AGGREGATE_FUNCTIONS[function](expression))
+        group_by = request.args.get(GROUP_BY_PARAM)
+        group_fields = group_by.split(',') if group_by else []
+        groups = [column(field) for field in group_fields]
+        query = search(self.session, self.model, filters=filters)
+        rows = aggregate(self.session, query, groups, expressions)
+
+        def aggregates_of(values):
+            result = defaultdict(dict)
+            for (function, field), value in zip(requested, values):
+                result[function][field] = aggregate_value(value)
+            return dict(result)
+
+        if groups:
+            meta = {'groups': [{'group': {field: aggregate_value(value) for field, value in zip(group_fields, row)},
+                                'aggregates': aggregates_of(row[len(groups):])} for row in rows]}
+        else:
+            meta = {'aggregates': aggregates_of(rows[0])}
+        result = {
+            'jsonapi': {'version': JSONAPI_VERSION},
+            'links': {'self': self.api_manager.url_for(self.model)},
+            'meta': meta
+        }
+        for postprocessor in self.postprocessors:
+            postprocessor(result=result, filters=filters, sort=[])
+        return result, 200, {}
+
+    def _parse_partition(self, value, sort):
+        """Returns the pair ``(number, partitions)`` given by the value of
+        the ``page[partition]`` query parameter, ``k/N``.
+
+        """
+        if self.partition_column is None:
+            raise BadRequest(details='This collection can not be split into partitions')
+        if sort:
+            raise BadRequest(details='Partitions are ordered by primary key and can not be sorted')
+        if PAGE_NUMBER_PARAM in request.args:
+            raise BadRequest(details=f'{PAGE_NUMBER_PARAM} can not be used with {PAGE_PARTITION_PARAM}')
+        try:
+            number, partitions = (int(part) for part in value.split('/'))
+        except ValueError:
+            raise BadRequest(details=f'{PAGE_PARTITION_PARAM} must be of the form k/N')
+        if not 1 <= number <= partitions:
+            raise BadRequest(details='Partition number must be between 1 and the number of partitions')
+        return number, partitions
+
+    def _partition_page(self, query, partition, page_size, filters, include, serializer) -> ResponseTuple:
+        """Returns the response with a page of the partition
+        ``(number, partitions)`` of the collection selected by `query`.
+
+        The boundaries of the partitions are computed once for the
+        filters and the number of partitions, and stored in the
+        :class:`~flask_restless.cache.PartitionCache` of the manager. Each
+        page is then selected in the order of the primary key, starting
+        after the primary key given by ``page[after]``, so that no page
+        requires an offset. The ``next`` link gives the next page, if any.
+
+        """
+        number, partitions = partition
+        column = self.partition_column
+        cache = self.api_manager.partition_cache
+        key = cache.key(self.api_manager.collection_name(self.model), filters, partitions)
+        boundaries = cache.get(key)
+        if boundaries is None:
+            boundaries = cache.add(key, partition_boundaries(self.session, query, column, partitions))
+        # With fewer rows than partitions, the last partitions are empty.
+        empty = number - 1 > len(boundaries)
+        if number > 1 and not empty:
+            query = query.filter(column >= boundaries[number - 2])
+        if number <= len(boundaries):
+            query = query.filter(column < boundaries[number - 1])
+        after = request.args.get(PAGE_AFTER_PARAM)
+        if after is not None:
+            query = query.filter(column > coerce_primary_key(column, after))
+        query = query.order_by(None).order_by(column)
+        query = self._selectinload_included_relationships(query, include, serializer, filters=filters)
+        if empty:
+            instances = []
+        elif page_size == 0:
+            instances = query.all()
+        else:
+            # The extra row tells whether there is a next page.
+            instances = query.limit(page_size + 1).all()
+        links = {'self': self.api_manager.url_for(self.model), 'next': None}
+        headers = {}
+        if page_size and len(instances) > page_size:
+            instances = instances[:page_size]
+            last = getattr(instances[-1], inspect(self.model).get_property_by_column(column).key)
+            # String primary keys may contain characters such as ``&``.
+            query_params = {PAGE_SIZE_PARAM: str(page_size), PAGE_AFTER_PARAM: quote(str(last), safe='')}
+            links['next'] = Paginated._to_url(Paginated._url_without_pagination_params(), query_params)
+            headers['Link'] = f'<{links["next"]}>; rel="next"'
+        result = {
+            'jsonapi': {'version': JSONAPI_VERSION},
+            'data': self._serialize_instances(instances),
+            'links': links,
+            'meta': {'partition': {'number': number, 'count': partitions}}
+        }
+        if include:
+            result['included'] = self._serialize_instances(get_inclusions_for_instances(include, instances))
+        for postprocessor in self.postprocessors:
+            postprocessor(result=result, filters=filters, sort=[])
+        return result, 200, headers
+
+    def _snapshot_response(self, name, filters, sort, include) -> Optional[Response]:
+        """Returns the response with the snapshot `name` of the collection,
+        or ``None`` if the request must be answered without it.
+
+        The snapshot is only used if, after the preprocessors, the request
+        has no filters, sorting, inclusions or sparse fieldsets, and if
+        there are no postprocessors, which could change the document.
+
+        """
+        if name not in self.snapshot_views:
+            raise BadRequest(details=f'No snapshot named "{name}"')
+        if filters or sort or include or parsed_request().sparse_fields or self.postprocessors:
+            return None
+        key = f'{request.base_url} {name}'
+        tables = dependencies(self.model, frozenset())
+        snapshot = self.snapshots.get(key, tables, self._snapshot_renderer(self.snapshot_views[name]))
+        response = Response(wrap_file(request.environ, snapshot.reader()), mimetype=CONTENT_TYPE,
+                            direct_passthrough=True)
+        response.set_etag(snapshot.etag)
+        response.last_modified = datetime.fromtimestamp(snapshot.created, timezone.utc)
+        return response.make_conditional(request, accept_ranges=True, complete_length=snapshot.size)
+
+    def _snapshot_renderer(self, filters):
+        """Returns a function that writes the document of all resources of
+        the collection that match `filters` to a binary file.
+
+        The function may be called from another thread, so it uses a
+        session and a request context of its own.
+
+        """
+        bind = self.session.get_bind(mapper=inspect(self.model))
+        app = current_app._get_current_object()
+        environ = {'path': request.path, 'base_url': request.url_root}
+        serializer = self.api_manager.serializer_for(self.model)
+        # The relationships are loaded for each batch of rows, instead of
+        # one query per resource.
+        options = cached_loader_options(self.api_manager, self.model, None, serializer, filters)
+
+        def render(file):
+            session = Session(bind=bind)
+            try:
+                with app.test_request_context(**environ):
+                    query = search(session, self.model, filters=deepcopy(filters)).options(*options)
+                    head = {'jsonapi': {'version': JSONAPI_VERSION}, 'links': {'self': self.api_manager.url_for(self.model)}}
+                    # The resources are written one at a time, and the total
+                    # is only known at the end.
+                    file.write(json.dumps(head)[:-1].encode() + b', "data": [')
+                    total = 0
+                    for instance in query.yield_per(1000):
+                        if total:
+                            file.write(b',')
+                        file.write(json.dumps(serializer.serialize(instance)).encode())
+                        total += 1
+                    file.write(f'], "meta": {{"total": {total}}}}}'.encode())
+            finally:
+                session.close()
+
+        return render
+
 
 class FetchResource(FetchView):
 
@@ -1173,9 +1878,33 @@ class FetchResource(FetchView):
             # instid.
             if temp_result is not None:
                 resource_id = temp_result
+        cached = self._cached_response(include, resource_id=resource_id)
+        if cached is not None:
+            return cached
 
         primary_key = self.api_manager.primary_key_for(self.model)
         query = query_by_primary_key(self.session, self.model, resource_id, primary_key)
+
+        # The version of the resource is only known if the document does
+        # not depend on any other resources. If the client has a cached
+        # representation, check its version before loading the resource.
+        linkage = self._linkage_version() if self.version_column is not None and not include else None
+        conditional = linkage is not None
+
+        def validators_for(version):
+            # The linkage may change without changing the time.
+            if linkage:
+                return self._conditional(f'{version}:{linkage}')
+            return self._conditional(version, version)
+
+        if conditional and (request.if_none_match or request.if_modified_since):
+            row = query.with_entities(getattr(self.model, self.version_column)).first()
+            if row is None:
+                raise NotFound(details=f'No resource with ID {resource_id}')
+            validators, not_modified = validators_for(row[0])
+            if not_modified:
+                return {}, 304, validators
+
         serializer = self.api_manager.serializer_for(self.model)
         query = self._selectinload_included_relationships(query, include, serializer)
         instance = query.first()
@@ -1197,7 +1926,10 @@ class FetchResource(FetchView):
         for postprocessor in self.postprocessors:
             postprocessor(result=result)
 
-        return result, 200, {}
+        headers = {}
+        if conditional:
+            headers, _ = validators_for(getattr(instance, self.version_column))
+        return result, 200, headers
 
 
 class APIBase(ModelView):
@@ -1288,7 +2020,7 @@ class APIBase(ModelView):
 
         #: The mapping from resource type name to requested sparse
         #: fields for resources of that type.
-        self.sparse_fields = parse_sparse_fields()
+        self.sparse_fields = parsed_request().sparse_fields
 
         # HACK: We would like to use the :attr:`API.decorators` class attribute
         # in order to decorate each view method with a decorator that catches
@@ -1298,7 +2030,7 @@ class APIBase(ModelView):
         def decorate(name, func):
             return setattr(self, name, func(getattr(self, name)))
 
-        for method in ['get', 'post', 'patch', 'delete']:
+        for method in ['get', 'post', 'put', 'patch', 'delete']:
             # Check if the subclass has the method before trying to decorate it.
             if hasattr(self, method):
                 decorate(method, catch_integrity_errors(self.session))
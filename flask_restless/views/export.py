@@ -0,0 +1,398 @@
+# export.py - view for streaming collections as NDJSON or CSV
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Views for streaming a whole collection as newline-delimited JSON or
+CSV, one flattened resource per line, and for exporting it to a file in a
+background job.
+
+The rows are fetched in batches from a server-side cursor and written to
+the response (or the file) as they are serialized, so neither the rows nor
+the output ever need to fit in memory.
+
+"""
+import csv
+import io
+import threading
+import time
+from collections import defaultdict
+from collections import deque
+
+from flask import Response
+from flask import current_app
+from flask import json
+from flask import request
+from flask import send_file
+from flask import stream_with_context
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from ..exceptions import BadRequest
+from ..exceptions import Error
+from ..search import search
+from .base import JSONAPI_VERSION
+from .base import ModelView
+from .base import cached_loader_options
+from .base import catch_processing_exceptions
+from .base import collection_parameters
+from .base import error_response
+from .base import mime_renderer
+from .base import parsed_request
+from .base import requires_json_api_accept
+from .helpers import upper_keys as upper
+
+#: The media types of the supported values of the ``format`` query
+#: parameter.
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+#: The name of the query parameter that selects the format of the export.
+FORMAT_PARAM = 'format'
+
+#: The type of the resource objects that represent export jobs.
+EXPORT_JOB_TYPE = 'export-job'
+
+#: The header that tells the client that ``export_max_rows`` cut the
+#: export short.
+TRUNCATED_HEADER = 'X-Export-Truncated'
+
+
+class RateLimiter:
+    """Allows at most `limit` calls per client in any window of `period`
+    seconds.
+
+    The calls are counted in the memory of the process, so each worker
+    process of the application has a limit of its own.
+
+    """
+
+    def __init__(self, limit, period=60):
+        self.limit = limit
+        self.period = period
+        self._calls = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Records a call by the client identified by `key`.
+
+        Returns ``0`` if the call is allowed, or else the number of seconds
+        after which the client may call again, in which case the call is
+        not recorded.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls[key]
+            while calls and calls[0] <= now - self.period:
+                calls.popleft()
+            if len(calls) >= self.limit:
+                return calls[0] + self.period - now
+            calls.append(now)
+            # Forget the clients whose calls have all expired.
+            for other in [other for other, times in self._calls.items() if times[-1] <= now - self.period]:
+                del self._calls[other]
+            return 0
+
+
+def flatten(resource):
+    """Returns a flat dictionary with the ID, the attributes and the IDs
+    of the related resources of the given resource object, in this order.
+
+    The value of a to-one relationship is the ID of the related resource,
+    or ``None``, and the value of a to-many relationship is the list of
+    IDs of the related resources, as accepted by :ref:`ingest`.
+
+    """
+    row = {'id': resource['id']}
+    # The fields are sorted, so that every line has the same order.
+    attributes = resource.get('attributes', {})
+    for name in sorted(attributes):
+        row[name] = attributes[name]
+    relationships = resource.get('relationships', {})
+    for name in sorted(relationships):
+        linkage = relationships[name].get('data')
+        if isinstance(linkage, list):
+            row[name] = [identifier['id'] for identifier in linkage]
+        else:
+            row[name] = None if linkage is None else linkage['id']
+    return row
+
+
+def csv_cell(value):
+    """Returns the CSV representation of a value of a flattened resource.
+
+    ``None`` is written as an empty cell, booleans as ``true`` or
+    ``false`` and lists and objects as JSON.
+
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+class ExportView(ModelView):
+    """Provides an endpoint for streaming the resources of a collection as
+    newline-delimited JSON (NDJSON) or CSV.
+
+    The request accepts the ``filter[objects]``, ``sort`` and
+    ``fields[...]`` query parameters of the collection, and ``format``,
+    either ``ndjson`` (the default) or ``csv``. It is not paginated.
+
+    `api_manager` is the :class:`~flask_restless.APIManager` that created
+    the API, whose serializer is used for the resources.
+
+    `yield_per` is the number of rows fetched from the cursor at a time.
+
+    `max_rows` is the maximum number of resources in a response, or
+    ``None`` for no limit.
+
+    `rate_limiter` is the :class:`RateLimiter` for the requests, keyed by
+    the address of the client, or ``None``.
+
+    `preprocessors` is as described in :ref:`processors`; the ``EXPORT``
+    preprocessors take the ``filters`` and ``sort`` keyword arguments.
+
+    """
+
+    decorators = [catch_processing_exceptions, mime_renderer]
+
+    def __init__(self, session, model, api_manager, yield_per=1000, max_rows=None, rate_limiter=None,
+                 preprocessors=None, *args, **kw):
+        super().__init__(session, model, *args, **kw)
+        self.api_manager = api_manager
+        self.yield_per = yield_per
+        self.max_rows = max_rows
+        self.rate_limiter = rate_limiter
+        self.preprocessors = defaultdict(list, upper(preprocessors or {}))
+
+    def _lines(self, instances, format_):
+        """Yields the lines of the response body for the given iterable of
+        instances in the given format.
+
+        """
+        serializer = self.api_manager.serializer_for(self.model)
+        only = parsed_request().sparse_fields.get(self.api_manager.collection_name(self.model))
+        rows = (flatten(serializer.serialize(instance, only=only)) for instance in instances)
+        if format_ == 'ndjson':
+            for row in rows:
+                yield json.dumps(row) + '\n'
+            return
+        # The columns are the fields of the serializer, in the order of
+        # `flatten`, so that they do not depend on the first resource.
+        attributes, relationships = serializer.attributes_columns, serializer.relationship_columns
+        if only is not None:
+            attributes, relationships = attributes & only, relationships & only
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=['id', *sorted(attributes), *sorted(relationships)],
+                                extrasaction='ignore')
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow({name: csv_cell(value) for name, value in row.items()})
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def _rate_limited(self):
+        """Returns a :http:statuscode:`429` response with a
+        :http:header:`Retry-After` header if the client has exceeded the
+        rate limit, or ``None`` otherwise.
+
+        """
+        if self.rate_limiter is None:
+            return None
+        retry_after = self.rate_limiter.acquire(request.remote_addr)
+        if not retry_after:
+            return None
+        data, status, headers = error_response(429, detail='Too many export requests')
+        headers['Retry-After'] = str(max(1, round(retry_after)))
+        return data, status, headers
+
+    def _query(self):
+        """Returns the query for the requested resources, after calling the
+        ``EXPORT`` preprocessors.
+
+        The to-many relationships of the resources are loaded with
+        :func:`~sqlalchemy.orm.selectinload`, which loads them for each
+        batch of rows fetched from the cursor, instead of one query per
+        resource.
+
+        """
+        filters, sort = collection_parameters()
+        for preprocessor in self.preprocessors['EXPORT']:
+            preprocessor(filters=filters, sort=sort)
+        query = search(self.session, self.model, filters=filters, sort=sort)
+        serializer = self.api_manager.serializer_for(self.model)
+        return query.options(*cached_loader_options(self.api_manager, self.model, None, serializer, filters))
+
+    def _truncated(self, query):
+        """Returns ``True`` if and only if `query` selects more than
+        ``max_rows`` resources.
+
+        """
+        if self.max_rows is None:
+            return False
+        primary_key = inspect(self.model).primary_key
+        return query.with_entities(*primary_key).offset(self.max_rows).limit(1).first() is not None
+
+    def get(self):
+        """Streams the requested resources, one per line.
+
+        If ``max_rows`` resources are streamed and there are more, the
+        response has the header ``X-Export-Truncated: true``. Responds with
+        :http:statuscode:`429` and a :http:header:`Retry-After` header if
+        the client has exceeded the rate limit.
+
+        """
+        format_ = request.args.get(FORMAT_PARAM, 'ndjson')
+        if format_ not in EXPORT_MIMETYPES:
+            detail = f'Format must be one of the following: {", ".join(sorted(EXPORT_MIMETYPES))}'
+            return error_response(400, detail=detail)
+        limited = self._rate_limited()
+        if limited is not None:
+            return limited
+        try:
+            query = self._query()
+        except (BadRequest, Error) as exception:
+            return error_response(exception.http_code, detail=exception.details)
+        headers = {}
+        if self._truncated(query):
+            headers[TRUNCATED_HEADER] = 'true'
+        if self.max_rows is not None:
+            query = query.limit(self.max_rows)
+        # Query.yield_per() also sets the `stream_results` execution option,
+        # so that drivers that support it use a server-side cursor. The
+        # statement is executed here, so that errors are reported before
+        # the response starts.
+        instances = iter(query.yield_per(self.yield_per))
+        body = stream_with_context(self._lines(instances, format_))
+        return Response(body, mimetype=EXPORT_MIMETYPES[format_], headers=headers)
+
+
+class ExportJobView(ExportView):
+    """Provides endpoints for starting jobs that export the resources of a
+    collection to gzipped newline-delimited JSON files and for reporting
+    the progress of these jobs.
+
+    The request that starts a job accepts the same query parameters as
+    :class:`ExportView`, except ``format``. `jobs` is the
+    :class:`~flask_restless.jobs.ExportJobs` that runs the jobs.
+
+    The ``GET_EXPORT_JOB`` preprocessors, which take the ``job_id``
+    keyword argument, are called before the state or the file of a job is
+    served.
+
+    """
+
+    decorators = [catch_processing_exceptions, requires_json_api_accept, mime_renderer]
+
+    def __init__(self, session, model, api_manager, jobs, *args, **kw):
+        super().__init__(session, model, api_manager, *args, **kw)
+        self.jobs = jobs
+        self.collection_name = api_manager.collection_name(model)
+
+    def _job_document(self, job):
+        """Returns the JSON API document for the state of `job`."""
+        url = f'{self.api_manager.url_for(self.model)}/exports/{job["id"]}'
+        links = {'self': url}
+        if job['status'] == 'done':
+            links['result'] = f'{url}/result'
+        attributes = {name: job[name] for name in ('status', 'rows', 'error', 'created', 'finished')}
+        return {
+            'jsonapi': {'version': JSONAPI_VERSION},
+            'data': {'id': job['id'], 'type': EXPORT_JOB_TYPE, 'attributes': attributes, 'links': links}
+        }
+
+    def _job(self, job_id):
+        """Returns the state of the export job `job_id` of this collection,
+        or ``None`` if there is no such job, after calling the
+        ``GET_EXPORT_JOB`` preprocessors.
+
+        """
+        for preprocessor in self.preprocessors['GET_EXPORT_JOB']:
+            preprocessor(job_id=job_id)
+        job = self.jobs.get(job_id)
+        if job is None or job['collection'] != self.collection_name:
+            return None
+        return job
+
+    def post(self):
+        """Starts a job that exports the requested resources.
+
+        Responds with :http:statuscode:`202` and the state of the job, whose
+        URL is given by the :http:header:`Location` header, and with the
+        header ``X-Export-Truncated: true`` if the job exports only the
+        first ``max_rows`` resources.
+
+        """
+        limited = self._rate_limited()
+        if limited is not None:
+            return limited
+        try:
+            query = self._query()
+        except (BadRequest, Error) as exception:
+            return error_response(exception.http_code, detail=exception.details)
+        headers = {}
+        if self._truncated(query):
+            headers[TRUNCATED_HEADER] = 'true'
+        if self.max_rows is not None:
+            query = query.limit(self.max_rows)
+        bind = self.session.get_bind(mapper=inspect(self.model))
+        app = current_app._get_current_object()
+        # The job serializes the resources in a request context like this
+        # one, so that sparse fieldsets and links are the same.
+        environ = {'path': request.path, 'base_url': request.url_root, 'query_string': request.query_string.decode('latin-1')}
+
+        def lines():
+            # The job runs in another thread, so it needs a session and a
+            # connection of its own.
+            session = Session(bind=bind)
+            try:
+                with app.test_request_context(**environ):
+                    instances = query.with_session(session).yield_per(self.yield_per)
+                    yield from self._lines(instances, 'ndjson')
+            finally:
+                session.close()
+
+        job = self.jobs.submit(self.collection_name, lines)
+        document = self._job_document(job)
+        headers['Location'] = document['data']['links']['self']
+        return document, 202, headers
+
+    def get(self, job_id):
+        """Returns the state of the export job `job_id`."""
+        job = self._job(job_id)
+        if job is None:
+            return error_response(404, detail=f'No export job with ID {job_id}')
+        return self._job_document(job), 200, {}
+
+
+class ExportResultView(ExportJobView):
+    """Serves the file written by a finished export job.
+
+    The file supports conditional and range requests, so that interrupted
+    downloads can be resumed.
+
+    """
+
+    decorators = [catch_processing_exceptions, mime_renderer]
+
+    def get(self, job_id):
+        job = self._job(job_id)
+        if job is None:
+            return error_response(404, detail=f'No export job with ID {job_id}')
+        if job['status'] != 'done':
+            return error_response(404, detail=f'Export job {job_id} is {job["status"]}')
+        return send_file(self.jobs.path(job_id), mimetype='application/gzip', conditional=True,
+                         download_name=f'{self.collection_name}-{job_id}.ndjson.gz')
@@ -10,8 +10,34 @@
 # License version 3 and under the 3-clause BSD license. For more
 # information, see LICENSE.AGPL and LICENSE.BSD.
 """Helper functions for view classes."""
+import enum
+from concurrent.futures import Future
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+from functools import lru_cache
+from importlib import import_module
+
+from sqlalchemy import select
 from sqlalchemy.inspection import inspect as sqlalchemy_inspect
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.base import MANYTOONE
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import Join
+from sqlalchemy.sql.util import ClauseAdapter
+
+#: Mapping from dialect name to the module whose ``insert`` function creates
+#: a dialect-specific :class:`~sqlalchemy.sql.expression.Insert` construct
+#: supporting "upsert" clauses. The modules are imported when first needed,
+#: since importing all of them takes longer than the rest of this package.
+UPSERT_INSERTS = {
+    'sqlite': 'sqlalchemy.dialects.sqlite',
+    'postgresql': 'sqlalchemy.dialects.postgresql',
+    'mysql': 'sqlalchemy.dialects.mysql',
+    'mariadb': 'sqlalchemy.dialects.mysql',
+}
 
 
 def upper_keys(dictionary):
@@ -22,22 +48,241 @@ def upper_keys(dictionary):
     return {k.upper(): v for k, v in dictionary.items()}
 
 
+def statement_of(query):
+    """Returns the :class:`~sqlalchemy.sql.expression.Select` statement of
+    `query`, which is either a :class:`~sqlalchemy.orm.Query`, as built by
+    :func:`~flask_restless.helpers.session_query`, or a statement already.
+
+    """
+    return query.selectable if isinstance(query, Query) else query
+
+
+def is_limited(statement):
+    """Returns ``True`` if `statement` has a ``LIMIT`` or ``OFFSET`` clause.
+
+    This is read from the statement itself instead of its SQL, so that the
+    statement is not compiled outside of the compiled cache of SQLAlchemy.
+
+    """
+    # SQLAlchemy has no public accessor for these clauses; both attributes
+    # exist from 1.4 through 2.0, and ``TestStatementCache.test_is_limited``
+    # fails if a supported version renames them.
+    return statement._limit_clause is not None or statement._offset_clause is not None
+
+
+def order_by_clauses(statement) -> tuple:
+    """Returns the ``ORDER BY`` clauses of `statement`, in order."""
+    # SQLAlchemy has no public accessor for these clauses either; the
+    # attribute exists from 1.4 through 2.0, and
+    # ``TestStatementCache.test_order_by_clauses`` fails if a supported
+    # version renames it.
+    return tuple(statement._order_by_clauses)
+
+
 def count(session, query):
-    """Returns the count of the specified `query`.
+    """Returns the count of the specified `query`, a
+    :class:`~sqlalchemy.orm.Query` or a
+    :class:`~sqlalchemy.sql.expression.Select`.
 
     This function employs an optimization that bypasses the
     :meth:`sqlalchemy.orm.Query.count` method, which can be very slow
-    for large queries.
+    for large queries: unless the query is limited, the columns of the
+    statement are replaced by a count, without wrapping it in a subquery,
+    which requires the ``maintain_column_froms`` argument of SQLAlchemy
+    1.4.23. Either way, the count statement has the same cache key on each
+    request, so SQLAlchemy compiles it once.
 
     """
-    # There is no straightforward way to find if SQLAlchemy Statement class has limit set
-    if ' LIMIT ' in str(query.statement):
-        return query.order_by(None).count()
-    counts = query.selectable.with_only_columns(func.count(query.selectable.selected_columns[0]))
-    num_results = session.execute(counts.order_by(None)).scalar()
-    if num_results is None:
-        return query.order_by(None).count()
-    return num_results
+    statement = statement_of(query).order_by(None)
+    if is_limited(statement):
+        return session.execute(select(func.count()).select_from(statement.subquery())).scalar()
+    counts = statement.with_only_columns(func.count(statement.selected_columns[0]), maintain_column_froms=True)
+    return session.execute(counts).scalar()
+
+
+def is_private_database(bind):
+    """Returns ``True`` if `bind`, an engine or a connection, uses an
+    in-memory SQLite database, which other connections can not see unless
+    its cache is shared.
+
+    """
+    url = bind.engine.url
+    if url.get_backend_name() != 'sqlite' or url.query.get('cache') == 'shared':
+        return False
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def count_concurrently(executor, session, query, model):
+    """Submits the :func:`count` of `query` to `executor` and returns the
+    :class:`~concurrent.futures.Future` of the result.
+
+    The count is executed on a new session bound to the engine of `model`
+    in `session`, so that it uses a connection of its own while `session`
+    executes other queries. It therefore does not see the uncommitted
+    changes of `session`, and, since it runs in a transaction of its own,
+    it may not match the page loaded by `session` if the collection changes
+    in the meantime.
+
+    If the engine uses a database private to each connection (see
+    :func:`is_private_database`), the count is executed by `session`
+    instead, before this function returns.
+
+    """
+    bind = session.get_bind(mapper=sqlalchemy_inspect(model))
+    if is_private_database(bind):
+        future = Future()
+        future.set_result(count(session, query))
+        return future
+    count_session = Session(bind=bind)
+    count_query = query.with_session(count_session)
+
+    def run():
+        try:
+            return count(count_session, count_query)
+        finally:
+            count_session.close()
+
+    return executor.submit(run)
+
+
+def deferred_join_page(query, loading_query, model, limit, offset):
+    """Returns the list of instances of `model` in the page of `query`
+    given by `limit` and `offset`, selected with a "deferred join".
+
+    The offset is first applied to a query for the primary keys alone,
+    which the database can usually answer from an index without reading
+    the rows it skips. The full rows of the page are then loaded by primary
+    key with `loading_query`, which is `query` with its loader options, and
+    put back in the order of `query`.
+
+    Returns ``None`` if `model` has a composite primary key, or if `query`
+    joins other tables, for example to sort by the attribute of a related
+    resource: the join may repeat the primary key of a row, once for each
+    related row, so that the page of keys would not match the page of rows.
+
+    """
+    mapper = sqlalchemy_inspect(model)
+    if len(mapper.primary_key) != 1:
+        return None
+    if any(isinstance(from_, Join) for from_ in statement_of(query).get_final_froms()):
+        return None
+    column = mapper.primary_key[0]
+    positions = {}
+    for row in query.with_entities(column).limit(limit).offset(offset):
+        positions.setdefault(row[0], len(positions))
+    if not positions:
+        return []
+    instances = loading_query.order_by(None).filter(column.in_(list(positions))).all()
+    return sorted(instances, key=lambda instance: positions[sqlalchemy_inspect(instance).identity[0]])
+
+
+def partition_column(model):
+    """Returns the primary key column by which the collection of `model`
+    can be split into partitions, or ``None`` if it has none.
+
+    The primary key must consist of a single integer or string column,
+    whose values can be stored as the boundaries of the partitions.
+
+    """
+    mapper = sqlalchemy_inspect(model)
+    if len(mapper.primary_key) != 1:
+        return None
+    column = mapper.primary_key[0]
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    return column if python_type in (int, str) else None
+
+
+def partition_boundaries(session, query, column, partitions):
+    """Returns the sorted list of the values of `column` at which the rows
+    of `query` are split into `partitions` partitions of nearly equal size.
+
+    The rows are numbered with the ``NTILE`` window function in the order
+    of `column`, and the smallest value in each tile but the first is a
+    boundary. There are fewer than ``partitions - 1`` boundaries if there
+    are fewer rows than partitions.
+
+    """
+    tile = func.ntile(partitions).over(order_by=column)
+    tiles = query.order_by(None).with_entities(column.label('value'), tile.label('tile')).subquery()
+    statement = select(func.min(tiles.c.value)).group_by(tiles.c.tile).order_by(tiles.c.tile)
+    return [row[0] for row in session.execute(statement)][1:]
+
+
+def collection_version(session, query, column, counter=False):
+    """Returns a tuple ``(count, maximum, total)`` describing the version
+    of the collection of resources selected by `query`.
+
+    `count` is the number of rows, `maximum` is the greatest value of
+    `column` among them and, if `counter` is ``True``, `total` is the sum
+    of the values of `column` (otherwise it is ``None``). `column` is
+    either a timestamp column updated on each change, in which case the
+    maximum and the count change whenever a row is added, deleted or
+    updated, or a version counter, in which case the sum is needed to
+    detect updates of rows other than the most recent one.
+
+    Like :func:`count`, this avoids wrapping `query` in a subquery if
+    possible.
+
+    """
+    aggregates = [func.max, func.sum] if counter else [func.max]
+    selectable = statement_of(query).order_by(None)
+    if is_limited(selectable):
+        subquery = selectable.with_only_columns(column.label('version')).subquery()
+        statement = select(func.count(), *(aggregate(subquery.c.version) for aggregate in aggregates))
+    else:
+        columns = [func.count(selectable.selected_columns[0])]
+        columns.extend(aggregate(column) for aggregate in aggregates)
+        statement = selectable.with_only_columns(*columns, maintain_column_froms=True)
+    num_results, maximum, *total = session.execute(statement).one()
+    return num_results, maximum, total[0] if total else None
+
+
+def aggregate(session, query, groups, aggregates):
+    """Returns the rows of a ``GROUP BY`` query over the rows selected by
+    `query`.
+
+    `groups` is a list of the columns by which to group the rows, possibly
+    empty, and `aggregates` is a list of aggregate expressions, such as
+    ``func.sum(column)``. Each row holds the values of `groups` followed
+    by those of `aggregates`, and the rows are ordered by `groups`.
+
+    Like :func:`count`, this replaces the columns of the statement instead
+    of wrapping it in a subquery, unless the query is limited, as a custom
+    ``query`` attribute of the model may be.
+
+    """
+    statement = statement_of(query)
+    if is_limited(statement):
+        # The limit selects the rows to aggregate, so it is applied in a
+        # subquery, to whose columns the expressions are adapted.
+        subquery = statement.subquery()
+        adapter = ClauseAdapter(subquery)
+        groups = [adapter.traverse(group) for group in groups]
+        aggregates = [adapter.traverse(expression) for expression in aggregates]
+        statement = select(*groups, *aggregates).select_from(subquery)
+    else:
+        statement = statement.order_by(None).with_only_columns(*groups, *aggregates, maintain_column_froms=True)
+    if groups:
+        statement = statement.group_by(*groups).order_by(*groups)
+    return session.execute(statement).all()
+
+
+def aggregate_value(value):
+    """Returns the JSON representation of a value returned by
+    :func:`aggregate`, encoding dates, times and enums as the default
+    serializer does.
+
+    """
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, enum.Enum) and not isinstance(value, str):
+        return value.name
+    return value
 
 
 def changes_on_update(model):
@@ -49,3 +294,64 @@ def changes_on_update(model):
 
     """
     return any(column.onupdate is not None for column in sqlalchemy_inspect(model).columns)
+
+
+@lru_cache(maxsize=None)
+def supports_returning_writes(model):
+    """Returns ``True`` if and only if instances of `model` can be
+    written with a single ``INSERT``, ``UPDATE`` or ``DELETE`` statement
+    instead of through the unit of work of the session.
+
+    This is not the case if the model has ORM validators, is part of an
+    inheritance hierarchy, or has a version counter, since these all rely
+    on the session flushing the instance.
+
+    """
+    mapper = sqlalchemy_inspect(model)
+    return not (mapper.validators or mapper.inherits is not None
+                or mapper.polymorphic_on is not None
+                or mapper.version_id_col is not None)
+
+
+@lru_cache(maxsize=None)
+def has_dependent_relationships(model):
+    """Returns ``True`` if and only if `model` has a relationship whose
+    rows would need to be updated or deleted along with an instance of
+    `model`, that is, a to-many relationship.
+
+    """
+    return any(prop.direction != MANYTOONE for prop in sqlalchemy_inspect(model).relationships)
+
+
+def upsert_statement(dialect_name, table, values, index_elements):
+    """Returns an ``INSERT ... ON CONFLICT DO UPDATE`` statement (or the
+    equivalent for the given dialect) that inserts `values` into `table`
+    or updates the conflicting row.
+
+    `values` is a dictionary mapping :class:`~sqlalchemy.Column` objects
+    to the values to insert.
+
+    `index_elements` is a list of :class:`~sqlalchemy.Column` objects that
+    identify the conflicting row. They must be covered by a primary key or
+    a unique constraint. MySQL ignores this argument and uses any unique
+    key of the table instead.
+
+    Returns ``None`` if the dialect does not support upsert statements.
+
+    """
+    module = UPSERT_INSERTS.get(dialect_name)
+    if module is None:
+        return None
+    statement = import_module(module).insert(table).values(values)
+    # Never overwrite the primary key of an existing row.
+    to_update = {column: value for column, value in values.items()
+                 if column not in index_elements and not column.primary_key}
+    if dialect_name in ('mysql', 'mariadb'):
+        if not to_update:
+            # MySQL has no "DO NOTHING", so update a key column to itself.
+            column = index_elements[0]
+            to_update = {column: column}
+        return statement.on_duplicate_key_update(to_update)
+    if not to_update:
+        return statement.on_conflict_do_nothing(index_elements=index_elements)
+    return statement.on_conflict_do_update(index_elements=index_elements, set_=to_update)
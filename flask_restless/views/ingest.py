@@ -0,0 +1,326 @@
+# ingest.py - view for bulk loading resources
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""View for loading large numbers of resources from a newline-delimited
+JSON or CSV request body.
+
+The request body is read row by row and the rows are inserted in chunks
+with SQLAlchemy Core ``executemany`` statements, so the whole body never
+needs to fit in memory.
+
+"""
+import csv
+import io
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from flask import json
+from flask import request
+from sqlalchemy import insert
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.base import MANYTOONE
+from werkzeug.http import parse_options_header
+
+from ..helpers import model_info
+from .base import JSONAPI_VERSION
+from .base import ModelView
+from .base import catch_integrity_errors
+from .base import catch_processing_exceptions
+from .base import error_response
+from .base import mime_renderer
+from .base import requires_json_api_accept
+from .helpers import upper_keys as upper
+
+#: Media types accepted for newline-delimited JSON request bodies.
+NDJSON_MIMETYPES = frozenset(('application/x-ndjson', 'application/jsonlines', 'application/jsonl'))
+
+#: Media types accepted for CSV request bodies.
+CSV_MIMETYPES = frozenset(('text/csv', ))
+
+#: The maximum number of per-row errors reported in a response.
+MAX_REPORTED_ERRORS = 100
+
+
+class RowError(Exception):
+    """Raised when a row of the request body cannot be inserted.
+
+    `detail` is a human-readable description of the problem.
+
+    """
+
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def ingest_columns(model, serializer, primary_key, allow_client_generated_ids=False):
+    """Returns a dictionary mapping the field names a client may provide
+    in an ingest request to the :class:`~sqlalchemy.Column` objects that
+    store them.
+
+    The fields are the attributes of `serializer` that are columns of
+    `model`, plus the to-one relationships of `serializer`, whose value is
+    stored in the foreign key column. If `allow_client_generated_ids` is
+    ``True``, the ``id`` field is stored in the `primary_key` column.
+
+    """
+    mapper = inspect(model)
+    columns = {}
+    for name in serializer.attributes_columns:
+        prop = mapper.column_attrs.get(name)
+        if prop is not None and prop.columns[0].table is mapper.local_table:
+            columns[name] = prop.columns[0]
+    for name in serializer.relationship_columns:
+        prop = mapper.relationships.get(name)
+        if prop is not None and prop.direction == MANYTOONE and len(prop.local_remote_pairs) == 1:
+            columns[name] = prop.local_remote_pairs[0][0]
+    if allow_client_generated_ids:
+        columns['id'] = mapper.get_property(primary_key).columns[0]
+    return columns
+
+
+def csv_value(column, value):
+    """Converts a string `value` read from a CSV file to the Python type
+    of `column`.
+
+    Empty strings (and missing values at the end of a short row) are
+    converted to ``None``. Strings for other types are returned unchanged
+    and left to the database driver.
+
+    """
+    if value is None or value == '':
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is bool:
+        lowered = value.lower()
+        if lowered in ('1', 'true', 't', 'yes', 'y'):
+            return True
+        if lowered in ('0', 'false', 'f', 'no', 'n'):
+            return False
+        raise ValueError(f'invalid boolean "{value}"')
+    if python_type in (int, float, Decimal):
+        return python_type(value)
+    return value
+
+
+class IngestView(ModelView):
+    """Provides an endpoint for loading many resources at once from a
+    newline-delimited JSON (NDJSON) or CSV request body.
+
+    Each line of an NDJSON body is an object mapping field names to
+    values; the first line of a CSV body is the header naming the
+    fields. The allowed field names are the keys of `columns`, as
+    returned by :func:`ingest_columns`.
+
+    `chunk_size` is the number of rows inserted with a single
+    ``executemany`` statement.
+
+    If `commit_per_chunk` is ``True``, the session is committed after
+    each chunk, so that a failure partway through the body keeps the
+    rows loaded so far. Otherwise, the session is committed once at the
+    end of the request.
+
+    `preprocessors` and `postprocessors` are as described in
+    :ref:`processors`; the ``INGEST`` preprocessors take no arguments
+    and the ``INGEST`` postprocessors take the ``result`` document.
+
+    """
+
+    decorators = [catch_processing_exceptions, requires_json_api_accept, mime_renderer]
+
+    def __init__(self, session, model, columns, chunk_size=1000, commit_per_chunk=True,
+                 preprocessors=None, postprocessors=None, *args, **kw):
+        super().__init__(session, model, *args, **kw)
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.commit_per_chunk = commit_per_chunk
+        self.preprocessors = defaultdict(list, upper(preprocessors or {}))
+        self.postprocessors = defaultdict(list, upper(postprocessors or {}))
+        mapper = inspect(model)
+        self.table = mapper.local_table
+        self.info = model_info(model)
+        #: The fields whose values may need to be converted, for example
+        #: from strings to dates; the others are foreign keys.
+        self.converted = frozenset(name for name in columns if name in mapper.column_attrs)
+        #: Counts of the rows handled by the current request.
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        # See the note in APIBase.__init__() on why this decorator is not
+        # part of the `decorators` class attribute.
+        self.post = catch_integrity_errors(self.session)(self.post)
+
+    def _ndjson_rows(self, stream):
+        """Yields pairs of row number and dictionary for each nonempty line
+        of the newline-delimited JSON `stream`.
+
+        Lines that are not valid JSON objects are yielded as
+        :exc:`RowError` instances instead of dictionaries.
+
+        """
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exception:
+                yield number, RowError(f'Unable to decode data: {exception}')
+                continue
+            if not isinstance(row, dict):
+                yield number, RowError('Row must be an object')
+                continue
+            yield number, row
+
+    def _csv_rows(self, stream):
+        """Yields pairs of row number and dictionary for each record of
+        the CSV `stream`, whose first line is the header.
+
+        """
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Malformed rows have more values than the header has fields.
+            if None in row:
+                yield reader.line_num, RowError('Row has more values than the header')
+                continue
+            values = {}
+            try:
+                for name, value in row.items():
+                    column = self.columns.get(name)
+                    values[name] = value if column is None else csv_value(column, value)
+            except ValueError as exception:
+                yield reader.line_num, RowError(f'Invalid value for "{name}": {exception}')
+                continue
+            yield reader.line_num, values
+
+    def _values(self, row):
+        """Returns the dictionary of column values to insert for the
+        given row of the request body.
+
+        Raises :exc:`RowError` if the row has an unknown field or a value
+        that cannot be converted.
+
+        """
+        values = {}
+        for name, value in row.items():
+            column = self.columns.get(name)
+            if column is None:
+                raise RowError(f'Model does not have field "{name}"')
+            if name in self.converted:
+                try:
+                    value = self.info.convert(name, value)
+                except (AttributeError, ValueError, OverflowError) as exception:
+                    raise RowError(f'Invalid value for "{name}": {exception}')
+            values[column.key] = value
+        return values
+
+    def _error(self, number, detail):
+        """Records an error for the row with the given number."""
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'detail': detail})
+
+    def _insert_chunk(self, chunk):
+        """Inserts the given list of pairs of row number and column values.
+
+        If the chunk cannot be inserted as a whole, its rows are inserted
+        one at a time in order to report the offending rows.
+
+        """
+        # Core executemany requires each set of parameters to have the same
+        # keys, and missing keys must not be sent as NULL so that column
+        # defaults still apply.
+        groups = defaultdict(list)
+        for number, values in chunk:
+            groups[frozenset(values)].append((number, values))
+        for rows in groups.values():
+            savepoint = self.session.begin_nested()
+            try:
+                self.session.execute(insert(self.table), [values for number, values in rows])
+                savepoint.commit()
+                self.inserted += len(rows)
+                continue
+            except SQLAlchemyError:
+                savepoint.rollback()
+            for number, values in rows:
+                savepoint = self.session.begin_nested()
+                try:
+                    self.session.execute(insert(self.table), [values])
+                    savepoint.commit()
+                    self.inserted += 1
+                except SQLAlchemyError as exception:
+                    savepoint.rollback()
+                    self._error(number, str(getattr(exception, 'orig', None) or exception))
+        if self.commit_per_chunk:
+            self.session.commit()
+
+    def post(self):
+        """Inserts each row of the request body as a new resource.
+
+        The response is a JSON API document whose ``meta`` element reports
+        the number of rows inserted and the number of rows that failed,
+        along with the first :data:`MAX_REPORTED_ERRORS` errors, each
+        identified by its row (or line) number in the request body.
+
+        If the body cannot be decoded, the response is a
+        :http:statuscode:`400` whose ``meta`` element reports the rows
+        handled before the error; with ``commit_per_chunk``, the rows
+        reported as inserted remain in the database.
+
+        """
+        for preprocessor in self.preprocessors['INGEST']:
+            preprocessor()
+        content_type, options = parse_options_header(request.headers.get('Content-Type'))
+        if content_type in NDJSON_MIMETYPES:
+            read_rows = self._ndjson_rows
+        elif content_type in CSV_MIMETYPES:
+            read_rows = self._csv_rows
+        else:
+            detail = f'Request must have one of the following media types: {", ".join(sorted(NDJSON_MIMETYPES | CSV_MIMETYPES))}'
+            return error_response(415, detail=detail)
+        encoding = options.get('charset', 'utf-8')
+        stream = io.TextIOWrapper(request.stream, encoding=encoding, newline='')
+        rows = self._valid_rows(read_rows(stream))
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self._insert_chunk(chunk)
+        except UnicodeDecodeError as exception:
+            self.session.rollback()
+            document, status, headers = error_response(400, cause=exception, detail=f'Unable to decode data: {exception}')
+            # The chunks before the error stay committed, if each chunk is.
+            inserted = self.inserted if self.commit_per_chunk else 0
+            document['meta'] = {'inserted': inserted, 'failed': self.failed, 'errors': self.errors}
+            return document, status, headers
+        result = {
+            'jsonapi': {'version': JSONAPI_VERSION},
+            'meta': {'inserted': self.inserted, 'failed': self.failed, 'errors': self.errors}
+        }
+        for postprocessor in self.postprocessors['INGEST']:
+            postprocessor(result=result)
+        self.session.commit()
+        return result, 200, {}
+
+    def _valid_rows(self, rows):
+        """Yields pairs of row number and column values for each of the
+        given rows that can be converted, recording an error for the
+        others.
+
+        """
+        for number, row in rows:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                yield number, self._values(row)
+            except RowError as exception:
+                self._error(number, exception.detail)
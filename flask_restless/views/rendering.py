@@ -0,0 +1,191 @@
+# rendering.py - building resource objects in the database
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Rendering of the resource objects of a page of a collection as a JSON
+array by the database, using the JSON functions of SQLite and PostgreSQL.
+
+Only resources that the database encodes exactly like
+:class:`~flask_restless.serialization.DefaultSerializer` can be rendered:
+their attributes must be plain columns of integer, string or boolean type
+and their relationships must be many-to-one relationships over a single
+foreign key. Otherwise, the functions here return ``None`` and the page is
+serialized in Python.
+
+"""
+from functools import lru_cache
+
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Text
+from sqlalchemy import case
+from sqlalchemy import cast
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import literal_column
+from sqlalchemy import null
+from sqlalchemy import select
+from sqlalchemy.inspection import inspect as sqlalchemy_inspect
+from sqlalchemy.orm.base import MANYTOONE
+from sqlalchemy.types import TypeDecorator
+
+from ..cache import RawJSON
+from ..serialization import DefaultSerializer
+from .helpers import order_by_clauses
+from .helpers import statement_of
+
+#: The Python types of the columns whose values the database encodes in the
+#: same way as :func:`json.dumps`. Dates and floating point numbers are
+#: formatted differently.
+RENDERED_TYPES = (bool, int, str)
+
+#: The dialects whose JSON functions are supported.
+RENDERED_DIALECTS = frozenset(('sqlite', 'postgresql'))
+
+#: The maximum number of arguments of a call to a function that builds a
+#: JSON object; PostgreSQL allows at most 100 arguments per function.
+MAX_OBJECT_ARGUMENTS = 100
+
+
+def rendered_column(mapper, name):
+    """Returns the :class:`~sqlalchemy.Column` that stores the attribute
+    `name` of `mapper`, or ``None`` if the database cannot render its
+    values.
+
+    """
+    prop = mapper.column_attrs.get(name)
+    if prop is None or len(prop.columns) != 1 or not isinstance(prop.columns[0], Column):
+        return None
+    column = prop.columns[0]
+    # Type decorators may convert the values after they are loaded.
+    if isinstance(column.type, TypeDecorator):
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    return column if python_type in RENDERED_TYPES else None
+
+
+def json_object(dialect_name, pairs):
+    """Returns a SQL expression for the JSON object with the given list of
+    pairs of key and SQL expression.
+
+    """
+    arguments = [argument for pair in pairs for argument in pair]
+    if dialect_name == 'sqlite':
+        return func.json_object(*arguments)
+    # PostgreSQL cannot infer the type of the parameters of a variadic
+    # function from the function itself.
+    arguments = [cast(literal(argument), Text) if isinstance(argument, str) else argument for argument in arguments]
+    return func.json_build_object(*arguments)
+
+
+def json_value(dialect_name, column):
+    """Returns a SQL expression for the JSON value of `column`."""
+    if dialect_name == 'sqlite' and column.type.python_type is bool:
+        # SQLite stores booleans as integers.
+        return func.json(case((column.is_(None), 'null'), (column, 'true'), else_='false'))
+    return column
+
+
+def json_linkage(dialect_name, foreign_key, type_):
+    """Returns a SQL expression for the resource identifier object given by
+    the value of `foreign_key`, or ``null`` if it is ``NULL``.
+
+    """
+    identifier = json_object(dialect_name, [('id', cast(foreign_key, String)), ('type', type_)])
+    if dialect_name == 'sqlite':
+        return func.json(case((foreign_key.is_(None), 'null'), else_=identifier))
+    return case((foreign_key.is_(None), null()), else_=identifier)
+
+
+@lru_cache(maxsize=256)
+def resource_expression(api_manager, model, dialect_name, only=None):
+    """Returns a SQL expression for the JSON resource object of a row of
+    `model`, as serialized by its serializer with the sparse fieldset
+    `only`, or ``None`` if the database cannot render it.
+
+    """
+    serializer = api_manager.serializer_for(model)
+    if dialect_name not in RENDERED_DIALECTS or api_manager.include_links:
+        return None
+    if not isinstance(serializer, DefaultSerializer):
+        return None
+    mapper = sqlalchemy_inspect(model)
+    try:
+        type_ = api_manager.collection_name(model)
+    except ValueError:
+        return None
+    primary_key = rendered_column(mapper, api_manager.primary_key_for(model))
+    if primary_key is None or primary_key.type.python_type is bool:
+        return None
+    attribute_names = serializer.attributes_columns
+    relation_names = serializer.relationship_columns
+    if only is not None:
+        attribute_names = attribute_names & only
+        relation_names = relation_names & only
+    attributes = []
+    for name in sorted(attribute_names):
+        column = rendered_column(mapper, name)
+        if column is None:
+            return None
+        attributes.append((name, json_value(dialect_name, column)))
+    relationships = []
+    for name in sorted(relation_names):
+        prop = mapper.relationships.get(name)
+        if prop is None or prop.direction != MANYTOONE or len(prop.local_remote_pairs) != 1:
+            return None
+        try:
+            target_type = api_manager.collection_name(prop.mapper.class_)
+        except ValueError:
+            return None
+        linkage = json_linkage(dialect_name, prop.local_remote_pairs[0][0], target_type)
+        relationships.append((name, json_object(dialect_name, [('data', linkage)])))
+    if max(len(attributes), len(relationships)) * 2 > MAX_OBJECT_ARGUMENTS:
+        return None
+    pairs = [('id', cast(primary_key, String)), ('type', type_)]
+    # The serializer leaves out empty attributes and relationships objects.
+    if attributes:
+        pairs.append(('attributes', json_object(dialect_name, attributes)))
+    if relationships:
+        pairs.append(('relationships', json_object(dialect_name, relationships)))
+    return json_object(dialect_name, pairs)
+
+
+def render_page(session, query, model, api_manager, only, limit, offset):
+    """Returns the resource objects of the page of `query` given by `limit`
+    and `offset` as a :class:`~flask_restless.cache.RawJSON` array built
+    by the database with a single statement.
+
+    `only` is the sparse fieldset requested for `model`, if any. Returns
+    ``None`` if the database cannot render the resource objects of `model`.
+
+    """
+    dialect_name = session.get_bind(mapper=sqlalchemy_inspect(model)).dialect.name
+    resource = resource_expression(api_manager, model, dialect_name, only)
+    if resource is None:
+        return None
+    # Neither database keeps the order of a sorted subquery when
+    # aggregating its rows, so the position of each row in the order of
+    # the query is carried out of the subquery.
+    ordering = order_by_clauses(statement_of(query))
+    position = func.row_number().over(order_by=ordering)
+    page = query.with_entities(resource.label('resource'), position.label('position'))
+    page = page.limit(limit).offset(offset).subquery()
+    if dialect_name == 'sqlite':
+        # Aggregate window functions, unlike aggregate functions, process
+        # the rows in the order of the window. Each row gets the whole
+        # array, so only the first is selected.
+        array = func.json_group_array(func.json(page.c.resource)).over(order_by=page.c.position, rows=(None, None))
+        statement = select(array).limit(1)
+        return RawJSON(session.execute(statement).scalar() or '[]')
+    # The dialect is imported here, since importing all of them takes
+    # longer than the rest of this package.
+    from sqlalchemy.dialects.postgresql import aggregate_order_by
+    array = func.json_agg(aggregate_order_by(page.c.resource, page.c.position))
+    statement = select(cast(func.coalesce(array, literal_column("'[]'::json")), Text))
+    return RawJSON(session.execute(statement).scalar())
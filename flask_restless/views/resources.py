@@ -19,17 +19,27 @@ SQLAlchemy models compatible with the JSON API specification.
 from flask import json
 from flask import request
 from markupsafe import escape
+from sqlalchemy import delete
+from sqlalchemy import insert
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.orm.base import MANYTOONE
 from werkzeug.exceptions import BadRequest
 
+from ..helpers import coerce_primary_key
 from ..helpers import get_by
 from ..helpers import get_related_model
-from ..helpers import has_field
 from ..helpers import is_like_list
-from ..helpers import strings_to_datetimes
+from ..helpers import model_info
+from ..helpers import session_query
 from ..serialization import ClientGeneratedIDNotAllowed
 from ..serialization import ConflictingType
+from ..serialization import DefaultRelationshipDeserializer
 from ..serialization import DeserializationException
+from ..serialization import MissingData
 from ..serialization import SerializationException
+from ..serialization import UnknownRelationship
 from .base import JSONAPI_VERSION
 from .base import APIBase
 from .base import MultipleExceptions
@@ -39,6 +49,9 @@ from .base import error_response
 from .base import errors_from_serialization_exceptions
 from .base import errors_response
 from .helpers import changes_on_update
+from .helpers import has_dependent_relationships
+from .helpers import supports_returning_writes
+from .helpers import upsert_statement
 
 
 class API(APIBase):
@@ -53,15 +66,39 @@ class API(APIBase):
     `page_size`, `max_page_size`, `serializer`, `deserializer`, and
     `includes` are as described in :meth:`APIManager.create_api`.
 
+    `upsert_columns` and `use_returning` are as described in
+    :meth:`APIManager.create_api`.
+
     """
 
-    def __init__(self, *args, **kw):
+    def __init__(self, *args, upsert_columns=None, use_returning=False, **kw):
         super(API, self).__init__(*args, **kw)
 
         #: Whether any side-effect changes are made to the SQLAlchemy
         #: model on updates.
         self.changes_on_update = changes_on_update(self.model)
 
+        #: The names of the columns that identify the row to update when
+        #: a :http:method:`put` request conflicts with an existing row.
+        self.upsert_columns = upsert_columns or [self.primary_key]
+
+        #: Whether to write instances of the model with single
+        #: ``INSERT ... RETURNING``, ``UPDATE ... RETURNING`` and
+        #: ``DELETE`` statements where possible.
+        self.use_returning = use_returning and supports_returning_writes(self.model)
+
+    def _returning_supported(self, feature):
+        """Returns ``True`` if and only if single-statement writes are
+        enabled for this API and the database supports `feature`, one of
+        ``'insert_returning'`` or ``'update_returning'``.
+
+        """
+        if not self.use_returning:
+            return False
+        dialect = self.session.get_bind(mapper=inspect(self.model)).dialect
+        # These attributes only exist on SQLAlchemy 2.0 and later.
+        return getattr(dialect, feature, False)
+
     def collection_processor_type(self, is_relation=False, **kw):
         """The suffix for the pre- and postprocessor identifiers for
         requests on collections of resources.
@@ -254,11 +291,21 @@ class API(APIBase):
             # See the note under the preprocessor in the get() method.
             if temp_result is not None:
                 resource_id = temp_result
-        instance = get_by(self.session, self.model, resource_id, self.primary_key)
-        if instance is None:
-            return error_response(404, detail=f'No resource found with ID {escape(resource_id)}')
-        self.session.delete(instance)
-        was_deleted = len(self.session.deleted) > 0
+        if self.use_returning and not has_dependent_relationships(self.model):
+            # Without any to-many relationships there is nothing for the
+            # session to cascade, so delete the row directly.
+            primary_key = getattr(self.model, self.primary_key)
+            statement = delete(self.model).where(primary_key == resource_id)
+            statement = statement.execution_options(synchronize_session='fetch')
+            was_deleted = self.session.execute(statement).rowcount > 0
+            if not was_deleted:
+                return error_response(404, detail=f'No resource found with ID {escape(resource_id)}')
+        else:
+            instance = get_by(self.session, self.model, resource_id, self.primary_key)
+            if instance is None:
+                return error_response(404, detail=f'No resource found with ID {escape(resource_id)}')
+            self.session.delete(instance)
+            was_deleted = len(self.session.deleted) > 0
         self.session.commit()
         for postprocessor in self.postprocessors['DELETE_RESOURCE']:
             postprocessor(was_deleted=was_deleted)
@@ -282,11 +329,19 @@ class API(APIBase):
             preprocessor(data=data)
         # Convert the dictionary representation into an instance of the
         # model.
+        resource = data.get('data')
+        use_returning = (isinstance(resource, dict) and not resource.get('relationships')
+                         and self._returning_supported('insert_returning'))
         try:
             instance = self.deserializer.deserialize(data)
-            self.session.add(instance)
-            self.session.flush()
-            self.session.refresh(instance)
+            if use_returning:
+                # Insert the row and load it back in a single round trip.
+                statement = insert(self.model).returning(self.model)
+                instance = self.session.scalars(statement, [self._column_values(instance)]).one()
+            else:
+                self.session.add(instance)
+                self.session.flush()
+                self.session.refresh(instance)
         except ClientGeneratedIDNotAllowed as exception:
             detail = exception.message()
             return error_response(403, cause=exception, detail=detail)
@@ -426,14 +481,15 @@ class API(APIBase):
 
         # Now consider only the attributes to update.
         data = data.pop('attributes', {})
+        info = model_info(self.model)
         # Check for any request parameter naming a column which does not exist
         # on the current model.
         for field in data:
-            if not has_field(self.model, field):
+            if not info.has_field(field):
                 return error_response(400, detail=f"Model does not have field '{escape(field)}'")
         # Special case: if there are any dates, convert the string form of the
         # date into an instance of the Python ``datetime`` object.
-        data = strings_to_datetimes(self.model, data)
+        data = info.convert_all(data)
         # Finally, update each attribute individually.
         try:
             if data:
@@ -463,6 +519,12 @@ class API(APIBase):
             # See the note under the preprocessor in the get() method.
             if temp_result is not None:
                 resource_id = temp_result
+        # Unwrap the data from the collection name key.
+        data = data.pop('data', {})
+        if self._returning_supported('update_returning'):
+            result = self._patch_returning(data, resource_id)
+            if result is not None:
+                return result
         # Get the instance on which to set the new attributes.
         instance = get_by(self.session, self.model, resource_id,
                           self.primary_key)
@@ -470,8 +532,6 @@ class API(APIBase):
         # return a 404 response.
         if instance is None:
             return error_response(404, detail=f'No instance with ID {escape(resource_id)} in model {self.model}')
-        # Unwrap the data from the collection name key.
-        data = data.pop('data', {})
         if 'type' not in data:
             return error_response(400, detail='Must specify correct data type')
         if 'id' not in data:
@@ -500,3 +560,196 @@ class API(APIBase):
             postprocessor(result=result)
         self.session.commit()
         return result, status, {}
+
+    def _patch_returning(self, data, resource_id):
+        """Updates the resource with the specified ID using a single
+        ``UPDATE ... RETURNING`` statement.
+
+        `data` and `resource_id` are as in :meth:`_update_instance`.
+
+        Returns ``None`` if the request cannot be handled this way, for
+        example because it changes a relationship or an attribute that is
+        not a column, in which case :meth:`patch` falls back to loading
+        and updating the instance through the session.
+
+        """
+        attributes = data.get('attributes') or {}
+        column_attrs = inspect(self.model).column_attrs
+        if (data.get('relationships') or not attributes or not isinstance(attributes, dict)
+                or data.get('type') != self.collection_name or data.get('id') != resource_id
+                or any(field not in column_attrs for field in attributes)):
+            return None
+        values = model_info(self.model).convert_all(attributes)
+        primary_key = getattr(self.model, self.primary_key)
+        statement = update(self.model).where(primary_key == resource_id).values(values)
+        statement = statement.returning(self.model).execution_options(populate_existing=True)
+        try:
+            instance = self.session.scalars(statement).first()
+        except self.validation_exceptions as exception:
+            return self._handle_validation_exception(exception)
+        # No row was updated, so no row has the specified ID.
+        if instance is None:
+            return error_response(404, detail=f'No instance with ID {escape(resource_id)} in model {self.model}')
+        if self.changes_on_update:
+            result = dict(data=self.serializer.serialize(instance))
+            status = 200
+        else:
+            result = dict()
+            status = 204
+        for postprocessor in self.postprocessors['PATCH_RESOURCE']:
+            postprocessor(result=result)
+        self.session.commit()
+        return result, status, {}
+
+    def _column_values(self, instance):
+        """Returns a dictionary mapping the names of the column attributes
+        that have been set on the (transient) `instance` to their values.
+
+        """
+        state = inspect(instance)
+        return {prop.key: state.dict[prop.key] for prop in state.mapper.column_attrs if prop.key in state.dict}
+
+    def _upsert_values(self, instance, links):
+        """Returns a dictionary mapping columns of the model's table to
+        the values to insert or update for an upsert request.
+
+        `instance` is the (transient) instance returned by the
+        deserializer and `links` is the dictionary of relationship
+        objects from the request document. Only to-one relationships are
+        supported, since they are stored as foreign keys on this table.
+
+        May raise :exc:`DeserializationException`.
+
+        """
+        state = inspect(instance)
+        mapper = state.mapper
+        values = {}
+        for prop in mapper.column_attrs:
+            column = prop.columns[0]
+            if prop.key in state.dict and column.table is mapper.local_table:
+                values[column] = state.dict[prop.key]
+        for link_name, link in links.items():
+            prop = mapper.relationships.get(link_name)
+            if prop is None:
+                raise UnknownRelationship(link_name)
+            if not isinstance(link, dict) or 'data' not in link:
+                raise MissingData(link_name)
+            if prop.direction != MANYTOONE:
+                exception = DeserializationException()
+                exception.detail = f'cannot upsert to-many relationship "{link_name}"'
+                raise exception
+            related_model = prop.mapper.class_
+            deserializer = DefaultRelationshipDeserializer(self.session, related_model, self.api_manager, relation_name=link_name)
+            related = deserializer.deserialize(link['data'])
+            if related is None and link['data'] is not None:
+                exception = DeserializationException()
+                exception.detail = f'no related resource for relationship "{link_name}"'
+                raise exception
+            for local, remote in prop.local_remote_pairs:
+                value = None
+                if related is not None:
+                    value = getattr(related, prop.mapper.get_property_by_column(remote).key)
+                values[local] = value
+        return values
+
+    def put(self, resource_id):
+        """Creates the resource with the specified ID, or replaces the
+        attributes of the existing one, in a single database statement.
+
+        The statement is an ``INSERT ... ON CONFLICT DO UPDATE`` (or the
+        equivalent for the database in use) keyed on the primary key of
+        the API or the columns given in the ``upsert_columns`` keyword
+        argument to :meth:`APIManager.create_api`. Since the client
+        provides the ID of the resource, this also requires
+        ``allow_client_generated_ids`` to be enabled.
+
+        The request document is the same as for a :http:method:`post`
+        request, and the response contains the resource as it appears in
+        the database after the statement has been executed. Its status is
+        :http:statuscode:`201`, with a :http:header:`Location` header, if
+        no row with the values of the upsert columns existed before the
+        statement, and :http:statuscode:`200` otherwise. If such a row
+        exists but has another ID, which may happen when the upsert
+        columns are not the primary key, the response is
+        :http:statuscode:`409` and nothing is written. If the resource
+        exists with other values of the upsert columns, it is updated.
+
+        """
+        try:
+            data = json.loads(request.get_data()) or {}
+        except (BadRequest, TypeError, ValueError, OverflowError) as exception:
+            detail = 'Unable to decode data'
+            return error_response(400, cause=exception, detail=detail)
+        for preprocessor in self.preprocessors['PUT_RESOURCE']:
+            temp_result = preprocessor(resource_id=resource_id, data=data)
+            # See the note under the preprocessor in the get() method.
+            if temp_result is not None:
+                resource_id = temp_result
+        resource = data.get('data')
+        if isinstance(resource, dict):
+            if 'id' not in resource:
+                return error_response(400, detail='Must specify resource ID')
+            if str(resource['id']) != str(resource_id):
+                return error_response(409, detail=f'ID must be {escape(resource_id)}, not {escape(resource["id"])}')
+            links = resource.pop('relationships', {})
+        else:
+            links = {}
+        mapper = inspect(self.model)
+        try:
+            instance = self.deserializer.deserialize(data)
+            values = self._upsert_values(instance, links)
+        except ClientGeneratedIDNotAllowed as exception:
+            detail = exception.message()
+            return error_response(403, cause=exception, detail=detail)
+        except ConflictingType as exception:
+            detail = exception.message()
+            return error_response(409, cause=exception, detail=detail)
+        except DeserializationException as exception:
+            detail = exception.message()
+            return error_response(400, cause=exception, detail=detail)
+        except self.validation_exceptions as exception:
+            return self._handle_validation_exception(exception)
+        id_column = mapper.get_property(self.primary_key).columns[0]
+        values[id_column] = coerce_primary_key(id_column, values.get(id_column, resource_id))
+        index_elements = [mapper.get_property(name).columns[0] for name in self.upsert_columns]
+        missing = [column.key for column in index_elements if column not in values]
+        if missing:
+            return error_response(400, detail=f'Missing value for "{missing[0]}"')
+        dialect_name = self.session.get_bind(mapper=mapper).dialect.name
+        statement = upsert_statement(dialect_name, mapper.local_table, values, index_elements)
+        if statement is None:
+            return error_response(501, detail=f'Upsert is not supported by the {dialect_name} dialect')
+        # Whether the statement creates the row is read beforehand, in the
+        # same transaction; a row inserted concurrently in between is
+        # reported as created.
+        conflict = (column == values[column] for column in index_elements)
+        existing = self.session.execute(select(id_column).where(*conflict).limit(1)).first()
+        if existing is not None and str(existing[0]) != str(values[id_column]):
+            names = ', '.join(self.upsert_columns)
+            detail = f'A resource with the same {escape(names)} already exists with ID {escape(existing[0])}'
+            return error_response(409, detail=detail)
+        if existing is None and index_elements != [id_column]:
+            # The resource may exist with other values of the upsert
+            # columns, in which case they are changed by an ``UPDATE``,
+            # since the upsert would conflict on the primary key instead.
+            existing = self.session.execute(select(id_column).where(id_column == values[id_column]).limit(1)).first()
+            if existing is not None:
+                statement = update(mapper.local_table).where(id_column == values[id_column]).values(values)
+        self.session.execute(statement)
+        # The row may have been in the identity map before the upsert, so
+        # make sure its attributes are loaded again.
+        query = session_query(self.session, self.model).populate_existing()
+        instance = query.filter(id_column == values[id_column]).first()
+        fields_for_this = self.sparse_fields.get(self.collection_name)
+        try:
+            data = self.serializer.serialize(instance, only=fields_for_this)
+        except SerializationException as exception:
+            detail = 'Failed to serialize object'
+            return error_response(500, cause=exception, detail=detail)
+        result = {'jsonapi': {'version': JSONAPI_VERSION}, 'data': data}
+        for postprocessor in self.postprocessors['PUT_RESOURCE']:
+            postprocessor(result=result)
+        self.session.commit()
+        if existing is None:
+            return result, 201, {'Location': request.base_url}
+        return result, 200, {}
@@ -39,7 +39,7 @@ VERSION_RE = r"^__version__ = ['\"]([^'\"]*)['\"]"
 #: required, so the user must install it explicitly.
 REQUIREMENTS = [
     'flask>=2.2,<3.1',
-    'sqlalchemy>=1.4.18,<2.1',
+    'sqlalchemy>=1.4.23,<2.1',
     'python-dateutil>2.2',
     'MarkupSafe>=2.0',
 ]
@@ -161,6 +161,7 @@ def force_content_type_jsonapi(test_client):
     # Decorate the appropriate test client request methods.
     test_client.patch = set_content_type(test_client.patch)
     test_client.post = set_content_type(test_client.post)
+    test_client.put = set_content_type(test_client.put)
 
 
 # This code is adapted from
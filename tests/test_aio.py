@@ -0,0 +1,176 @@
+# test_aio.py - unit tests for APIs backed by an AsyncSession
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for :class:`~flask_restless.aio.AsyncAPIManager`."""
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy import Column
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import relationship
+
+from flask_restless import IllegalArgumentError
+from flask_restless.cache import ResponseCache
+
+from .helpers import FlaskTestBase
+from .helpers import dumps
+
+try:
+    import aiosqlite  # noqa
+    import asgiref  # noqa
+    from sqlalchemy.ext.asyncio import async_scoped_session
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from flask_restless.aio import AsyncAPIManager
+except ImportError:
+    has_async = False
+else:
+    has_async = True
+
+
+class TestAsyncAPIManager(FlaskTestBase):
+    """Tests for fetching and writing resources with an
+    :class:`~flask_restless.aio.AsyncAPIManager`.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+        if not has_async:
+            self.skipTest('aiosqlite or asgiref not found.')
+        Base = declarative_base()
+
+        class Person(Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+
+        class Article(Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref='articles')
+
+        self.Article = Article
+        self.Person = Person
+        # Flask runs each asynchronous view in its own event loop, so the
+        # connections cannot be pooled across requests.
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.engine = create_async_engine(f'sqlite+aiosqlite:///{self.path}', poolclass=NullPool)
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.session = async_scoped_session(self.Session, scopefunc=asyncio.current_task)
+
+        async def create():
+            async with self.engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+            async with self.Session() as setup_session:
+                setup_session.add_all([Person(id=1, name='foo'), Article(id=1, title='bar', author_id=1)])
+                await setup_session.commit()
+
+        asyncio.run(create())
+        self.manager = AsyncAPIManager(self.flaskapp, session=self.session)
+        self.manager.create_api(Person, methods=['GET', 'POST', 'PATCH', 'DELETE'])
+        self.manager.create_api(Article)
+
+    def tearDown(self):
+        if has_async:
+            asyncio.run(self.engine.dispose())
+            os.remove(self.path)
+
+    def test_fetch(self):
+        """Tests for fetching a collection with an included relationship and
+        a single resource.
+
+        """
+        response = self.app.get('/api/article?include=author')
+        assert response.status_code == 200
+        document = response.json
+        assert ['1'] == [article['id'] for article in document['data']]
+        assert ['foo'] == [person['attributes']['name'] for person in document['included']]
+        assert document['meta']['total'] == 1
+        response = self.app.get('/api/person/1/articles')
+        assert ['bar'] == [article['attributes']['title'] for article in response.json['data']]
+
+    def test_write(self):
+        """Tests that created, updated and deleted resources are committed
+        through the asynchronous session.
+
+        """
+        data = {'data': {'type': 'person', 'attributes': {'name': 'baz'}}}
+        response = self.app.post('/api/person', data=dumps(data))
+        assert response.status_code == 201
+        person_id = response.json['data']['id']
+        data = {'data': {'type': 'person', 'id': person_id, 'attributes': {'name': 'qux'}}}
+        response = self.app.patch(f'/api/person/{person_id}', data=dumps(data))
+        assert response.status_code == 204
+        assert self.app.get(f'/api/person/{person_id}').json['data']['attributes']['name'] == 'qux'
+        response = self.app.delete(f'/api/person/{person_id}')
+        assert response.status_code == 204
+        assert self.app.get(f'/api/person/{person_id}').status_code == 404
+
+    def test_export_not_supported(self):
+        """Tests that the export endpoint, whose response is streamed after
+        the view returns, cannot be created.
+
+        """
+        with self.assertRaises(IllegalArgumentError):
+            self.manager.create_api(self.Person, url_prefix='/api2', allow_export=True)
+
+    def test_cache_tracks_own_sessions(self):
+        """Tests that a cache listens for the events of the sessions of the
+        requests only, if the factory of the scoped session has no session
+        class of its own.
+
+        """
+        cache = ResponseCache()
+        manager = AsyncAPIManager(self.flaskapp, session=self.session, cache=cache)
+        manager.create_api(self.Person, url_prefix='/api2', methods=['GET', 'PATCH'], cache_responses=True)
+        manager.create_api(self.Article, url_prefix='/api2')
+        assert not event.contains(Session, 'after_commit', cache._after_commit)
+        assert 'sync_session_class' not in self.Session.kw
+        assert self.app.get('/api2/person/1').json['data']['attributes']['name'] == 'foo'
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'baz'}}}
+        response = self.app.patch('/api2/person/1', data=dumps(data))
+        assert response.status_code == 204
+        assert self.app.get('/api2/person/1').json['data']['attributes']['name'] == 'baz'
+
+    def test_cache_tracks_session_class(self):
+        """Tests that a cache listens on the session class given to the
+        factory of the scoped session, so that writes outside of the APIs
+        are seen.
+
+        """
+
+        class APISession(Session):
+            pass
+
+        factory = async_sessionmaker(self.engine, expire_on_commit=False, sync_session_class=APISession)
+        session = async_scoped_session(factory, scopefunc=asyncio.current_task)
+        cache = ResponseCache()
+        manager = AsyncAPIManager(self.flaskapp, session=session, cache=cache)
+        manager.create_api(self.Person, url_prefix='/api2', cache_responses=True)
+        manager.create_api(self.Article, url_prefix='/api2')
+        assert event.contains(APISession, 'after_commit', cache._after_commit)
+        assert self.app.get('/api2/person/1').json['data']['attributes']['name'] == 'foo'
+
+        async def rename():
+            async with factory() as write_session:
+                (await write_session.get(self.Person, 1)).name = 'baz'
+                await write_session.commit()
+
+        asyncio.run(rename())
+        assert self.app.get('/api2/person/1').json['data']['attributes']['name'] == 'baz'
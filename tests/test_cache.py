@@ -0,0 +1,608 @@
+# test_cache.py - unit tests for the server-side response cache
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for caching responses to :http:method:`get` requests and the
+resource objects they contain.
+
+"""
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from threading import Event
+from threading import Thread
+from unittest import TestCase
+from unittest import mock
+
+from flask import json
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import event
+from sqlalchemy import update
+from sqlalchemy.orm import relationship
+
+from flask_restless import APIManager
+from flask_restless import IllegalArgumentError
+from flask_restless import ProcessingException
+from flask_restless.cache import CachedResponse
+from flask_restless.cache import FragmentCache
+from flask_restless.cache import MemoryBackend
+from flask_restless.cache import MmapBackend
+from flask_restless.cache import RawJSON
+from flask_restless.cache import ResponseCache
+from flask_restless.cache import SingleFlight
+from flask_restless.cache import dependencies
+from flask_restless.cache import dumps_document
+from flask_restless.cache import model_dependencies
+from flask_restless.serialization import DefaultSerializer
+
+from .helpers import ManagerTestBase
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from .helpers import dumps
+
+
+class TestMemoryBackend(TestCase):
+    """Tests for :class:`flask_restless.cache.MemoryBackend`."""
+
+    def test_evicts_least_recently_used(self):
+        """Tests that the least recently used values are evicted when the
+        size of the stored values exceeds the budget.
+
+        """
+        backend = MemoryBackend(max_bytes=25)
+        backend.set('a', b'x' * 9)
+        backend.set('b', b'x' * 9)
+        backend.get('a')
+        backend.set('c', b'x' * 9)
+        assert backend.get('a') is not None
+        assert backend.get('b') is None
+        assert backend.get('c') is not None
+        assert backend.size == 20
+
+    def test_expires(self):
+        """Tests that values are not returned after their time to live."""
+        backend = MemoryBackend()
+        with mock.patch('flask_restless.cache.time.time', return_value=1000):
+            backend.set('a', b'x', ttl=10)
+            assert not backend.add('a', b'y')
+        with mock.patch('flask_restless.cache.time.time', return_value=1010):
+            assert backend.get('a') is None
+            assert backend.add('a', b'y')
+
+
+class TestMmapBackend(TestCase):
+    """Tests for :class:`flask_restless.cache.MmapBackend`."""
+
+    def setUp(self):
+        if fcntl is None:
+            self.skipTest('fcntl not found.')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'cache')
+        self.backend = MmapBackend(self.path, max_bytes=4096, slot_sizes=(128, 1024))
+        self.addCleanup(self.backend.close)
+
+    def test_shared(self):
+        """Tests that values are visible to all backends using the same
+        file.
+
+        """
+        other = MmapBackend(self.path, max_bytes=4096, slot_sizes=(128, 1024))
+        self.addCleanup(other.close)
+        self.backend.set('a', b'x')
+        self.backend.set('b', b'y' * 500)
+        assert other.get_many(['a', 'b', 'c']) == [b'x', b'y' * 500, None]
+        assert not other.add('a', b'z')
+        other.delete('a')
+        assert self.backend.add('a', b'z')
+        assert other.get('a') == b'z'
+        other.clear()
+        assert self.backend.get('a') is None
+
+    def test_too_large(self):
+        """Tests that values larger than the largest slot are not stored."""
+        self.backend.set('a', b'x' * 1024)
+        assert self.backend.get('a') is None
+
+    def test_clock_eviction(self):
+        """Tests that a full size class evicts a value that has not been
+        read recently.
+
+        """
+        # Each size class has 2048 bytes, so there are sixteen small slots.
+        for i in range(16):
+            self.backend.set(str(i), b'x')
+        for i in range(1, 16):
+            self.backend.get(str(i))
+        self.backend.set('new', b'x')
+        assert self.backend.get('0') is None
+        assert all(self.backend.get(str(i)) == b'x' for i in range(1, 16))
+        assert self.backend.get('new') == b'x'
+
+    def test_expires(self):
+        """Tests that values are not returned after their time to live."""
+        with mock.patch('flask_restless.cache.time.time', return_value=1000):
+            self.backend.set('a', b'x', ttl=10)
+        with mock.patch('flask_restless.cache.time.time', return_value=1010):
+            assert self.backend.get('a') is None
+
+    def test_different_layout(self):
+        """Tests that a file created with a different layout is not
+        reused.
+
+        """
+        with self.assertRaises(ValueError):
+            MmapBackend(self.path, max_bytes=8192, slot_sizes=(128, 1024))
+
+
+class TestResponseCache(ManagerTestBase):
+    """Tests for the ``cache_responses`` keyword argument to
+    :meth:`APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            articles = relationship('Article')
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            author_id = Column(Integer, ForeignKey('person.id'))
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.cache = ResponseCache()
+        self.manager = APIManager(self.flaskapp, session=self.session, cache=self.cache)
+        self.manager.create_api(Person, methods=['GET', 'PATCH'], cache_responses=True)
+        self.manager.create_api(Article, methods=['GET', 'PATCH'], cache_responses=True)
+
+        self.statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+    def queries(self):
+        """Returns the number of ``SELECT`` statements executed since the
+        last call.
+
+        """
+        selects = [s for s in self.statements if s.startswith('SELECT')]
+        self.statements.clear()
+        return len(selects)
+
+    def test_collection(self):
+        """Tests that a repeated request for a collection is served from the
+        cache.
+
+        """
+        self.session.add(self.Person(id=1, name='foo'))
+        self.session.commit()
+        first = self.app.get('/api/person')
+        assert self.queries() > 0
+        second = self.app.get('/api/person')
+        assert self.queries() == 0
+        assert second.status_code == 200
+        assert second.headers['Content-Type'] == 'application/vnd.api+json'
+        assert second.json == first.json
+
+    def test_normalized_query_string(self):
+        """Tests that requests whose query parameters differ only in order
+        share a cache entry.
+
+        """
+        self.session.add(self.Person(id=1, name='foo'))
+        self.session.commit()
+        filters = [{'name': 'name', 'op': 'eq', 'val': 'foo'}]
+        self.app.get('/api/person', query_string={'filter[objects]': dumps(filters), 'fields[person]': 'name,articles'})
+        self.queries()
+        reordered = dumps([{'val': 'foo', 'op': 'eq', 'name': 'name'}])
+        response = self.app.get(f'/api/person?fields[person]=articles,name&filter[objects]={reordered}')
+        assert self.queries() == 0
+        assert response.json['data'][0]['id'] == '1'
+
+    def test_invalidated_by_update(self):
+        """Tests that updating a resource invalidates the cached responses
+        for its collection.
+
+        """
+        self.session.add(self.Person(id=1, name='foo'))
+        self.session.commit()
+        self.app.get('/api/person/1')
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'bar'}}}
+        response = self.app.patch('/api/person/1', data=dumps(data))
+        assert response.status_code == 204
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['attributes']['name'] == 'bar'
+
+    def test_invalidated_by_related_model(self):
+        """Tests that changing a related resource invalidates the cached
+        relationship linkage.
+
+        """
+        self.session.add_all([self.Person(id=1), self.Article(id=1)])
+        self.session.commit()
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['relationships']['articles']['data'] == []
+        self.session.get(self.Article, 1).author_id = 1
+        self.session.commit()
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['relationships']['articles']['data'] == [{'type': 'article', 'id': '1'}]
+
+    def test_invalidated_by_statement(self):
+        """Tests that an ``UPDATE`` statement executed with the session
+        invalidates the cached responses.
+
+        """
+        self.session.add(self.Person(id=1, name='foo'))
+        self.session.commit()
+        self.app.get('/api/person')
+        self.session.execute(update(self.Person).values(name='bar'))
+        self.session.commit()
+        response = self.app.get('/api/person')
+        assert response.json['data'][0]['attributes']['name'] == 'bar'
+
+    def test_rollback(self):
+        """Tests that changes that are rolled back do not invalidate the
+        cached responses.
+
+        """
+        self.session.add(self.Person(id=1, name='foo'))
+        self.session.commit()
+        self.app.get('/api/person')
+        self.session.get(self.Person, 1).name = 'bar'
+        self.session.flush()
+        self.session.rollback()
+        self.session.commit()
+        self.queries()
+        self.app.get('/api/person')
+        assert self.queries() == 0
+
+    def test_preprocessors(self):
+        """Tests that preprocessors are applied to requests served from
+        the cache.
+
+        """
+        authorized = []
+
+        def check_auth(**kw):
+            if not authorized:
+                raise ProcessingException(status=401)
+
+        self.manager.create_api(self.Person, url_prefix='/api2', cache_responses=True,
+                                preprocessors={'GET_COLLECTION': [check_auth]})
+        authorized.append(True)
+        assert self.app.get('/api2/person').status_code == 200
+        authorized.clear()
+        assert self.app.get('/api2/person').status_code == 401
+
+    def test_conditional(self):
+        """Tests that cached responses are conditional on their
+        :http:header:`ETag`.
+
+        """
+        self.manager.create_api(self.Person, url_prefix='/api2', cache_responses=True, version_column='id')
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        etag = self.app.get('/api2/person/1').headers['ETag']
+        response = self.app.get('/api2/person/1', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert self.app.get('/api2/person/1').headers['ETag'] == etag
+
+    def test_unknown_include(self):
+        """Tests that the dependencies of documents that include unknown
+        relationships, which come from the client, are not cached.
+
+        """
+        tables = dependencies(self.Person, frozenset(['articles']))
+        size = model_dependencies.cache_info().currsize
+        for name in ['bogus1', 'bogus2', 'articles.bogus']:
+            assert dependencies(self.Person, frozenset([name])) <= tables
+        assert model_dependencies.cache_info().currsize == size
+
+    def test_requires_cache(self):
+        """Tests that ``cache_responses`` requires the manager to have a
+        cache.
+
+        """
+        manager = APIManager(self.flaskapp, session=self.session)
+        with self.assertRaises(IllegalArgumentError):
+            manager.create_api(self.Person, url_prefix='/api2', cache_responses=True)
+
+
+class TestDumpsDocument(TestCase):
+    """Tests for :func:`flask_restless.cache.dumps_document`."""
+
+    def test_splices_raw_json(self):
+        """Tests that pre-encoded values appear unchanged in the output."""
+        document = {'data': [RawJSON('{"id": "1"}'), {'id': '2'}], 'meta': RawJSON('[]')}
+        assert json.loads(dumps_document(document)) == {'data': [{'id': '1'}, {'id': '2'}], 'meta': []}
+
+
+class TestFragmentCache(ManagerTestBase):
+    """Tests for the ``fragment_cache`` keyword argument to
+    :class:`APIManager`.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+            articles = relationship('Article')
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, viewonly=True)
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.manager = APIManager(self.flaskapp, session=self.session, fragment_cache=FragmentCache())
+        self.manager.create_api(Person, methods=['GET', 'PATCH'])
+        self.manager.create_api(Article)
+        self.session.add_all([self.Person(id=1, name='foo'), self.Person(id=2, name='bar')])
+        self.session.commit()
+
+    def serializations(self):
+        """Returns a context manager that records the calls to
+        :meth:`DefaultSerializer.serialize`.
+
+        """
+        return mock.patch.object(DefaultSerializer, 'serialize', autospec=True, side_effect=DefaultSerializer.serialize)
+
+    def test_reuses_fragments(self):
+        """Tests that resource objects are serialized once for all the
+        responses that contain them.
+
+        """
+        self.session.add(self.Article(id=1, author_id=1))
+        self.session.commit()
+        first = self.app.get('/api/person')
+        with self.serializations() as serialize:
+            second = self.app.get('/api/person', query_string={'page[size]': 1})
+            included = self.app.get('/api/article/1', query_string={'include': 'author'})
+        assert second.json['data'] == first.json['data'][:1]
+        assert included.json['included'] == first.json['data'][:1]
+        # Only the article is serialized, since it has no version.
+        assert serialize.call_count == 1
+
+    def test_new_version(self):
+        """Tests that a resource is serialized again when its version
+        changes.
+
+        """
+        self.app.get('/api/person/1')
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'baz'}}}
+        self.app.patch('/api/person/1', data=dumps(data))
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['attributes']['name'] == 'baz'
+
+    def test_linkage(self):
+        """Tests that a cached resource object is invalidated when the
+        linkage of its relationships changes.
+
+        """
+        self.session.add(self.Article(id=1))
+        self.session.commit()
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['relationships']['articles']['data'] == []
+        self.session.get(self.Article, 1).author_id = 1
+        self.session.commit()
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['relationships']['articles']['data'] == [{'type': 'article', 'id': '1'}]
+
+    def test_write_without_new_version(self):
+        """Tests that a cached resource object is invalidated by a write to
+        the table of its own model that leaves its version unchanged.
+
+        """
+        self.app.get('/api/person/1')
+        person = self.session.get(self.Person, 1)
+        self.session.execute(update(self.Person).where(self.Person.id == 1)
+                             .values(name='baz', updated_at=person.updated_at))
+        self.session.commit()
+        response = self.app.get('/api/person/1')
+        assert response.json['data']['attributes']['name'] == 'baz'
+
+    def test_sparse_fieldsets(self):
+        """Tests that each sparse fieldset has its own cached resource
+        objects.
+
+        """
+        response = self.app.get('/api/person/1', query_string={'fields[person]': 'name'})
+        assert response.json['data']['attributes'] == {'name': 'foo'}
+        response = self.app.get('/api/person/1')
+        assert 'updated_at' in response.json['data']['attributes']
+
+    def test_postprocessors(self):
+        """Tests that postprocessors receive resource objects as
+        dictionaries.
+
+        """
+
+        def upper(result=None, **kw):
+            for resource in result['data']:
+                resource['attributes']['name'] = resource['attributes']['name'].upper()
+
+        self.manager.create_api(self.Person, url_prefix='/api2', postprocessors={'GET_COLLECTION': [upper]})
+        self.app.get('/api/person')
+        response = self.app.get('/api2/person')
+        assert [person['attributes']['name'] for person in response.json['data']] == ['FOO', 'BAR']
+
+    def test_without_version(self):
+        """Tests that resources without a version are not cached."""
+        self.session.add(self.Article(id=1))
+        self.session.commit()
+        self.app.get('/api/article')
+        with self.serializations() as serialize:
+            self.app.get('/api/article')
+        assert serialize.call_count == 1
+
+
+class TestSingleFlight(TestCase):
+    """Tests for :class:`flask_restless.cache.SingleFlight`."""
+
+    def test_threads(self):
+        """Tests that threads joining a computation in progress receive its
+        result.
+
+        """
+        group = SingleFlight()
+        leader = group.begin('key')
+        assert leader.leader
+        assert leader.wait() is None
+        results = []
+        followers = [group.begin('key') for _ in range(3)]
+        threads = [Thread(target=lambda flight=flight: results.append(flight.wait())) for flight in followers]
+        for thread in threads:
+            thread.start()
+        result = CachedResponse(200, {}, b'{}')
+        leader.finish(result)
+        for thread in threads:
+            thread.join()
+        assert results == [result] * 3
+        # The next request starts a new computation.
+        assert group.begin('key').leader
+
+    def test_timeout(self):
+        """Tests that a request stops waiting after the timeout."""
+        group = SingleFlight(timeout=0.01)
+        group.begin('key')
+        assert group.begin('key').wait() is None
+
+    def test_failure(self):
+        """Tests that waiting requests are released if the computation
+        fails.
+
+        """
+        group = SingleFlight()
+        leader = group.begin('key')
+        follower = group.begin('key')
+        leader.finish(None)
+        assert follower.wait() is None
+
+    def test_lock_file(self):
+        """Tests that computations are shared between groups, as in
+        separate processes, through a lock file.
+
+        """
+        if fcntl is None:
+            self.skipTest('fcntl not found.')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        first = SingleFlight(lock_dir=directory).begin('key')
+        assert first.wait() is None
+        results = []
+        second = SingleFlight(lock_dir=directory).begin('key')
+        thread = Thread(target=lambda: results.append(second.wait()))
+        thread.start()
+        result = CachedResponse(200, {'ETag': 'W/"x"'}, b'{}')
+        first.finish(result)
+        thread.join()
+        assert results == [result]
+        # The lock file is removed by each request that held the lock.
+        assert os.listdir(directory) == ['key.response']
+
+    def test_old_response_files_removed(self):
+        """Tests that the response files older than the timeout are removed
+        when another response is written.
+
+        """
+        if fcntl is None:
+            self.skipTest('fcntl not found.')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        group = SingleFlight(timeout=0.01, lock_dir=directory)
+        for key in ('first', 'second'):
+            flight = group.begin(key)
+            assert flight.wait() is None
+            flight.finish(CachedResponse(200, {}, b'{}'))
+            time.sleep(0.02)
+        assert os.listdir(directory) == ['second.response']
+
+
+class TestCoalescedRequests(ManagerTestBase):
+    """Tests for the ``single_flight`` keyword argument to
+    :class:`APIManager`.
+
+    """
+
+    def database_uri(self):
+        # Each thread has its own connection, which must see the same
+        # database.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return f'sqlite:///{os.path.join(directory, "test.db")}'
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add(Person(id=1))
+        self.session.commit()
+        self.started = Event()
+        self.release = Event()
+        self.computed = []
+
+        def block(result=None, **kw):
+            self.computed.append(result)
+            self.started.set()
+            self.release.wait(5)
+
+        self.manager = APIManager(self.flaskapp, session=self.session, single_flight=SingleFlight())
+        self.manager.create_api(Person, postprocessors={'GET_COLLECTION': [block]})
+
+    def test_coalesced(self):
+        """Tests that identical concurrent requests are computed once."""
+        responses = []
+
+        def fetch(query_string):
+            responses.append(self.flaskapp.test_client().get('/api/person', query_string=query_string))
+
+        leader = Thread(target=fetch, args=({'page[size]': 5, 'page[number]': 1}, ))
+        leader.start()
+        assert self.started.wait(5)
+        # The same request, with the query parameters in another order.
+        followers = [Thread(target=fetch, args=({'page[number]': 1, 'page[size]': 5}, )) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        # Give the followers time to join the computation in progress.
+        time.sleep(0.2)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        assert len(self.computed) == 1
+        assert [response.status_code for response in responses] == [200] * 4
+        assert all(response.json == responses[0].json for response in responses)
@@ -0,0 +1,496 @@
+# test_export.py - unit tests for streaming collections
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for exporting collections as newline-delimited JSON and
+CSV, and for export jobs.
+
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import event
+from sqlalchemy.orm import relationship
+
+from flask_restless import APIManager
+from flask_restless import IllegalArgumentError
+from flask_restless import ProcessingException
+from flask_restless.jobs import ExportJobs
+from flask_restless.jobs import JobStore
+
+from .helpers import ManagerTestBase
+from .helpers import dumps
+
+
+def ndjson_rows(response):
+    """Returns the list of objects in the newline-delimited JSON body of
+    `response`.
+
+    """
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+class TestExport(ManagerTestBase):
+    """Tests for the ``allow_export`` keyword argument to
+    :meth:`APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            active = Column(Boolean)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref='articles')
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        people = [Person(id=i, name=f'person{i}', active=i % 2 == 0) for i in range(1, 6)]
+        self.session.add_all(people)
+        self.session.add_all([Article(id=1, title='foo', author=people[0]), Article(id=2, title='bar')])
+        self.session.commit()
+        self.manager.create_api(Person, max_page_size=2, allow_export=True)
+        self.manager.create_api(Article, allow_export=True)
+
+    def test_ndjson(self):
+        """Tests that each resource is streamed as a flattened object on a
+        line of its own, regardless of the maximum page size.
+
+        """
+        response = self.app.get('/api/person/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        rows = ndjson_rows(response)
+        assert [row['id'] for row in rows] == ['1', '2', '3', '4', '5']
+        assert rows[0] == {'id': '1', 'name': 'person1', 'active': False, 'articles': ['1']}
+        response = self.app.get('/api/article/export')
+        assert ndjson_rows(response) == [
+            {'id': '1', 'title': 'foo', 'author': '1'},
+            {'id': '2', 'title': 'bar', 'author': None},
+        ]
+
+    def test_csv(self):
+        """Tests that the resources are streamed as the records of a CSV
+        file whose header names the fields.
+
+        """
+        response = self.app.get('/api/person/export?format=csv&fields[person]=name,active')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        assert rows[0] == ['id', 'active', 'name']
+        assert rows[1:3] == [['1', 'false', 'person1'], ['2', 'true', 'person2']]
+        assert len(rows) == 6
+
+    def test_csv_header(self):
+        """Tests that the header of a CSV export names the fields of the
+        serializer, even if there are no resources.
+
+        """
+        filters = [{'name': 'id', 'op': 'gt', 'val': 10}]
+        response = self.app.get(f'/api/person/export?format=csv&filter[objects]={dumps(filters)}')
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        assert rows == [['id', 'active', 'name', 'articles']]
+
+    def test_relationships_loaded_per_batch(self):
+        """Tests that the to-many relationships of the exported resources
+        are loaded with one query per batch, not one per resource.
+
+        """
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        rows = ndjson_rows(self.app.get('/api/person/export'))
+        event.remove(self.engine, 'before_cursor_execute', record)
+        assert [row['articles'] for row in rows] == [['1'], [], [], [], []]
+        assert len(statements) == 2
+
+    def test_filter_and_sort(self):
+        """Tests that the export accepts the filtering and sorting
+        parameters of the collection.
+
+        """
+        filters = [{'name': 'active', 'op': 'eq', 'val': True}]
+        response = self.app.get(f'/api/person/export?filter[objects]={dumps(filters)}&sort=-id&fields[person]=name')
+        assert ndjson_rows(response) == [{'id': '4', 'name': 'person4'}, {'id': '2', 'name': 'person2'}]
+
+    def test_bad_request(self):
+        """Tests that an unknown format or filter field causes a
+        :http:status:`400`.
+
+        """
+        assert self.app.get('/api/person/export?format=xml').status_code == 400
+        filters = [{'name': 'bogus', 'op': 'eq', 'val': 1}]
+        response = self.app.get(f'/api/person/export?filter[objects]={dumps(filters)}')
+        assert response.status_code == 400
+
+    def test_stream_results(self):
+        """Tests that the rows are fetched with a server-side cursor when
+        the driver supports it.
+
+        """
+        options = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(connection, cursor, statement, parameters, context, executemany):
+            options.append(context.execution_options)
+
+        self.app.get('/api/article/export?fields[article]=title')
+        event.remove(self.engine, 'before_cursor_execute', record)
+        assert options[0].get('stream_results')
+        assert options[0].get('yield_per') == 1000
+
+    def test_max_rows(self):
+        """Tests that at most ``export_max_rows`` resources are exported."""
+        self.manager.create_api(self.Person, url_prefix='/api2', allow_export=True, export_max_rows=3)
+        response = self.app.get('/api2/person/export')
+        assert len(ndjson_rows(response)) == 3
+        assert response.headers['X-Export-Truncated'] == 'true'
+        filters = [{'name': 'id', 'op': 'gt', 'val': 2}]
+        response = self.app.get(f'/api2/person/export?filter[objects]={dumps(filters)}')
+        assert len(ndjson_rows(response)) == 3
+        assert 'X-Export-Truncated' not in response.headers
+        with self.assertRaises(IllegalArgumentError):
+            self.manager.create_api(self.Person, url_prefix='/api3', allow_export=True, export_max_rows=0)
+
+    def test_rate_limit(self):
+        """Tests that a client exceeding ``export_rate_limit`` gets a
+        :http:status:`429` with a :http:header:`Retry-After` header.
+
+        """
+        self.manager.create_api(self.Person, url_prefix='/api2', allow_export=True, export_rate_limit=2)
+        assert self.app.get('/api2/person/export').status_code == 200
+        assert self.app.get('/api2/person/export').status_code == 200
+        response = self.app.get('/api2/person/export')
+        assert response.status_code == 429
+        assert 0 < int(response.headers['Retry-After']) <= 60
+        # The limit applies to each client separately.
+        response = self.app.get('/api2/person/export', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert response.status_code == 200
+
+    def test_preprocessors(self):
+        """Tests that the ``EXPORT`` preprocessors may modify the filters."""
+
+        def only_active(filters, sort):
+            filters.append({'name': 'active', 'op': 'eq', 'val': True})
+
+        self.manager.create_api(self.Person, url_prefix='/api2', allow_export=True,
+                                preprocessors={'EXPORT': [only_active]})
+        response = self.app.get('/api2/person/export')
+        assert [row['id'] for row in ndjson_rows(response)] == ['2', '4']
+
+    def test_single_dispatcher(self):
+        """Tests that the export URL takes precedence over the resource URL
+        with a single dispatcher.
+
+        """
+        manager = APIManager(self.flaskapp, session=self.session, single_dispatcher=True, url_prefix='/api2')
+        manager.create_api(self.Person, allow_export=True)
+        assert len(ndjson_rows(self.app.get('/api2/person/export?fields[person]=name'))) == 5
+        assert self.app.get('/api2/person/1?fields[person]=name').json['data']['id'] == '1'
+
+    def test_disabled(self):
+        """Tests that the export endpoint does not exist by default."""
+        self.manager.create_api(self.Person, url_prefix='/api2')
+        assert self.app.get('/api2/person/export').status_code == 404
+
+
+class MemoryJobStore(JobStore):
+    """Stores the states of jobs in a dictionary, recording each update."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.updates = []
+
+    def create(self, job):
+        self.jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **values):
+        self.updates.append(values)
+        self.jobs[job_id].update(values)
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return None if job is None else dict(job)
+
+    def delete(self, job_id):
+        self.jobs.pop(job_id, None)
+
+    def expired(self, finished_before):
+        return [job['id'] for job in self.jobs.values() if (job['finished'] or finished_before) < finished_before]
+
+    def stale(self, heartbeat_before):
+        return [job['id'] for job in self.jobs.values()
+                if job['status'] in ('pending', 'running') and job['heartbeat'] < heartbeat_before]
+
+
+class TestExportJobs(ManagerTestBase):
+    """Tests for the ``allow_export_jobs`` keyword argument to
+    :meth:`APIManager.create_api` and for
+    :class:`~flask_restless.jobs.ExportJobs`.
+
+    """
+
+    def database_uri(self):
+        # The jobs run on connections of their own, and each connection to
+        # an in-memory SQLite database has a database of its own.
+        return f'sqlite:///{os.path.join(self.directory, "test.sqlite")}'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Person(id=i, name=f'person{i}') for i in range(1, 6)])
+        self.session.add(Article(id=1))
+        self.session.commit()
+        self.jobs = ExportJobs(os.path.join(self.directory, 'exports'))
+        self.manager = APIManager(self.flaskapp, session=self.session, export_jobs=self.jobs)
+        self.manager.create_api(Person, allow_export_jobs=True)
+        self.manager.create_api(Article, allow_export_jobs=True)
+
+    def tearDown(self):
+        super().tearDown()
+        self.jobs.shutdown()
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_job(self):
+        """Tests that a job exports the requested resources to a gzipped
+        file, which is served once the job is done.
+
+        """
+        response = self.app.post('/api/person/exports?sort=-id&fields[person]=name')
+        assert response.status_code == 202
+        job = response.json['data']
+        assert job['type'] == 'export-job'
+        assert response.headers['Location'] == f'/api/person/exports/{job["id"]}'
+        self.jobs.wait()
+        response = self.app.get(f'/api/person/exports/{job["id"]}')
+        assert response.status_code == 200
+        job = response.json['data']
+        assert job['attributes']['status'] == 'done'
+        assert job['attributes']['rows'] == 5
+        response = self.app.get(job['links']['result'])
+        assert response.status_code == 200
+        assert response.mimetype == 'application/gzip'
+        body = response.get_data()
+        lines = gzip.decompress(body).decode().splitlines()
+        assert json.loads(lines[0]) == {'id': '5', 'name': 'person5'}
+        assert len(lines) == 5
+        # Interrupted downloads can be resumed.
+        response = self.app.get(job['links']['result'], headers={'Range': 'bytes=10-'})
+        assert response.status_code == 206
+        assert response.get_data() == body[10:]
+
+    def test_progress_and_store(self):
+        """Tests that the progress of a job is recorded in the given job
+        store.
+
+        """
+        store = MemoryJobStore()
+        jobs = ExportJobs(os.path.join(self.directory, 'other'), store=store, progress_interval=2)
+        self.addCleanup(jobs.shutdown)
+        manager = APIManager(self.flaskapp, session=self.session, export_jobs=jobs, url_prefix='/api2')
+        manager.create_api(self.Person, allow_export_jobs=True)
+        job_id = self.app.post('/api2/person/exports?fields[person]=name').json['data']['id']
+        jobs.wait()
+        assert [update.get('rows') for update in store.updates] == [None, 2, 4, 5]
+        assert store.get(job_id)['status'] == 'done'
+
+    def test_max_rows(self):
+        """Tests that a job exports at most ``export_max_rows`` resources and
+        that the response that starts it says so.
+
+        """
+        self.manager.create_api(self.Person, url_prefix='/api2', allow_export_jobs=True, export_max_rows=3)
+        response = self.app.post('/api2/person/exports')
+        assert response.headers['X-Export-Truncated'] == 'true'
+        job_id = response.json['data']['id']
+        self.jobs.wait()
+        assert self.app.get(f'/api2/person/exports/{job_id}').json['data']['attributes']['rows'] == 3
+
+    def test_failed_job(self):
+        """Tests that a failed job logs the exception, records a generic
+        error and leaves no file.
+
+        """
+
+        def lines():
+            yield '{}\n'
+            raise ValueError('bogus')
+
+        with self.assertLogs('flask_restless.jobs', level='ERROR') as logs:
+            job = self.jobs.submit('person', lines)
+            self.jobs.wait()
+        assert 'bogus' in logs.output[0]
+        response = self.app.get(f'/api/person/exports/{job["id"]}')
+        attributes = response.json['data']['attributes']
+        assert attributes['status'] == 'failed'
+        assert attributes['error'] == 'The export failed'
+        assert self.app.get(f'/api/person/exports/{job["id"]}/result').status_code == 404
+        assert os.listdir(os.path.join(self.directory, 'exports')) == ['jobs.sqlite']
+
+    def test_retention(self):
+        """Tests that the states and the files of the jobs that finished
+        more than ``retention`` seconds ago are deleted when a job is
+        submitted.
+
+        """
+        jobs = ExportJobs(os.path.join(self.directory, 'other'), retention=0)
+        self.addCleanup(jobs.shutdown)
+        manager = APIManager(self.flaskapp, session=self.session, export_jobs=jobs, url_prefix='/api2')
+        manager.create_api(self.Person, allow_export_jobs=True)
+        first = self.app.post('/api2/person/exports').json['data']['id']
+        jobs.wait()
+        assert os.path.exists(jobs.path(first))
+        second = self.app.post('/api2/person/exports').json['data']['id']
+        jobs.wait()
+        assert not os.path.exists(jobs.path(first))
+        assert self.app.get(f'/api2/person/exports/{first}').status_code == 404
+        assert self.app.get(f'/api2/person/exports/{second}').status_code == 200
+
+    def test_stale_job(self):
+        """Tests that an unfinished job of a process that stopped recording
+        heartbeats is marked as failed.
+
+        """
+        for job_id in ('stale', 'other'):
+            self.jobs.store.create({'id': job_id, 'collection': 'person', 'status': 'running', 'rows': 0,
+                                    'created': '2020-01-01T00:00:00+00:00', 'heartbeat': '2020-01-01T00:00:00+00:00'})
+        partial_path = f'{self.jobs.path("stale")}.part'
+        with open(partial_path, 'w'):
+            pass
+        attributes = self.app.get('/api/person/exports/stale').json['data']['attributes']
+        assert attributes['status'] == 'failed'
+        assert attributes['error'] == 'The export was interrupted'
+        assert not os.path.exists(partial_path)
+        self.jobs.cleanup()
+        assert self.jobs.store.get('other')['status'] == 'failed'
+        with self.assertRaises(ValueError):
+            ExportJobs(os.path.join(self.directory, 'other'), heartbeat_interval=10, stale_after=10)
+
+    def test_heartbeat(self):
+        """Tests that the heartbeat of an unfinished job is recorded by its
+        process.
+
+        """
+        store = MemoryJobStore()
+        jobs = ExportJobs(os.path.join(self.directory, 'other'), store=store, heartbeat_interval=0.01,
+                          stale_after=0.02)
+        self.addCleanup(jobs.shutdown)
+        started = threading.Event()
+        release = threading.Event()
+
+        def lines():
+            started.set()
+            release.wait(5)
+            yield '{}\n'
+
+        job = jobs.submit('person', lines)
+        started.wait(5)
+        time.sleep(0.1)
+        assert jobs.get(job['id'])['status'] == 'running'
+        assert any('heartbeat' in update and 'status' not in update for update in store.updates)
+        release.set()
+        jobs.wait()
+        assert jobs.get(job['id'])['status'] == 'done'
+
+    def test_get_preprocessors(self):
+        """Tests that the ``GET_EXPORT_JOB`` preprocessors are called before
+        the state and the file of a job are served.
+
+        """
+
+        def forbidden(job_id):
+            raise ProcessingException(status=403, detail=f'Job {job_id} is private')
+
+        manager = APIManager(self.flaskapp, session=self.session, export_jobs=self.jobs, url_prefix='/api2')
+        manager.create_api(self.Person, allow_export_jobs=True, preprocessors={'GET_EXPORT_JOB': [forbidden]})
+        job_id = self.app.post('/api2/person/exports').json['data']['id']
+        self.jobs.wait()
+        assert self.app.get(f'/api2/person/exports/{job_id}').status_code == 403
+        assert self.app.get(f'/api2/person/exports/{job_id}/result').status_code == 403
+
+    def test_unknown_job(self):
+        """Tests that the jobs of other collections and the results of
+        unfinished jobs are not found.
+
+        """
+        job_id = self.app.post('/api/article/exports').json['data']['id']
+        self.jobs.wait()
+        assert self.app.get(f'/api/article/exports/{job_id}').status_code == 200
+        assert self.app.get(f'/api/person/exports/{job_id}').status_code == 404
+        assert self.app.get(f'/api/person/exports/{job_id}/result').status_code == 404
+        self.jobs.store.create({'id': 'pending', 'collection': 'person', 'status': 'pending', 'rows': 0})
+        response = self.app.get('/api/person/exports/pending/result')
+        assert response.status_code == 404
+
+    def test_bad_filters(self):
+        """Tests that invalid filters are reported when the job is
+        requested.
+
+        """
+        filters = [{'name': 'bogus', 'op': 'eq', 'val': 1}]
+        response = self.app.post(f'/api/person/exports?filter[objects]={dumps(filters)}')
+        assert response.status_code == 400
+
+    def test_single_dispatcher(self):
+        """Tests that the URLs of export jobs take precedence over the other
+        URLs of the collection with a single dispatcher.
+
+        """
+        manager = APIManager(self.flaskapp, session=self.session, export_jobs=self.jobs, single_dispatcher=True,
+                             url_prefix='/api2')
+        manager.create_api(self.Person, allow_export_jobs=True)
+        job_id = self.app.post('/api2/person/exports?fields[person]=name').json['data']['id']
+        self.jobs.wait()
+        assert self.app.get(f'/api2/person/exports/{job_id}').json['data']['attributes']['rows'] == 5
+        assert self.app.get(f'/api2/person/exports/{job_id}/result').status_code == 200
+
+    def test_requires_export_jobs(self):
+        """Tests that export jobs require the ``export_jobs`` argument of the
+        manager.
+
+        """
+        with self.assertRaises(IllegalArgumentError):
+            APIManager(self.flaskapp, session=self.session).create_api(self.Person, allow_export_jobs=True)
@@ -18,16 +18,38 @@ Flask-Restless meets the minimum requirements of the JSON API
 specification.
 
 """
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import Boolean
 from sqlalchemy import Column
+from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
 from sqlalchemy import Integer
 from sqlalchemy import Unicode
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import select
 from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
 
 from flask_restless import APIManager
+from flask_restless import IllegalArgumentError
 from flask_restless import ProcessingException
+from flask_restless.cache import ResponseCache
+from flask_restless.helpers import get_by
+from flask_restless.views.base import accept_error
+from flask_restless.views.base import sparse_fields_from
+from flask_restless.views.helpers import count
+from flask_restless.views.helpers import is_limited
+from flask_restless.views.helpers import is_private_database
+from flask_restless.views.helpers import order_by_clauses
+from flask_restless.views.helpers import statement_of
 
 from .helpers import FlaskSQLAlchemyTestBase
 from .helpers import ManagerTestBase
@@ -66,6 +88,33 @@ class TestFetchRelation(ManagerTestBase):
         assert response.status_code == 404
         # TODO Check error message here.
 
+    def test_non_decimal_id(self):
+        """Tests that an ID that Python, but not the database, would read as
+        an integer does not identify a resource.
+
+        """
+        self.session.add(self.Person(id=10))
+        self.session.commit()
+        for resource_id in ('1_0', '+10'):
+            response = self.app.get(f'/api/person/{resource_id}/articles')
+            expected = 200 if resource_id == '+10' else 404
+            assert response.status_code == expected, resource_id
+
+    def test_get_by_per_session(self):
+        """Tests that the instances remembered during a request belong to
+        the session in which they were looked up.
+
+        """
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        other = Session(bind=self.engine)
+        self.addCleanup(other.close)
+        with self.flaskapp.test_request_context():
+            first = get_by(self.session, self.Person, '1', 'id')
+            second = get_by(other, self.Person, '1', 'id')
+        assert first in self.session
+        assert second in other
+
     def test_nonexistent_relation(self):
         """Tests that a request for a nonexistent relation yields an error."""
         person = self.Person(id=1)
@@ -1102,6 +1151,813 @@ class TestAssociationProxy(ManagerTestBase):
         assert ['1'] == sorted(tag['id'] for tag in tags)
 
 
+class TestConditionalRequests(ManagerTestBase):
+    """Tests for responding with :http:status:`304` to conditional
+    requests.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            version = Column(Integer, nullable=False)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship('Person')
+            __mapper_args__ = {'version_id_col': version}
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.manager.create_api(Article, methods=['GET', 'PATCH'])
+        self.manager.create_api(Person, version_column='updated_at')
+
+        self.statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+    def test_resource_etag(self):
+        """Tests that a resource is not sent again if its version has not
+        changed, and that the version is checked without loading the
+        resource.
+
+        """
+        self.session.add(self.Article(id=1, title='foo'))
+        self.session.commit()
+        response = self.app.get('/api/article/1')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert etag.startswith('W/')
+        self.statements.clear()
+        response = self.app.get('/api/article/1', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+        assert len(self.statements) == 1
+        assert 'title' not in self.statements[0]
+        data = {'data': {'type': 'article', 'id': '1', 'attributes': {'title': 'bar'}}}
+        response = self.app.patch('/api/article/1', data=dumps(data))
+        assert response.status_code in (200, 204)
+        response = self.app.get('/api/article/1', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert response.json['data']['attributes']['title'] == 'bar'
+
+    def test_resource_last_modified(self):
+        """Tests that a resource is not sent again if it has not been
+        modified since the time given by the client.
+
+        """
+        self.session.add(self.Person(id=1, updated_at=datetime(2020, 1, 2, 3, 4, 5, 6)))
+        self.session.commit()
+        response = self.app.get('/api/person/1')
+        assert response.headers['Last-Modified'] == 'Thu, 02 Jan 2020 03:04:05 GMT'
+        headers = {'If-Modified-Since': 'Thu, 02 Jan 2020 03:04:05 GMT'}
+        response = self.app.get('/api/person/1', headers=headers)
+        assert response.status_code == 304
+        headers = {'If-Modified-Since': 'Thu, 02 Jan 2020 03:04:04 GMT'}
+        response = self.app.get('/api/person/1', headers=headers)
+        assert response.status_code == 200
+
+    def test_collection(self):
+        """Tests that a collection is not sent again unless a resource in
+        it is added, updated or deleted.
+
+        """
+        self.session.add_all([self.Article(id=1), self.Article(id=2)])
+        self.session.commit()
+        response = self.app.get('/api/article')
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        response = self.app.get('/api/article', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        # Updating an older resource changes the version of the collection.
+        data = {'data': {'type': 'article', 'id': '1', 'attributes': {'title': 'bar'}}}
+        self.app.patch('/api/article/1', data=dumps(data))
+        response = self.app.get('/api/article', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        self.session.add(self.Article(id=3))
+        self.session.commit()
+        response = self.app.get('/api/article', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+
+    def test_collection_query_parameters(self):
+        """Tests that the entity tag depends on the query parameters."""
+        self.session.add_all([self.Person(id=1), self.Person(id=2)])
+        self.session.commit()
+        response = self.app.get('/api/person?page[size]=1')
+        etag = response.headers['ETag']
+        response = self.app.get('/api/person?page[size]=1&page[number]=2', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_include(self):
+        """Tests that documents with included resources have no entity
+        tag, since they depend on the version of other resources.
+
+        """
+        self.session.add(self.Article(id=1))
+        self.session.commit()
+        response = self.app.get('/api/article/1?include=author')
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+        response = self.app.get('/api/article?include=author')
+        assert 'ETag' not in response.headers
+
+    def test_without_version_column(self):
+        """Tests that there are no entity tags if the model has no version
+        column.
+
+        """
+        self.manager.create_api(self.Person, url_prefix='/api2')
+        response = self.app.get('/api2/person')
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+
+    def to_many_models(self):
+        """Creates and returns a model with a version column and a to-many
+        relationship, and the model of the related resources.
+
+        """
+
+        class Shelf(self.Base):
+            __tablename__ = 'shelf'
+            id = Column(Integer, primary_key=True)
+            version = Column(Integer, nullable=False)
+            books = relationship('Book')
+            __mapper_args__ = {'version_id_col': version}
+
+        class Book(self.Base):
+            __tablename__ = 'book'
+            id = Column(Integer, primary_key=True)
+            shelf_id = Column(Integer, ForeignKey('shelf.id'))
+
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Shelf(id=1), Shelf(id=2), Book(id=1, shelf_id=1)])
+        self.session.commit()
+        return Shelf, Book
+
+    def test_to_many_without_cache(self):
+        """Tests that resources with to-many relationships have no entity
+        tag if no cache tracks the changes to their linkage.
+
+        """
+        Shelf, Book = self.to_many_models()
+        self.manager.create_api(Shelf, url_prefix='/api2')
+        self.manager.create_api(Book, url_prefix='/api2')
+        response = self.app.get('/api2/shelf/1')
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+        response = self.app.get('/api2/shelf')
+        assert 'ETag' not in response.headers
+
+    def test_to_many_linkage(self):
+        """Tests that a change to the linkage of a to-many relationship,
+        which does not change the version of the resource, changes its
+        entity tag.
+
+        """
+        Shelf, Book = self.to_many_models()
+        manager = APIManager(self.flaskapp, session=self.session, cache=ResponseCache())
+        manager.create_api(Shelf, url_prefix='/api2')
+        manager.create_api(Book, url_prefix='/api2')
+        etags = [self.app.get(url).headers['ETag'] for url in ('/api2/shelf/1', '/api2/shelf')]
+        for url, etag in zip(('/api2/shelf/1', '/api2/shelf'), etags):
+            response = self.app.get(url, headers={'If-None-Match': etag})
+            assert response.status_code == 304
+            assert 'Last-Modified' not in response.headers
+        book = self.session.get(Book, 1)
+        book.shelf_id = 2
+        self.session.commit()
+        for url, etag in zip(('/api2/shelf/1', '/api2/shelf'), etags):
+            response = self.app.get(url, headers={'If-None-Match': etag})
+            assert response.status_code == 200
+            assert response.headers['ETag'] != etag
+
+
+class TestRequestParsing(ManagerTestBase):
+    """Tests for caching the parsed query strings and headers of
+    requests.
+
+    """
+
+    def setUp(self):
+        super(TestRequestParsing, self).setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            age = Column(Integer)
+
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Person(id=1, name='foo', age=10), Person(id=2, name='bar', age=20)])
+        self.session.commit()
+        self.manager.create_api(Person)
+
+    def test_query_string_parsed_once(self):
+        """Tests that the sparse fieldsets of repeated query strings are
+        parsed once and shared between requests without being changed.
+
+        """
+        sparse_fields_from.cache_clear()
+        for _ in range(3):
+            response = self.app.get('/api/person?fields[person]=name&sort=-age')
+            people = response.json['data']
+            assert ['2', '1'] == [person['id'] for person in people]
+            assert all(['name'] == sorted(person['attributes']) for person in people)
+        info = sparse_fields_from.cache_info()
+        assert info.misses == 1
+        assert info.hits >= 2
+        assert sparse_fields_from(b'fields[person]=name&sort=-age') == {'person': {'name'}}
+
+    def test_cached_header_errors(self):
+        """Tests that cached checks of the :https:header:`Accept` header
+        still reject each unacceptable request.
+
+        """
+        headers = {'Accept': 'application/vnd.api+json; q=0.5; foo=bar'}
+        for _ in range(2):
+            response = self.app.get('/api/person', headers=headers)
+            assert response.status_code == 406
+        assert accept_error.cache_info().hits >= 1
+
+
+class TestConcurrentCount(ManagerTestBase):
+    """Tests for counting the resources of a collection concurrently with
+    loading the page, with the ``query_executor`` keyword argument to the
+    :class:`~flask_restless.APIManager` constructor.
+
+    """
+
+    def database_uri(self):
+        # Each connection to an in-memory SQLite database has a database
+        # of its own, so the count needs a database file.
+        return f'sqlite:///{self.path}'
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        super(TestConcurrentCount, self).setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Person(id=i) for i in range(1, 6)])
+        self.session.commit()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.manager = APIManager(self.flaskapp, session=self.session, query_executor=self.executor)
+        self.manager.create_api(Person)
+
+    def tearDown(self):
+        super(TestConcurrentCount, self).tearDown()
+        self.executor.shutdown()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_count_in_executor(self):
+        """Tests that the count query runs in the executor while the page
+        is loaded in the thread of the request.
+
+        """
+        threads = {}
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            kind = 'count' if 'count(' in statement else 'page'
+            threads[kind] = threading.get_ident()
+
+        response = self.app.get('/api/person?page[size]=2&page[number]=3')
+        assert response.status_code == 200
+        document = response.json
+        assert ['5'] == [person['id'] for person in document['data']]
+        assert document['meta']['total'] == 5
+        assert document['links']['prev'] is not None
+        assert threads['page'] == threading.get_ident()
+        assert threads['count'] != threading.get_ident()
+
+    def test_in_memory_database(self):
+        """Tests that a model bound to an in-memory SQLite database, which
+        the connection of the count can not see, is refused.
+
+        """
+        for uri in ('sqlite://', 'sqlite:///:memory:', 'sqlite:///file:test?mode=memory&uri=true'):
+            assert is_private_database(create_engine(uri))
+        for uri in (f'sqlite:///{self.path}', 'sqlite:///file:test?mode=memory&cache=shared&uri=true'):
+            assert not is_private_database(create_engine(uri))
+        session = Session(bind=create_engine('sqlite://'))
+        self.addCleanup(session.close)
+        manager = APIManager(self.flaskapp, session=session, query_executor=self.executor)
+        with self.assertRaises(IllegalArgumentError):
+            manager.create_api(self.Person, url_prefix='/api2')
+
+
+class TestDeferredJoin(ManagerTestBase):
+    """Tests for selecting pages of collections by primary key first, with
+    the ``deferred_join`` keyword argument to
+    :meth:`~flask_restless.APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super(TestDeferredJoin, self).setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref=backref('articles'))
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        names = ['d', 'a', 'e', 'c', 'b', 'f', 'g']
+        self.session.add_all([Person(id=i, name=name) for i, name in enumerate(names, start=1)])
+        self.session.add_all([Article(id=i, author_id=i) for i in range(1, 8)])
+        self.session.commit()
+        self.manager.create_api(Person, deferred_join=True)
+        self.manager.create_api(Article)
+        self.manager.create_api(Person, url_prefix='/api2')
+
+    def test_same_page(self):
+        """Tests that a deferred join returns the same page, in the same
+        order, as an offset over full rows.
+
+        """
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        url = '/person?sort=-name&include=articles&page[size]=2&page[number]=2'
+        response = self.app.get(f'/api{url}')
+        document = response.json
+        assert ['3', '1'] == [person['id'] for person in document['data']]
+        assert ['1', '3'] == sorted(article['id'] for article in document['included'])
+        # Only the primary keys are selected with an offset.
+        page = [statement for statement in statements if 'OFFSET' in statement]
+        assert len(page) == 1
+        assert 'person.name' not in page[0].split('FROM')[0]
+        expected = self.app.get(f'/api2{url}').json
+        assert expected['data'] == document['data']
+        assert expected['meta'] == document['meta']
+
+    def test_joined_sort(self):
+        """Tests that requests sorted by the attributes of related
+        resources, whose join may repeat the primary keys, are paginated
+        with an offset over full rows.
+
+        """
+        self.session.add_all([self.Article(id=8, author_id=1), self.Article(id=9, author_id=1)])
+        self.session.commit()
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        url = '/person?sort=-articles.id&page[size]=2&page[number]=1'
+        document = self.app.get(f'/api{url}').json
+        page = [statement for statement in statements if 'OFFSET' in statement]
+        assert len(page) == 1
+        assert 'person.name' in page[0].split('FROM')[0]
+        expected = self.app.get(f'/api2{url}').json
+        assert expected['data'] == document['data']
+
+    def test_past_last_page(self):
+        """Tests that a page past the last page is empty."""
+        response = self.app.get('/api/person?page[size]=2&page[number]=9')
+        assert response.status_code == 200
+        assert response.json['data'] == []
+
+
+class TestDatabaseRendering(ManagerTestBase):
+    """Tests for building resource objects in the database, with the
+    ``render_in_database`` keyword argument to
+    :meth:`~flask_restless.APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super(TestDatabaseRendering, self).setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            age = Column(Integer)
+            active = Column(Boolean)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            created_at = Column(DateTime)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person)
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([
+            Person(id=1, name='foo', age=23, active=True),
+            Person(id=2, name='b"ar', active=False),
+            Person(id=3),
+            Article(id=1, title='baz', author_id=1, created_at=datetime(2020, 1, 1)),
+            Article(id=2),
+        ])
+        self.session.commit()
+        self.manager.create_api(Person, render_in_database=True)
+        self.manager.create_api(Article, render_in_database=True, exclude=['created_at'])
+        self.manager.create_api(Person, url_prefix='/api2')
+        self.manager.create_api(Article, url_prefix='/api2', exclude=['created_at'])
+
+    def test_same_document(self):
+        """Tests that the documents built by the database are the same as
+        those serialized in Python.
+
+        """
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        for url in ('/person', '/article', '/person?fields[person]=name&sort=-id', '/article?page[size]=1&page[number]=2'):
+            statements.clear()
+            document = self.app.get(f'/api{url}').json
+            assert any('json_group_array' in statement for statement in statements)
+            expected = self.app.get(f'/api2{url}').json
+            assert expected['data'] == document['data']
+            assert expected['meta'] == document['meta']
+
+    def test_sorted_page(self):
+        """Tests that the resource objects are aggregated in the order of
+        the sort, by their position in the sorted rows, even when sorting
+        by a related resource, which the database does not do by itself.
+
+        """
+        self.session.add_all([self.Person(id=i, name=str(10 - i), age=i % 3) for i in range(4, 10)])
+        self.session.add_all([self.Article(id=i, title=str(i % 2), author_id=i) for i in range(3, 10)])
+        self.session.commit()
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        for url in ('/person?sort=age,-name', '/article?sort=author.name,-title&page[size]=4&page[number]=2'):
+            statements.clear()
+            document = self.app.get(f'/api{url}').json
+            page = [statement for statement in statements if 'json_group_array' in statement]
+            assert len(page) == 1
+            assert 'OVER (ORDER BY' in page[0]
+            expected = self.app.get(f'/api2{url}').json
+            assert [resource['id'] for resource in expected['data']] == [resource['id'] for resource in document['data']]
+            assert expected['data'] == document['data']
+
+    def test_fallback(self):
+        """Tests that resources the database cannot render, or requests
+        that include related resources, are serialized in Python.
+
+        """
+        self.manager.create_api(self.Article, url_prefix='/api3', render_in_database=True)
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        document = self.app.get('/api3/article').json
+        assert document['data'][0]['attributes']['created_at'] == '2020-01-01T00:00:00'
+        document = self.app.get('/api/article?include=author').json
+        assert ['1'] == [person['id'] for person in document['included']]
+        assert not any('json_group_array' in statement for statement in statements)
+
+
+class TestPartitions(ManagerTestBase):
+    """Tests for splitting collections into partitions by primary key, with
+    the ``allow_partitions`` keyword argument to
+    :meth:`~flask_restless.APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super(TestPartitions, self).setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref=backref('articles'))
+
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Person(id=i * 3, name=str(i)) for i in range(1, 21)])
+        self.session.add_all([Article(id=i, author_id=i * 3) for i in range(1, 21)])
+        self.session.commit()
+        self.manager.create_api(Person, allow_partitions=True, max_page_size=50)
+        self.manager.create_api(Article)
+
+    def fetch_partition(self, url):
+        """Follows the ``next`` links from `url` and returns the IDs of all
+        the resources.
+
+        """
+        ids = []
+        while url is not None:
+            response = self.app.get(url)
+            assert response.status_code == 200
+            ids.extend(int(person['id']) for person in response.json['data'])
+            url = response.json['links']['next']
+        return ids
+
+    def test_partitions(self):
+        """Tests that the partitions are disjoint, ordered by primary key
+        and together cover the filtered collection.
+
+        """
+        filters = dumps([{'name': 'id', 'op': 'gt', 'val': 6}])
+        partitions = [self.fetch_partition(f'/api/person?page[partition]={k}/4&page[size]=2&filter[objects]={filters}')
+                      for k in range(1, 5)]
+        assert [len(ids) for ids in partitions] == [5, 5, 4, 4]
+        ids = [id_ for partition in partitions for id_ in partition]
+        assert ids == list(range(9, 61, 3))
+
+    def test_keyset_pages(self):
+        """Tests that the pages of a partition are selected after the last
+        primary key of the previous page.
+
+        """
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        response = self.app.get('/api/person?page[partition]=2/2&page[size]=3&include=articles')
+        document = response.json
+        assert [person['id'] for person in document['data']] == ['33', '36', '39']
+        assert sorted(article['id'] for article in document['included']) == ['11', '12', '13']
+        assert document['meta']['partition'] == {'number': 2, 'count': 2}
+        assert 'page[after]=39' in document['links']['next']
+        assert 'rel="next"' in response.headers['Link']
+        response = self.app.get('/api/person?page[partition]=2/2&page[size]=3&page[after]=39')
+        assert [person['id'] for person in response.json['data']] == ['42', '45', '48']
+        # The second page starts after the primary key, not at an offset.
+        assert any('person.id > ?' in statement for statement in statements)
+
+    def test_boundaries_cached(self):
+        """Tests that the boundaries are computed once, so that writes do
+        not move them.
+
+        """
+        assert self.fetch_partition('/api/person?page[partition]=2/2&page[size]=0') == list(range(33, 61, 3))
+        self.session.add_all([self.Person(id=i, name='new') for i in (1, 2)])
+        self.session.commit()
+        assert self.fetch_partition('/api/person?page[partition]=1/2&page[size]=0') == [1, 2] + list(range(3, 31, 3))
+        assert self.fetch_partition('/api/person?page[partition]=2/2&page[size]=0') == list(range(33, 61, 3))
+
+    def test_string_primary_keys(self):
+        """Tests that the primary key in the ``next`` link is encoded, so
+        that string primary keys may contain reserved characters.
+
+        """
+
+        class Tag(self.Base):
+            __tablename__ = 'tag'
+            name = Column(Unicode, primary_key=True)
+
+        self.Base.metadata.create_all(bind=self.engine)
+        names = ['a&b', 'c d', 'e+f', 'g#h', 'i=j']
+        self.session.add_all([Tag(name=name) for name in names])
+        self.session.commit()
+        self.manager.create_api(Tag, allow_partitions=True)
+        ids = []
+        url = '/api/tag?page[partition]=1/1&page[size]=1'
+        while url is not None:
+            response = self.app.get(url)
+            assert response.status_code == 200
+            ids.extend(tag['id'] for tag in response.json['data'])
+            assert len(ids) <= len(names)
+            url = response.json['links']['next']
+        assert ids == names
+
+    def test_more_partitions_than_resources(self):
+        """Tests that partitions beyond the number of resources are
+        empty.
+
+        """
+        ids = [self.fetch_partition(f'/api/person?page[partition]={k}/30') for k in range(1, 31)]
+        assert [len(partition) for partition in ids] == [1] * 20 + [0] * 10
+
+    def test_bad_requests(self):
+        """Tests for invalid uses of partitions."""
+        for query in ('page[partition]=0/2', 'page[partition]=3/2', 'page[partition]=x',
+                      'page[partition]=1/2&sort=name', 'page[partition]=1/2&page[number]=2',
+                      'page[after]=3'):
+            check_sole_error(self.app.get(f'/api/person?{query}'), 400, [])
+        check_sole_error(self.app.get('/api/article?page[partition]=1/2'), 400, ['partitions'])
+
+
+class TestAggregation(ManagerTestBase):
+    """Tests for aggregates of collections, with the ``allow_aggregation``
+    keyword argument to :meth:`~flask_restless.APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super(TestAggregation, self).setUp()
+
+        class Order(self.Base):
+            __tablename__ = 'order'
+            id = Column(Integer, primary_key=True)
+            status = Column(Unicode)
+            total = Column(Integer)
+            created = Column(DateTime)
+            secret = Column(Integer)
+
+        self.Order = Order
+        self.Base.metadata.create_all(bind=self.engine)
+        statuses = ['new', 'paid', 'paid', 'new', 'shipped', 'paid']
+        self.session.add_all([Order(id=i, status=status, total=i * 10, created=datetime(2020, 1, i), secret=i)
+                              for i, status in enumerate(statuses, start=1)])
+        self.session.commit()
+        self.manager.create_api(Order, allow_aggregation=True, exclude=['secret'])
+
+    def test_aggregates(self):
+        """Tests that aggregates of the filtered collection are computed by
+        a single query and returned in the ``meta`` object.
+
+        """
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        filters = dumps([{'name': 'id', 'op': 'gt', 'val': 1}])
+        query = f'aggregate[count]=*&aggregate[sum]=total&aggregate[max]=total,created&filter[objects]={filters}'
+        response = self.app.get(f'/api/order?{query}')
+        assert response.status_code == 200
+        document = response.json
+        assert 'data' not in document
+        assert document['meta'] == {'aggregates': {
+            'count': {'*': 5},
+            'sum': {'total': 200},
+            'max': {'total': 60, 'created': '2020-01-06T00:00:00'},
+        }}
+        assert len(statements) == 1
+
+    def test_group_by(self):
+        """Tests that aggregates are grouped by the fields given in the
+        ``group_by`` query parameter, in order.
+
+        """
+        response = self.app.get('/api/order?aggregate[count]=*&aggregate[min]=total&group_by=status')
+        assert response.json['meta']['groups'] == [
+            {'group': {'status': 'new'}, 'aggregates': {'count': {'*': 2}, 'min': {'total': 10}}},
+            {'group': {'status': 'paid'}, 'aggregates': {'count': {'*': 3}, 'min': {'total': 20}}},
+            {'group': {'status': 'shipped'}, 'aggregates': {'count': {'*': 1}, 'min': {'total': 50}}},
+        ]
+
+    def test_bad_requests(self):
+        """Tests for invalid aggregates, including fields that the
+        serializer excludes.
+
+        """
+        for query in ('aggregate[avg]=total', 'aggregate[sum]=*', 'aggregate[sum]=status',
+                      'aggregate[max]=secret', 'aggregate[count]=*&group_by=secret', 'group_by=status'):
+            check_sole_error(self.app.get(f'/api/order?{query}'), 400, [])
+
+    def test_limited_query(self):
+        """Tests that aggregates of a model whose custom query is limited
+        only cover the rows selected by the limit.
+
+        """
+        session = self.session
+
+        def query(cls):
+            # Without assertions, the query accepts the filters of search()
+            # after its limit.
+            return session.query(cls).enable_assertions(False).order_by(cls.id.desc()).limit(3)
+
+        self.Order.query = classmethod(query)
+        response = self.app.get('/api/order?aggregate[count]=*&aggregate[sum]=total&group_by=status')
+        assert response.json['meta']['groups'] == [
+            {'group': {'status': 'new'}, 'aggregates': {'count': {'*': 1}, 'sum': {'total': 40}}},
+            {'group': {'status': 'paid'}, 'aggregates': {'count': {'*': 1}, 'sum': {'total': 60}}},
+            {'group': {'status': 'shipped'}, 'aggregates': {'count': {'*': 1}, 'sum': {'total': 50}}},
+        ]
+        response = self.app.get('/api/order?aggregate[count]=*&aggregate[min]=total')
+        assert response.json['meta']['aggregates'] == {'count': {'*': 3}, 'min': {'total': 40}}
+
+    def test_not_allowed(self):
+        """Tests that aggregates must be enabled for the collection."""
+        self.manager.create_api(self.Order, url_prefix='/api2')
+        check_sole_error(self.app.get('/api2/order?aggregate[count]=*'), 400, ['aggregates'])
+
+
+class TestStatementCache(ManagerTestBase):
+    """Tests that the statements executed for requests are found in the
+    compiled cache of SQLAlchemy once they have been compiled.
+
+    """
+
+    def setUp(self):
+        super(TestStatementCache, self).setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref=backref('articles'))
+
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Person(id=i, name=str(i)) for i in range(1, 5)])
+        self.session.add_all([Article(id=i, author_id=i % 2 + 1) for i in range(1, 5)])
+        self.session.commit()
+        self.manager.create_api(Person)
+        self.manager.create_api(Article)
+
+    def test_cache_hits(self):
+        """Tests that repeated requests, with different parameter values,
+        only execute cached statements.
+
+        """
+        misses = []
+
+        @event.listens_for(self.engine, 'after_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if context.cache_hit != context.cache_hit.CACHE_HIT:
+                misses.append(statement)
+
+        filters = '[{{"name": "id", "op": "gt", "val": {}}}]'
+        for value in (0, 1):
+            misses.clear()
+            assert self.app.get(f'/api/person?page[size]=2&filter[objects]={filters.format(value)}').status_code == 200
+            assert self.app.get(f'/api/person/{value + 1}/articles?page[size]=2').status_code == 200
+            assert self.app.get(f'/api/article?include=author&page[number]={value + 1}').status_code == 200
+        assert misses == []
+
+    def test_is_limited(self):
+        """Tests that :func:`is_limited` reads the ``LIMIT`` and ``OFFSET``
+        clauses of the statements of the supported versions of SQLAlchemy.
+
+        """
+        statement = select(self.Person)
+        assert not is_limited(statement)
+        assert is_limited(statement.limit(2))
+        assert is_limited(statement.offset(2))
+        assert count(self.session, statement.limit(2).offset(3)) == 1
+        assert count(self.session, statement.where(self.Person.id > 1)) == 3
+
+    def test_order_by_clauses(self):
+        """Tests that :func:`order_by_clauses` reads the ``ORDER BY``
+        clauses of the statements of the supported versions of SQLAlchemy.
+
+        """
+        statement = select(self.Person)
+        assert order_by_clauses(statement) == ()
+        clauses = order_by_clauses(statement.order_by(self.Person.name.desc(), self.Person.id))
+        assert [str(clause) for clause in clauses] == ['person.name DESC', 'person.id']
+        query = self.session.query(self.Person).order_by(self.Person.id)
+        assert [str(clause) for clause in order_by_clauses(statement_of(query))] == ['person.id']
+
+
 class TestFlaskSQLAlchemy(FlaskSQLAlchemyTestBase):
     """Tests for fetching resources defined as Flask-SQLAlchemy models
     instead of pure SQLAlchemy models.
@@ -0,0 +1,194 @@
+# test_ingest.py - unit tests for bulk loading resources
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for loading resources from newline-delimited JSON and CSV
+request bodies.
+
+"""
+from datetime import date
+
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import Date
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import event
+from sqlalchemy.orm import relationship
+
+from flask_restless import IllegalArgumentError
+
+from .helpers import ManagerTestBase
+from .helpers import dumps
+
+NDJSON = 'application/x-ndjson'
+
+
+def ndjson(*rows):
+    """Returns the newline-delimited JSON representation of `rows`."""
+    return '\n'.join(dumps(row) for row in rows) + '\n'
+
+
+class TestIngest(ManagerTestBase):
+    """Tests for the ``allow_ingest`` keyword argument to
+    :meth:`APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode, unique=True)
+            birthday = Column(Date)
+            active = Column(Boolean, default=True)
+            secret = Column(Unicode)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person)
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.manager.create_api(Person, exclude=['secret'], allow_ingest=True, ingest_chunk_size=2)
+        self.manager.create_api(Article, allow_ingest=True, allow_client_generated_ids=True)
+
+    def test_ndjson(self):
+        """Tests that each line of a newline-delimited JSON body is inserted
+        as a resource.
+
+        """
+        body = ndjson({'name': 'a', 'birthday': '1969-07-20'}, {'name': 'b'}, {'name': 'c', 'active': False})
+        response = self.app.post('/api/person/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 200
+        assert response.json['meta'] == {'inserted': 3, 'failed': 0, 'errors': []}
+        people = self.session.query(self.Person).order_by(self.Person.name).all()
+        assert [person.name for person in people] == ['a', 'b', 'c']
+        assert people[0].birthday == date(1969, 7, 20)
+        # Column defaults still apply to rows without a value.
+        assert [person.active for person in people] == [True, True, False]
+
+    def test_csv(self):
+        """Tests that each record of a CSV body is inserted as a resource,
+        with values converted to the type of the column.
+
+        """
+        body = 'name,birthday,active\na,1969-07-20,true\nb,,0\n'
+        response = self.app.post('/api/person/ingest', data=body, content_type='text/csv; charset=utf-8')
+        assert response.status_code == 200
+        assert response.json['meta']['inserted'] == 2
+        people = self.session.query(self.Person).order_by(self.Person.name).all()
+        assert people[0].birthday == date(1969, 7, 20)
+        assert people[0].active is True
+        assert people[1].birthday is None
+        assert people[1].active is False
+
+    def test_row_errors(self):
+        """Tests that rows that cannot be inserted are reported by row
+        number while the other rows are inserted.
+
+        """
+        body = '\n'.join([
+            dumps({'name': 'a'}),
+            'not json',
+            dumps({'secret': 'x'}),
+            dumps({'name': 'b', 'birthday': 'bogus'}),
+            dumps({'name': 'a'}),
+            dumps([1, 2]),
+            dumps({'name': 'c'}),
+        ])
+        response = self.app.post('/api/person/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 200
+        meta = response.json['meta']
+        assert meta['inserted'] == 2
+        assert meta['failed'] == 5
+        assert [error['row'] for error in meta['errors']] == [2, 3, 4, 5, 6]
+        assert 'secret' in meta['errors'][1]['detail']
+        assert 'UNIQUE' in meta['errors'][3]['detail']
+        assert sorted(person.name for person in self.session.query(self.Person)) == ['a', 'c']
+
+    def test_relationships_and_ids(self):
+        """Tests that to-one relationships are given by the ID of the
+        related resource, and that IDs are accepted if client generated
+        IDs are allowed.
+
+        """
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        body = ndjson({'id': 5, 'title': 'foo', 'author': 1})
+        response = self.app.post('/api/article/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 200
+        assert response.json['meta']['inserted'] == 1
+        article = self.session.get(self.Article, 5)
+        assert article.author_id == 1
+
+    def test_commit_per_request(self):
+        """Tests that the session is committed after each chunk by default,
+        and once at the end of the request if ``ingest_commit_per_chunk`` is
+        ``False``.
+
+        """
+        commits = []
+        event.listen(self.engine, 'commit', commits.append)
+        self.manager.create_api(self.Person, url_prefix='/api2', allow_ingest=True,
+                                ingest_chunk_size=1, ingest_commit_per_chunk=False)
+        body = ndjson({'name': 'a'}, {'name': 'b'})
+        response = self.app.post('/api2/person/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 200
+        assert response.json['meta']['inserted'] == 2
+        assert len(commits) == 1
+        commits.clear()
+        body = ndjson({'name': 'c'}, {'name': 'd'}, {'name': 'e'})
+        response = self.app.post('/api/person/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 200
+        # Two chunks of at most two rows, each committed separately.
+        assert len(commits) == 2
+        assert self.session.query(self.Person).count() == 5
+
+    def test_decoding_error(self):
+        """Tests that a body that cannot be decoded causes a
+        :http:status:`400` reporting the rows committed before the error.
+
+        """
+        self.manager.create_api(self.Person, url_prefix='/api2', allow_ingest=True, ingest_commit_per_chunk=False)
+        body = ndjson(*({'name': f'person{i}'} for i in range(1000))).encode() + b'\xff\n'
+        response = self.app.post('/api/person/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 400
+        meta = response.json['meta']
+        assert 0 < meta['inserted'] < 1000
+        assert meta['inserted'] == self.session.query(self.Person).count()
+        self.session.query(self.Person).delete()
+        self.session.commit()
+        response = self.app.post('/api2/person/ingest', data=body, content_type=NDJSON)
+        assert response.status_code == 400
+        assert response.json['meta']['inserted'] == 0
+        assert self.session.query(self.Person).count() == 0
+
+    def test_unsupported_media_type(self):
+        """Tests that a body that is neither NDJSON nor CSV causes a
+        :http:status:`415`.
+
+        """
+        response = self.app.post('/api/person/ingest', data='{}', content_type='application/json')
+        assert response.status_code == 415
+
+    def test_disabled(self):
+        """Tests that the ingest endpoint does not exist by default."""
+        self.manager.create_api(self.Person, url_prefix='/api2', methods=['GET', 'POST'])
+        response = self.app.post('/api2/person/ingest', data=ndjson({'name': 'a'}), content_type=NDJSON)
+        assert response.status_code == 405
+
+    def test_bad_chunk_size(self):
+        """Tests that a nonpositive chunk size is not allowed."""
+        with self.assertRaises(IllegalArgumentError):
+            self.manager.create_api(self.Person, url_prefix='/api2', allow_ingest=True, ingest_chunk_size=0)
@@ -10,16 +10,24 @@
 # License version 3 and under the 3-clause BSD license. For more
 # information, see LICENSE.AGPL and LICENSE.BSD.
 """Unit tests for the :mod:`flask_restless.manager` module."""
+import gc
+import weakref
+
 from flask import Flask
 from sqlalchemy import Column
 from sqlalchemy import ForeignKey
 from sqlalchemy import Integer
 from sqlalchemy import Unicode
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import MANYTOONE
+from sqlalchemy.orm import ONETOMANY
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
 
 from flask_restless import APIManager
 from flask_restless import IllegalArgumentError
+from flask_restless.helpers import model_info
+from flask_restless.views.base import cached_loader_options
 
 from .helpers import ManagerTestBase
 from .helpers import SQLAlchemyTestBase
@@ -374,3 +382,194 @@ class TestAPIManager(ManagerTestBase):
         """
         with self.assertRaises(AttributeError):
             self.manager.create_api(self.Person, additional_attributes=['bogus'])
+
+    def test_model_info(self):
+        """Tests that the metadata of a model describes its columns and
+        relationships in both directions.
+
+        """
+        self.manager.create_api(self.Article)
+        info = model_info(self.Article)
+        assert info.primary_keys == ('id', )
+        assert info.foreign_keys == ('author_id', )
+        assert isinstance(info.column_types['title'], Unicode)
+        assert info.relations['author'] == (False, MANYTOONE, self.Person)
+        assert model_info(self.Person).relations['articles'] == (True, ONETOMANY, self.Article)
+        assert info.has_field('title') and not info.has_field('bogus')
+
+    def test_model_info_not_evicted(self):
+        """Tests that the metadata of a model is kept however many models
+        there are.
+
+        """
+        models = [type(f'Model{i}', (self.Base,), {'__tablename__': f'model{i}', 'id': Column(Integer, primary_key=True)})
+                  for i in range(200)]
+        infos = [model_info(model) for model in models]
+        assert all(model_info(model) is info for model, info in zip(models, infos))
+
+    def test_model_info_unevaluable_hybrid(self):
+        """Tests that the metadata of a model is built even if the
+        expression of one of its hybrid properties cannot be evaluated on
+        the class, and that the error is raised when a value is converted
+        for it.
+
+        """
+
+        class Post(self.Base):
+            __tablename__ = 'post'
+            id = Column(Integer, primary_key=True)
+
+            @hybrid_property
+            def summary(self):
+                return self.body[:10]
+
+        info = model_info(Post)
+        assert info.converter('id') is None
+        with self.assertRaises(AttributeError):
+            info.convert('summary', 'foo')
+
+
+class TestSingleDispatcher(ManagerTestBase):
+    """Tests for the ``single_dispatcher`` keyword argument to the
+    :class:`flask_restless.APIManager` constructor.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref=backref('articles'))
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.manager = APIManager(self.flaskapp, session=self.session, single_dispatcher=True)
+
+    def test_fixed_rules(self):
+        """Tests that the number of URL rules does not grow with the
+        number of APIs.
+
+        """
+        self.manager.create_api(self.Person)
+        rules = len(list(self.flaskapp.url_map.iter_rules()))
+        self.manager.create_api(self.Article, methods=['GET', 'POST', 'PATCH'])
+        assert len(list(self.flaskapp.url_map.iter_rules())) == rules
+        assert len(self.manager.blueprints) == 1
+
+    def test_dispatch(self):
+        """Tests that requests are dispatched to the views of the requested
+        collection, honoring the allowed methods.
+
+        """
+        self.manager.create_api(self.Person)
+        self.manager.create_api(self.Article, methods=['GET', 'POST', 'PATCH'])
+        self.manager.create_api(self.Person, url_prefix='/api2', methods=['POST'])
+        person = self.Person(id=1)
+        article = self.Article(id=2, author=person)
+        self.session.add_all([person, article])
+        self.session.commit()
+        assert self.app.get('/api/person').json['data'][0]['id'] == '1'
+        assert self.app.get('/api/person/1/articles/2').json['data']['id'] == '2'
+        response = self.app.get('/api/article/2/relationships/author')
+        assert response.json['data'] == {'id': '1', 'type': 'person'}
+        assert self.app.post('/api/article', json={'data': {'type': 'article'}}).status_code == 201
+        # Methods that are not allowed for the API of the collection.
+        response = self.app.post('/api/person', json={'data': {'type': 'person'}})
+        assert response.status_code == 405
+        assert 'POST' not in response.headers['Allow']
+        assert self.app.get('/api2/person').status_code == 405
+        assert self.app.post('/api2/person', json={'data': {'type': 'person'}}).status_code == 201
+        assert self.app.get('/api/bogus').status_code == 404
+
+
+class TestLazyAPIs(ManagerTestBase):
+    """Tests for the ``lazy`` keyword argument to the
+    :class:`flask_restless.APIManager` constructor.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person, backref=backref('articles'))
+
+        self.Article = Article
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.manager = APIManager(self.flaskapp, session=self.session, lazy=True)
+
+    def test_built_on_first_request(self):
+        """Tests that an API is built on the first request for it, and the
+        APIs of related models when they are needed.
+
+        """
+        self.manager.create_api(self.Person)
+        self.manager.create_api(self.Article)
+        assert not self.manager.created_apis_for
+        self.session.add(self.Article(id=1, author=self.Person(id=1)))
+        self.session.commit()
+        response = self.app.get('/api/article/1?include=author')
+        assert response.status_code == 200
+        assert response.json['included'][0]['type'] == 'person'
+        assert set(self.manager.created_apis_for) == {self.Article, self.Person}
+
+    def test_warmup(self):
+        """Tests that :meth:`APIManager.warmup` builds all APIs, raising
+        the errors in their configuration.
+
+        """
+        self.manager.create_api(self.Person)
+        self.manager.create_api(self.Article)
+        self.manager.create_api(self.Article, url_prefix='/api2')
+        self.manager.warmup()
+        assert set(self.manager.created_apis_for) == {self.Article, self.Person}
+        assert self.manager.url_prefix_for(self.Article) == '/api2'
+        self.manager.create_api(self.Article, url_prefix='/api3', additional_attributes=['bogus'])
+        with self.assertRaises(AttributeError):
+            self.manager.warmup()
+
+    def test_warmup_freeze(self):
+        """Tests that :meth:`APIManager.warmup` computes the loader options
+        used by requests and can freeze the objects it built.
+
+        """
+        self.manager.create_api(self.Person)
+        self.manager.create_api(self.Article)
+        self.addCleanup(gc.unfreeze)
+        self.manager.warmup(freeze=True)
+        assert gc.get_freeze_count() > 0
+        misses = self.manager.loader_options.cache_info().misses
+        assert self.app.get('/api/article').status_code == 200
+        assert self.app.get('/api/person').status_code == 200
+        assert self.manager.loader_options.cache_info().misses == misses
+
+    def test_loader_options_freed(self):
+        """Tests that the loader options cached by a manager do not keep it
+        alive.
+
+        """
+        manager = APIManager(session=self.session)
+        manager.create_api(self.Person)
+        cached_loader_options(manager, self.Person, (), manager.created_apis_for[self.Person].serializer, False)
+        reference = weakref.ref(manager)
+        del manager
+        # The registry of APIs keeps the manager of the latest API for a model.
+        APIManager(session=self.session).create_api(self.Person)
+        gc.collect()
+        assert reference() is None
@@ -1,7 +1,12 @@
 import cProfile
+import multiprocessing
+import os
 import pstats
+import random
+import tempfile
 import time
 import unittest
+from functools import partial
 
 from flask import Flask
 from sqlalchemy import Column
@@ -10,6 +15,7 @@ from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import Unicode
 from sqlalchemy import create_engine
+from sqlalchemy import event
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
@@ -17,6 +23,9 @@ from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 
 from flask_restless import APIManager
+from flask_restless.cache import MemoryBackend
+from flask_restless.cache import MmapBackend
+from flask_restless.cache import ResponseCache
 
 Base = declarative_base()
 
@@ -88,3 +97,170 @@ class TestPerformance(unittest.TestCase):
         processing_time = time.time() - start_time
         print('Fetch time:', processing_time)
         assert response.status_code == 200
+
+
+def _fetch_with_cache(database, backend_factory, paths, queue):
+    """Fetches each of `paths` with a new application whose response
+    cache is stored in the backend returned by `backend_factory`, and
+    reports the number of ``SELECT`` statements and the elapsed time on
+    `queue`.
+
+    """
+    app = Flask(__name__)
+    engine = create_engine(database)
+    selects = []
+    event.listen(engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: selects.append(statement))
+    session = scoped_session(sessionmaker(bind=engine))
+    api_manager = APIManager(app=app, session=session, cache=ResponseCache(backend_factory()))
+    api_manager.create_api(Person, collection_name='people', cache_responses=True)
+    test_client = app.test_client()
+    start_time = time.time()
+    for path in paths:
+        assert test_client.get(path).status_code == 200
+    queue.put((len(selects), time.time() - start_time))
+
+
+@unittest.skip("Slow test, for manual run only")
+class TestSharedCachePerformance(unittest.TestCase):
+    """Compares a response cache private to each worker process with one
+    shared by all workers through a memory-mapped file.
+
+    """
+
+    processes = 8
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(directory, 'cache')
+        self.database = f'sqlite:///{os.path.join(directory, "test.db")}'
+        engine = create_engine(self.database)
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        session.bulk_save_objects([Person(id=i, name=f'Person {i}') for i in range(1, 10001)])
+        session.commit()
+        # Every worker requests the same pages, in a different order.
+        self.paths = [f'/api/people?page[number]={i}&page[size]=100' for i in range(1, 101)] * 5
+
+    def run_workers(self, backend_factory):
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = []
+        for number in range(self.processes):
+            paths = random.Random(number).sample(self.paths, len(self.paths))
+            worker = context.Process(target=_fetch_with_cache, args=(self.database, backend_factory, paths, queue))
+            worker.start()
+            workers.append(worker)
+        results = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        selects = sum(result[0] for result in results)
+        elapsed = max(result[1] for result in results)
+        return selects, elapsed
+
+    def test_shared_cache(self):
+        selects, elapsed = self.run_workers(MemoryBackend)
+        print(f'Private caches: {selects} SELECT statements, {elapsed:.2f}s')
+        selects, elapsed = self.run_workers(partial(MmapBackend, self.cache_path))
+        print(f'Shared cache:   {selects} SELECT statements, {elapsed:.2f}s')
+
+
+def _many_models(count):
+    """Returns a list of `count` new model classes, each with a few
+    columns and a relationship to the previous one.
+
+    """
+    base = declarative_base()
+    models = []
+    for i in range(count):
+        attributes = {
+            '__tablename__': f'model{i}',
+            'id': Column(Integer, primary_key=True),
+            'name': Column(Unicode),
+            'title': Column(String(16)),
+        }
+        if models:
+            attributes['parent_id'] = Column(Integer, ForeignKey(f'model{i - 1}.id'))
+            attributes['parent'] = relationship(models[-1], backref=backref('children'))
+        models.append(type(f'Model{i}', (base, ), attributes))
+    return models
+
+
+@unittest.skip("Slow test, for manual run only")
+class TestStartupPerformance(unittest.TestCase):
+    """Measures the time to create the APIs for many models, with and
+    without building them lazily.
+
+    """
+
+    models = 350
+
+    def create_apis(self, **kw):
+        models = _many_models(self.models)
+        app = Flask(__name__)
+        session = scoped_session(sessionmaker(bind=create_engine('sqlite://')))
+        start_time = time.time()
+        api_manager = APIManager(app=app, session=session, **kw)
+        for model in models:
+            api_manager.create_api(model, methods=['GET', 'POST', 'PATCH', 'DELETE'])
+        return api_manager, time.time() - start_time
+
+    def test_startup(self):
+        api_manager, elapsed = self.create_apis()
+        print(f'Eager:             {elapsed:.2f}s')
+        api_manager, elapsed = self.create_apis(lazy=True)
+        print(f'Lazy:              {elapsed:.2f}s')
+        start_time = time.time()
+        api_manager.warmup()
+        print(f'Lazy, then warmup: {elapsed + time.time() - start_time:.2f}s')
+        api_manager, elapsed = self.create_apis(lazy=True, single_dispatcher=True)
+        print(f'Lazy, dispatcher:  {elapsed:.2f}s')
+
+
+class WideRow(Base):
+    __tablename__ = 'wide_row'
+
+    id = Column(Integer, primary_key=True)
+    rank = Column(Integer, index=True)
+    body = Column(Unicode)
+    summary = Column(Unicode)
+    notes = Column(Unicode)
+
+
+@unittest.skip("Slow test, for manual run only")
+class TestDeferredJoinPerformance(unittest.TestCase):
+    """Measures the time to fetch a page of a collection of wide rows at
+    increasing offsets, with and without a deferred join.
+
+    """
+
+    rows = 100000
+
+    def setUp(self):
+        app = Flask(__name__)
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        session = scoped_session(sessionmaker(bind=self.engine))
+        Base.metadata.create_all(bind=self.engine)
+        text = 'x' * 1000
+        session.bulk_save_objects([WideRow(id=i, rank=random.randrange(self.rows), body=text, summary=text, notes=text)
+                                   for i in range(1, self.rows + 1)])
+        session.commit()
+        api_manager = APIManager(app=app, session=session)
+        api_manager.create_api(WideRow, collection_name='offset', max_page_size=100)
+        api_manager.create_api(WideRow, collection_name='deferred', max_page_size=100, deferred_join=True)
+        self.test_client = app.test_client()
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def test_offsets(self):
+        for page_number in (1, 100, 500, 999):
+            for collection_name in ('offset', 'deferred'):
+                url = f'/api/{collection_name}?sort=rank&page[size]=100&page[number]={page_number}'
+                start_time = time.time()
+                for _ in range(5):
+                    self.test_client.get(url)
+                elapsed = (time.time() - start_time) / 5
+                print(f'Page {page_number:4}, {collection_name:8}: {elapsed * 1000:.1f}ms')
@@ -0,0 +1,217 @@
+# test_returning.py - unit tests for single-statement writes
+#
+# Copyright 2012, 2013, 2014, 2015, 2016 Jeffrey Finkelstein
+#           <jeffrey.finkelstein@gmail.com> and contributors.
+#
+# This file is part of Flask-Restless.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for creating, updating and deleting resources with a single
+``INSERT ... RETURNING``, ``UPDATE ... RETURNING`` or ``DELETE``
+statement.
+
+"""
+from datetime import datetime
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import event
+from sqlalchemy.orm import relationship
+from sqlalchemy.orm import validates
+
+from .helpers import ManagerTestBase
+from .helpers import check_sole_error
+from .helpers import dumps
+
+
+class TestReturning(ManagerTestBase):
+    """Tests for the ``use_returning`` keyword argument to
+    :meth:`APIManager.create_api`.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            updated_at = Column(DateTime, onupdate=datetime.now)
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship(Person)
+            comments = relationship('Comment')
+
+        class Comment(self.Base):
+            __tablename__ = 'comment'
+            id = Column(Integer, primary_key=True)
+            article_id = Column(Integer, ForeignKey('article.id'))
+
+        class Tag(self.Base):
+            __tablename__ = 'tag'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+
+            @validates('name')
+            def validate_name(self, key, name):
+                return name.lower()
+
+        self.Article = Article
+        self.Comment = Comment
+        self.Person = Person
+        self.Tag = Tag
+        self.Base.metadata.create_all(bind=self.engine)
+        methods = ['GET', 'POST', 'PATCH', 'DELETE']
+        self.manager.create_api(Article, methods=methods, use_returning=True)
+        self.manager.create_api(Comment)
+        self.manager.create_api(Person, methods=methods, use_returning=True)
+        self.manager.create_api(Tag, methods=methods, use_returning=True)
+
+        self.statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, *args):
+            self.statements.append(statement)
+
+    def writes(self):
+        """Returns the statements recorded since the last call, ignoring
+        transaction control statements.
+
+        """
+        statements = [s for s in self.statements if s.split()[0] in ('SELECT', 'INSERT', 'UPDATE', 'DELETE')]
+        self.statements.clear()
+        return statements
+
+    def test_post(self):
+        """Tests that creating a resource uses a single ``INSERT ...
+        RETURNING`` statement.
+
+        """
+        data = {'data': {'type': 'person', 'attributes': {'name': 'foo'}}}
+        response = self.app.post('/api/person', data=dumps(data))
+        assert response.status_code == 201
+        document = response.json
+        assert document['data']['attributes']['name'] == 'foo'
+        assert response.headers['Location'].endswith(f'/api/person/{document["data"]["id"]}')
+        statements = self.writes()
+        assert len(statements) == 1
+        assert statements[0].startswith('INSERT')
+        assert 'RETURNING' in statements[0]
+        assert self.session.get(self.Person, int(document['data']['id'])).name == 'foo'
+
+    def test_post_with_relationship(self):
+        """Tests that creating a resource with relationships falls back to
+        flushing the session.
+
+        """
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        data = {
+            'data': {
+                'type': 'article',
+                'relationships': {'author': {'data': {'type': 'person', 'id': '1'}}}
+            }
+        }
+        response = self.app.post('/api/article', data=dumps(data))
+        assert response.status_code == 201
+        document = response.json
+        assert document['data']['relationships']['author']['data']['id'] == '1'
+
+    def test_patch(self):
+        """Tests that updating the attributes of a resource uses a single
+        ``UPDATE ... RETURNING`` statement.
+
+        """
+        self.session.add(self.Person(id=1, name='foo'))
+        self.session.commit()
+        self.writes()
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'bar'}}}
+        response = self.app.patch('/api/person/1', data=dumps(data))
+        # The `updated_at` column changes on update, so the resource is
+        # returned to the client.
+        assert response.status_code == 200
+        document = response.json
+        assert document['data']['attributes']['name'] == 'bar'
+        assert document['data']['attributes']['updated_at'] is not None
+        statements = self.writes()
+        assert len(statements) == 1
+        assert statements[0].startswith('UPDATE')
+        assert 'RETURNING' in statements[0]
+        assert self.session.get(self.Person, 1).name == 'bar'
+
+    def test_patch_nonexistent(self):
+        """Tests that updating a resource that does not exist causes a
+        :http:status:`404`.
+
+        """
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'bar'}}}
+        response = self.app.patch('/api/person/1', data=dumps(data))
+        check_sole_error(response, 404, ['No instance with ID 1'])
+
+    def test_patch_unknown_field(self):
+        """Tests that updating a field that does not exist causes a
+        :http:status:`400`, as it does without ``use_returning``.
+
+        """
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'bogus': 'bar'}}}
+        response = self.app.patch('/api/person/1', data=dumps(data))
+        check_sole_error(response, 400, ['does not have field', 'bogus'])
+
+    def test_validators(self):
+        """Tests that models with ORM validators are written through the
+        session, so that the validators are applied.
+
+        """
+        data = {'data': {'type': 'tag', 'attributes': {'name': 'FOO'}}}
+        response = self.app.post('/api/tag', data=dumps(data))
+        assert response.status_code == 201
+        assert response.json['data']['attributes']['name'] == 'foo'
+
+    def test_delete(self):
+        """Tests that deleting a resource without to-many relationships
+        uses a single ``DELETE`` statement.
+
+        """
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        self.writes()
+        response = self.app.delete('/api/person/1')
+        assert response.status_code == 204
+        statements = self.writes()
+        assert len(statements) == 1
+        assert statements[0].startswith('DELETE')
+        assert self.session.query(self.Person).count() == 0
+
+    def test_delete_nonexistent(self):
+        """Tests that deleting a resource that does not exist causes a
+        :http:status:`404`.
+
+        """
+        response = self.app.delete('/api/person/1')
+        check_sole_error(response, 404, ['No resource found with ID 1'])
+
+    def test_delete_with_to_many_relationship(self):
+        """Tests that deleting a resource with a to-many relationship
+        falls back to the session, so that the related rows are updated.
+
+        """
+        article = self.Article(id=1)
+        comment = self.Comment(id=1)
+        article.comments = [comment]
+        self.session.add_all([article, comment])
+        self.session.commit()
+        response = self.app.delete('/api/article/1')
+        assert response.status_code == 204
+        assert self.session.get(self.Comment, 1).article_id is None
@@ -0,0 +1,192 @@
+# test_snapshots.py - unit tests for snapshots of collections
+#
+# This file is part of Flask-Restless-NG.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for serving collections from precomputed snapshots."""
+import os
+import shutil
+import tempfile
+import time
+
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy import event
+from sqlalchemy import text
+from sqlalchemy.orm import relationship
+
+from flask_restless import APIManager
+from flask_restless import IllegalArgumentError
+from flask_restless.snapshots import SnapshotStore
+
+from .helpers import ManagerTestBase
+from .helpers import dumps
+
+
+class TestSnapshots(ManagerTestBase):
+    """Tests for the ``snapshots`` keyword argument to
+    :meth:`APIManager.create_api` and for
+    :class:`~flask_restless.snapshots.SnapshotStore`.
+
+    """
+
+    def database_uri(self):
+        # Snapshots are rendered on connections of their own, and each
+        # connection to an in-memory SQLite database has a database of its
+        # own.
+        return f'sqlite:///{os.path.join(self.directory, "test.sqlite")}'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super().setUp()
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            active = Column(Boolean)
+            articles = relationship('Article')
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('person.id'))
+
+        self.Person = Person
+        self.Base.metadata.create_all(bind=self.engine)
+        self.session.add_all([Person(id=i, name=f'person{i}', active=i % 2 == 0) for i in range(1, 16)])
+        self.session.add_all([Article(id=i, author_id=i) for i in range(1, 4)])
+        self.session.commit()
+        self.store = SnapshotStore(os.path.join(self.directory, 'snapshots'), interval=60)
+        self.manager = APIManager(self.flaskapp, session=self.session, snapshot_store=self.store)
+        active = [{'name': 'active', 'op': 'eq', 'val': True}]
+        self.manager.create_api(Person, methods=['GET', 'POST'], snapshots={'latest': [], 'active': active})
+        self.manager.create_api(Article)
+
+    def tearDown(self):
+        super().tearDown()
+        self.store.shutdown()
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_snapshot(self):
+        """Tests that a snapshot holds the whole collection, regardless of
+        the page size.
+
+        """
+        response = self.app.get('/api/person?snapshot=latest')
+        assert response.status_code == 200
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        document = response.json
+        assert document['meta']['total'] == 15
+        expected = self.app.get('/api/person?page[size]=0').json['data']
+        assert document['data'] == expected
+        response = self.app.get('/api/person?snapshot=active')
+        assert [person['id'] for person in response.json['data']] == [str(i) for i in range(2, 16, 2)]
+
+    def test_served_from_file(self):
+        """Tests that a valid snapshot is served without querying the
+        database.
+
+        """
+        body = self.app.get('/api/person?snapshot=latest').get_data()
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        assert self.app.get('/api/person?snapshot=latest').get_data() == body
+        event.remove(self.engine, 'before_cursor_execute', record)
+        assert statements == []
+        assert len(os.listdir(self.store.directory)) == 1
+
+    def test_relationships_loaded_per_batch(self):
+        """Tests that the to-many relationships of the resources in a
+        snapshot are loaded with one query per batch, not one per resource.
+
+        """
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        response = self.app.get('/api/person?snapshot=latest')
+        event.remove(self.engine, 'before_cursor_execute', record)
+        articles = [person['relationships']['articles']['data'] for person in response.json['data']]
+        assert articles[:4] == [[{'type': 'article', 'id': str(i)}] for i in range(1, 4)] + [[]]
+        assert len([statement for statement in statements if 'FROM article' in statement]) == 1
+
+    def test_conditional_and_range(self):
+        """Tests for conditional and range requests for a snapshot."""
+        response = self.app.get('/api/person?snapshot=latest')
+        body = response.get_data()
+        etag = response.headers['ETag']
+        response = self.app.get('/api/person?snapshot=latest', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        response = self.app.get('/api/person?snapshot=latest', headers={'Range': 'bytes=10-19'})
+        assert response.status_code == 206
+        assert response.get_data() == body[10:20]
+        assert response.headers['Content-Range'] == f'bytes 10-19/{len(body)}'
+
+    def test_invalidated_by_write(self):
+        """Tests that a snapshot is rendered again in the background after a
+        tracked session commits changes to the collection, while the
+        previous snapshot is served.
+
+        """
+        etag = self.app.get('/api/person?snapshot=latest').headers['ETag']
+        data = {'data': {'type': 'person', 'attributes': {'name': 'foo'}}}
+        assert self.app.post('/api/person', data=dumps(data)).status_code == 201
+        response = self.app.get('/api/person?snapshot=latest')
+        assert response.json['meta']['total'] == 15
+        assert response.headers['ETag'] == etag
+        self.store.executor.submit(lambda: None).result()
+        response = self.app.get('/api/person?snapshot=latest')
+        assert response.json['meta']['total'] == 16
+        assert response.headers['ETag'] != etag
+
+    def test_refreshed_in_background(self):
+        """Tests that a snapshot older than the refresh interval is served
+        while it is rendered again in the background.
+
+        """
+        self.store.interval = 0.01
+        self.app.get('/api/person?snapshot=latest')
+        # A change that the snapshot store cannot see.
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO person (id, name) VALUES (100, 'foo')"))
+        time.sleep(0.02)
+        assert self.app.get('/api/person?snapshot=latest').json['meta']['total'] == 15
+        # The refresher runs one snapshot at a time, in order.
+        self.store.executor.submit(lambda: None).result()
+        assert self.app.get('/api/person?snapshot=latest').json['meta']['total'] == 16
+
+    def test_not_used(self):
+        """Tests that an unknown snapshot causes a :http:status:`400`, and
+        that a snapshot is not used for requests with filters or sparse
+        fieldsets.
+
+        """
+        assert self.app.get('/api/person?snapshot=bogus').status_code == 400
+        filters = [{'name': 'id', 'op': 'lt', 'val': 3}]
+        response = self.app.get(f'/api/person?snapshot=latest&filter[objects]={dumps(filters)}')
+        assert [person['id'] for person in response.json['data']] == ['1', '2']
+        response = self.app.get('/api/person?snapshot=latest&fields[person]=name')
+        assert all(list(person['attributes']) == ['name'] for person in response.json['data'])
+        assert os.listdir(self.store.directory) == []
+
+    def test_requires_snapshot_store(self):
+        """Tests that snapshots require the ``snapshot_store`` argument of
+        the manager.
+
+        """
+        manager = APIManager(self.flaskapp, session=self.session)
+        with self.assertRaises(IllegalArgumentError):
+            manager.create_api(self.Person, url_prefix='/api2', snapshots={'latest': []})
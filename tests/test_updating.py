@@ -20,7 +20,9 @@ specification.
 """
 from __future__ import division
 
+from datetime import date
 from datetime import datetime
+from datetime import time
 
 from sqlalchemy import Column
 from sqlalchemy import Date
@@ -240,6 +242,31 @@ class TestUpdating(ManagerTestBase):
         assert response.status_code == 204
         assert person.birth_datetime == now
 
+    def test_deserializing_non_iso_datetime(self):
+        """Test for deserializing date and time fields given in a format
+        other than ISO 8601.
+
+        """
+        person = self.Person(id=1)
+        self.session.add(person)
+        self.session.commit()
+        data = {
+            'data': {
+                'type': 'person',
+                'id': '1',
+                'attributes': {
+                    'bedtime': '2nd Jan 1900 14:35',
+                    'date_created': '2nd Jan 1900 14:35',
+                    'birth_datetime': '2nd Jan 1900 14:35'
+                }
+            }
+        }
+        response = self.app.patch('/api/person/1', data=dumps(data))
+        assert response.status_code == 204
+        assert person.bedtime == time(14, 35)
+        assert person.date_created == date(1900, 1, 2)
+        assert person.birth_datetime == datetime(1900, 1, 2, 14, 35)
+
     def test_correct_content_type(self):
         """Tests that the server responds with :http:status:`201` if the
         request has the correct JSON API content type.
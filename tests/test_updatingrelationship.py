@@ -20,6 +20,7 @@ specification.
 from sqlalchemy import Column
 from sqlalchemy import ForeignKey
 from sqlalchemy import Integer
+from sqlalchemy import event
 from sqlalchemy.orm import backref
 from sqlalchemy.orm import relationship
 
@@ -159,6 +160,30 @@ class TestAdding(ManagerTestBase):
         assert response.status_code == 404
         # TODO check error message here
 
+    def test_linkage_fetched_once(self):
+        """Tests that a resource identified more than once in a request is
+        fetched from the database only once.
+
+        """
+        person = self.Person(id=1)
+        article = self.Article(id=1)
+        self.session.add_all([article, person])
+        self.session.commit()
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT') and 'WHERE article.id' in statement:
+                statements.append(statement)
+
+        data = dict(data=[dict(id='1', type='article'), dict(id=1, type='article')])
+        response = self.app.post('/api/person/1/relationships/articles',
+                                 json=data)
+        event.remove(self.engine, 'before_cursor_execute', record)
+        assert response.status_code == 204
+        assert len(statements) == 1
+        assert [article.id for article in person.articles] == [1]
+
     def test_empty_request(self):
         """Test that attempting to POST to a relationship URL with no data
         yields an error.
@@ -0,0 +1,254 @@
+# test_upserting.py - unit tests for upserting resources
+#
+# Copyright 2012, 2013, 2014, 2015, 2016 Jeffrey Finkelstein
+#           <jeffrey.finkelstein@gmail.com> and contributors.
+#
+# This file is part of Flask-Restless.
+#
+# Flask-Restless is distributed under both the GNU Affero General Public
+# License version 3 and under the 3-clause BSD license. For more
+# information, see LICENSE.AGPL and LICENSE.BSD.
+"""Unit tests for creating or updating resources in a single request via
+the :http:method:`put` method.
+
+"""
+from sqlalchemy import Column
+from sqlalchemy import ForeignKey
+from sqlalchemy import Integer
+from sqlalchemy import Unicode
+from sqlalchemy.orm import backref
+from sqlalchemy.orm import relationship
+
+from .helpers import ManagerTestBase
+from .helpers import check_sole_error
+from .helpers import dumps
+
+
+class TestUpserting(ManagerTestBase):
+    """Tests for upserting resources."""
+
+    def setUp(self):
+        super().setUp()
+
+        class Article(self.Base):
+            __tablename__ = 'article'
+            id = Column(Integer, primary_key=True)
+            title = Column(Unicode)
+            author_id = Column(Integer, ForeignKey('person.id'))
+            author = relationship('Person', backref=backref('articles'))
+
+        class Person(self.Base):
+            __tablename__ = 'person'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode)
+            age = Column(Integer)
+
+        class Tag(self.Base):
+            __tablename__ = 'tag'
+            id = Column(Integer, primary_key=True)
+            name = Column(Unicode, unique=True, nullable=False)
+            count = Column(Integer)
+
+        self.Article = Article
+        self.Person = Person
+        self.Tag = Tag
+        self.Base.metadata.create_all(bind=self.engine)
+        self.manager.create_api(Article, methods=['PUT'], allow_client_generated_ids=True)
+        self.manager.create_api(Person, methods=['GET', 'PUT'], allow_client_generated_ids=True)
+        self.manager.create_api(Tag, methods=['PUT'], allow_client_generated_ids=True, upsert_columns=['name'])
+
+    def test_create(self):
+        """Tests that a :http:method:`put` request for a resource that
+        does not exist creates it.
+
+        """
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'foo'}}}
+        response = self.app.put('/api/person/1', data=dumps(data))
+        assert response.status_code == 201
+        assert response.headers['Location'].endswith('/api/person/1')
+        document = response.json
+        person = document['data']
+        assert person['id'] == '1'
+        assert person['attributes']['name'] == 'foo'
+        assert self.session.get(self.Person, 1).name == 'foo'
+
+    def test_update(self):
+        """Tests that a :http:method:`put` request for an existing
+        resource updates the attributes given in the request and leaves
+        the others untouched.
+
+        """
+        person = self.Person(id=1, name='foo', age=10)
+        self.session.add(person)
+        self.session.commit()
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'bar'}}}
+        response = self.app.put('/api/person/1', data=dumps(data))
+        assert response.status_code == 200
+        document = response.json
+        assert document['data']['attributes'] == {'name': 'bar', 'age': 10}
+        assert self.session.query(self.Person).count() == 1
+
+    def test_idempotent(self):
+        """Tests that repeating the same :http:method:`put` request
+        yields the same resource.
+
+        """
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'foo'}}}
+        first = self.app.put('/api/person/1', data=dumps(data))
+        second = self.app.put('/api/person/1', data=dumps(data))
+        assert first.status_code == 201
+        assert second.status_code == 200
+        assert first.json['data'] == second.json['data']
+        assert self.session.query(self.Person).count() == 1
+
+    def test_to_one_relationship(self):
+        """Tests that a :http:method:`put` request can set a to-one
+        relationship.
+
+        """
+        self.session.add(self.Person(id=1))
+        self.session.commit()
+        data = {
+            'data': {
+                'type': 'article',
+                'id': '1',
+                'relationships': {'author': {'data': {'type': 'person', 'id': '1'}}}
+            }
+        }
+        response = self.app.put('/api/article/1', data=dumps(data))
+        assert response.status_code == 201
+        document = response.json
+        author = document['data']['relationships']['author']['data']
+        assert author == {'type': 'person', 'id': '1'}
+        assert self.session.get(self.Article, 1).author_id == 1
+
+    def test_to_many_relationship(self):
+        """Tests that a :http:method:`put` request with a to-many
+        relationship causes an error.
+
+        """
+        data = {
+            'data': {
+                'type': 'person',
+                'id': '1',
+                'relationships': {'articles': {'data': []}}
+            }
+        }
+        response = self.app.put('/api/person/1', data=dumps(data))
+        check_sole_error(response, 400, ['cannot upsert', 'articles'])
+
+    def test_missing_id(self):
+        """Tests that a :http:method:`put` request without an ID in the
+        document causes an error.
+
+        """
+        data = {'data': {'type': 'person', 'attributes': {'name': 'foo'}}}
+        response = self.app.put('/api/person/1', data=dumps(data))
+        check_sole_error(response, 400, ['Must specify', 'ID'])
+
+    def test_conflicting_id(self):
+        """Tests that a :http:method:`put` request with an ID in the
+        document that does not match the URL causes an error.
+
+        """
+        data = {'data': {'type': 'person', 'id': '2', 'attributes': {'name': 'foo'}}}
+        response = self.app.put('/api/person/1', data=dumps(data))
+        check_sole_error(response, 409, ['ID must be 1', 'not 2'])
+
+    def test_conflicting_type(self):
+        """Tests that a :http:method:`put` request with the wrong type
+        causes an error.
+
+        """
+        data = {'data': {'type': 'article', 'id': '1'}}
+        response = self.app.put('/api/person/1', data=dumps(data))
+        assert response.status_code == 409
+
+    def test_client_generated_ids_not_allowed(self):
+        """Tests that :http:method:`put` requests are forbidden unless
+        client generated IDs are allowed.
+
+        """
+        self.manager.create_api(self.Person, methods=['PUT'], url_prefix='/api2')
+        data = {'data': {'type': 'person', 'id': '1'}}
+        response = self.app.put('/api2/person/1', data=dumps(data))
+        assert response.status_code == 403
+
+    def test_upsert_columns(self):
+        """Tests that ``upsert_columns`` determines which row is
+        updated on conflict.
+
+        """
+        self.session.add(self.Tag(id=1, name='foo', count=1))
+        self.session.commit()
+        data = {'data': {'type': 'tag', 'id': '1', 'attributes': {'name': 'foo', 'count': 2}}}
+        response = self.app.put('/api/tag/1', data=dumps(data))
+        assert response.status_code == 200
+        assert response.json['data']['attributes']['count'] == 2
+        data = {'data': {'type': 'tag', 'id': '2', 'attributes': {'name': 'bar', 'count': 3}}}
+        response = self.app.put('/api/tag/2', data=dumps(data))
+        assert response.status_code == 201
+        assert self.session.query(self.Tag).count() == 2
+
+    def test_upsert_columns_other_id(self):
+        """Tests that a :http:method:`put` request whose upsert columns
+        match a resource with another ID causes an error instead of
+        updating that resource.
+
+        """
+        self.session.add(self.Tag(id=1, name='foo', count=1))
+        self.session.commit()
+        data = {'data': {'type': 'tag', 'id': '2', 'attributes': {'name': 'foo', 'count': 2}}}
+        response = self.app.put('/api/tag/2', data=dumps(data))
+        check_sole_error(response, 409, ['name', 'ID 1'])
+        self.session.expire_all()
+        assert self.session.get(self.Tag, 1).count == 1
+        assert self.session.query(self.Tag).count() == 1
+
+    def test_upsert_columns_rename(self):
+        """Tests that a :http:method:`put` request changes the upsert
+        columns of an existing resource with the same ID.
+
+        """
+        self.session.add(self.Tag(id=1, name='foo', count=1))
+        self.session.commit()
+        data = {'data': {'type': 'tag', 'id': '1', 'attributes': {'name': 'baz', 'count': 2}}}
+        response = self.app.put('/api/tag/1', data=dumps(data))
+        assert response.status_code == 200
+        assert response.json['data']['attributes'] == {'name': 'baz', 'count': 2}
+        self.session.expire_all()
+        assert self.session.query(self.Tag).count() == 1
+        assert self.session.get(self.Tag, 1).name == 'baz'
+
+    def test_processors(self):
+        """Tests that the ``PUT_RESOURCE`` pre- and postprocessors are
+        applied.
+
+        """
+
+        def set_name(data=None, **kw):
+            data['data']['attributes'] = {'name': 'bar'}
+
+        def add_meta(result=None, **kw):
+            result['meta'] = {'upserted': True}
+
+        self.manager.create_api(self.Person, methods=['PUT'], url_prefix='/api2',
+                                allow_client_generated_ids=True,
+                                preprocessors={'PUT_RESOURCE': [set_name]},
+                                postprocessors={'PUT_RESOURCE': [add_meta]})
+        data = {'data': {'type': 'person', 'id': '1', 'attributes': {'name': 'foo'}}}
+        response = self.app.put('/api2/person/1', data=dumps(data))
+        assert response.status_code == 201
+        document = response.json
+        assert document['data']['attributes']['name'] == 'bar'
+        assert document['meta'] == {'upserted': True}
+
+    def test_method_not_allowed(self):
+        """Tests that :http:method:`put` is not allowed unless requested
+        in ``methods``.
+
+        """
+        self.manager.create_api(self.Person, url_prefix='/api2')
+        data = {'data': {'type': 'person', 'id': '1'}}
+        response = self.app.put('/api2/person/1', data=dumps(data))
+        assert response.status_code == 405